@@ -3,14 +3,16 @@ import numpy as np
 import matplotlib.pyplot as plt
 from itertools import product
 from spring_model import bounce_prob
+from quantization import SIZE_ROUNDING_SLACK, floor_to_step
 
 # --- Constants ---
 INITIAL_EQUITY = 1000.0
 RISK_PER_TRADE_PCT = 0.01
 FIXED_RR_RATIO = 1.5
 PROB_THRESHOLD = 0.5
+BTC_AMOUNT_STEP = 0.001  # Bybit BTCUSDT qtyStep; btc_1m.csv is BTC data
 
-def run_backtest(price_df, signals_df, bb_window, bb_std_dev):
+def run_backtest(price_df, signals_df, bb_window, bb_std_dev, amount_step):
     equity = INITIAL_EQUITY
     equity_curve = [INITIAL_EQUITY]
     trades = []
@@ -30,7 +32,9 @@ def run_backtest(price_df, signals_df, bb_window, bb_std_dev):
         risk_per_trade_usd = equity * RISK_PER_TRADE_PCT
         stop_loss_dist = abs(signal['entry'] - signal['sl'])
         if stop_loss_dist == 0: continue
-        position_size = risk_per_trade_usd / stop_loss_dist
+        # Same rounding as the live bot: floor to the exchange amount step
+        position_size = floor_to_step(risk_per_trade_usd / stop_loss_dist * (1 + SIZE_ROUNDING_SLACK), amount_step)
+        if position_size <= 0: continue
 
         # 3. Determine TP based on fixed R:R
         take_profit_dist = stop_loss_dist * FIXED_RR_RATIO
@@ -113,7 +117,7 @@ if __name__ == '__main__':
 
     print("Running backtest grid search...")
     for window, mult in product(bb_windows, bb_multipliers):
-        equity_curve, trades = run_backtest(price_df, signals_df, window, mult)
+        equity_curve, trades = run_backtest(price_df, signals_df, window, mult, BTC_AMOUNT_STEP)
         if len(equity_curve) > 1:
             total_r, max_dd, sharpe = calculate_metrics(equity_curve, num_days)
             results.append(((window, mult), total_r, max_dd, sharpe, len(trades)))
@@ -130,7 +134,7 @@ if __name__ == '__main__':
     if sorted_results:
         best_params = sorted_results[0][0]
         print(f"\nPlotting equity curve for best params: {best_params}")
-        best_equity_curve, _ = run_backtest(price_df, signals_df, best_params[0], best_params[1])
+        best_equity_curve, _ = run_backtest(price_df, signals_df, best_params[0], best_params[1], BTC_AMOUNT_STEP)
         plt.figure(figsize=(12, 6))
         plt.plot(best_equity_curve)
         plt.title(f'Equity Curve - Best Params: {best_params} (Sharpe: {sorted_results[0][3]:.2f})')
@@ -0,0 +1,106 @@
+# file: benchmarks/bench_paper_exchange.py
+"""
+Нагрузочный прогон менеджера позиций на бумажной бирже (paper_exchange.PaperExchange):
+сетки входа, активации, TP/SL и закрытия по воспроизводимой ленте цен - без сети и моков.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_paper_exchange [--trades 1000] [--steps 300] [--mode ladder] [--latency-ms 0]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+# БД выбирается по env-переменной на каждый вызов get_db_connection()
+os.environ["DATABASE_FILE"] = os.path.join(tempfile.mkdtemp(), "bench_paper.sqlite")
+
+from db_setup import setup_database
+from db_utils import create_managed_trade, get_db_connection
+import position_manager
+from paper_exchange import PaperExchange, PriceFeed
+from trade_logger import start_log_writer, stop_log_writer
+from trade_store import TradeStore
+
+
+def make_instruction(i: int, symbol: str) -> dict:
+    long = i % 2 == 0
+    return {
+        'signal_id': f"bench-{i}", 'symbol': symbol, 'side': 'long' if long else 'short',
+        'entry_start': 98.0 if long else 101.0, 'entry_end': 99.5 if long else 102.5,
+        'stop_loss': 96.0 if long else 104.5, 'take_profits': [102.0, 104.0] if long else [98.0, 96.0],
+        'move_sl_to_be_after_tp_index': 1, 'grid_orders': 3,
+    }
+
+
+async def run(n_trades: int, steps: int, latency_ms: float, seed: int) -> dict:
+    symbols = [f"PAPER{i:05d}USDT" for i in range(n_trades)]
+    exchange = PaperExchange(balance=1_000_000.0, latency_ms=latency_ms, seed=seed)
+    for symbol in symbols:
+        exchange.set_price(symbol, 100.0)
+
+    store = TradeStore()
+    setup_start = time.perf_counter()
+    for i, symbol in enumerate(symbols):
+        instruction = make_instruction(i, symbol)
+        trade_id = create_managed_trade(instruction, 1.0)
+        store.load_trade(trade_id)
+        await position_manager.place_entry_grid(trade_id, 1.0, instruction, exchange, store)
+    store.loaded = True
+    setup_elapsed = time.perf_counter() - setup_start
+
+    feed = PriceFeed.random_walk({s: 100.0 for s in symbols}, steps=steps, sigma=0.004, seed=seed)
+    ticks_per_step = len(symbols)
+    reconciled = 0
+    cycles = 0
+    cycle_start = time.perf_counter()
+    for step in range(steps):
+        for ts, symbol, price in feed.ticks[step * ticks_per_step:(step + 1) * ticks_per_step]:
+            exchange.set_price(symbol, price, ts)
+        cycle = await position_manager.run_manager_cycle(exchange, store)
+        if not cycle:
+            break
+        reconciled += cycle['trades']
+        cycles += 1
+    cycle_elapsed = time.perf_counter() - cycle_start
+
+    conn = get_db_connection()
+    statuses = dict(conn.execute("SELECT status, COUNT(*) FROM managed_trades GROUP BY status").fetchall())
+    reasons = dict(conn.execute("SELECT close_reason, COUNT(*) FROM managed_trades WHERE status = 'CLOSED' GROUP BY close_reason").fetchall())
+    conn.close()
+    return {
+        "setup_s": setup_elapsed, "cycles": cycles, "cycle_s": cycle_elapsed, "reconciled": reconciled,
+        "statuses": statuses, "reasons": reasons, "fills": len(exchange.trades), "calls": exchange.calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trades", type=int, default=1000)
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument("--mode", choices=("ladder", "reactive"), default="ladder")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    position_manager.TP_PLACEMENT_MODE = args.mode
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        setup_database()
+        start_log_writer(echo=False)
+        result = asyncio.run(run(args.trades, args.steps, args.latency_ms, args.seed))
+        stop_log_writer()
+
+    print(f"trades: {args.trades}  steps: {args.steps}  mode: {args.mode}  latency: {args.latency_ms} ms")
+    print(f"setup (create + entry grid): {result['setup_s']:.2f} s  ({args.trades / result['setup_s']:,.0f} trades/s)")
+    print(f"manager cycles             : {result['cycles']} in {result['cycle_s']:.2f} s "
+          f"({result['cycle_s'] * 1000 / max(result['cycles'], 1):.1f} ms/cycle)")
+    print(f"reconciles                 : {result['reconciled']:,}  ({result['reconciled'] / result['cycle_s']:,.0f} trade reconciles/s)")
+    print(f"final statuses             : {result['statuses']}")
+    print(f"close reasons              : {result['reasons']}")
+    print(f"fills: {result['fills']:,}  exchange calls: {result['calls']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# file: benchmarks/bench_portfolio_risk.py
+"""
+Стоимость проверки нового сигнала против открытого портфеля и инкрементального обновления
+(перенос стопа) при сотнях открытых сделок.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_portfolio_risk [--trades 500] [--symbols 150] [--checks 20000]
+"""
+import argparse
+import random
+import time
+
+from portfolio_risk import PortfolioExposure
+
+
+def make_trade(trade_id: int, symbol: str, side: str) -> dict:
+    entry = random.uniform(1, 1000)
+    stop = entry * (0.97 if side == 'long' else 1.03)
+    return {
+        'id': trade_id, 'symbol': symbol, 'side': side, 'status': 'ACTIVE', 'total_qty': 1.0, 'executed_qty': 1.0,
+        'avg_entry_price': entry, 'entry_range_start': entry, 'entry_range_end': entry,
+        'initial_sl_price': stop, 'current_sl_price': stop,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trades", type=int, default=500)
+    parser.add_argument("--symbols", type=int, default=150)
+    parser.add_argument("--checks", type=int, default=20000)
+    args = parser.parse_args()
+    random.seed(7)
+
+    symbols = [f"SYM{i}USDT" for i in range(args.symbols)]
+    # Все три лимита включены, чтобы проверка проходила полный путь
+    exposure = PortfolioExposure(buckets={s: f"bucket{i % 12}" for i, s in enumerate(symbols)},
+                                 max_total_pct=0.05, max_symbol_pct=0.02, max_bucket_pct=0.03)
+    trades = [make_trade(i, random.choice(symbols), random.choice(('long', 'short'))) for i in range(args.trades)]
+    start = time.perf_counter()
+    exposure.rebuild(trades)
+    rebuild_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(args.checks):
+        exposure.check(symbols[i % len(symbols)], 'long', 10.0, 100_000.0)
+    check_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(args.checks):
+        trade = trades[i % len(trades)]
+        trade['current_sl_price'] = trade['avg_entry_price'] * (0.98 if trade['side'] == 'long' else 1.02)
+        exposure.upsert(trade)
+    update_elapsed = time.perf_counter() - start
+
+    print(f"open trades: {args.trades}, symbols: {args.symbols}, buckets: 12")
+    print(f"rebuild         : {rebuild_elapsed * 1e3:8.2f} ms")
+    print(f"check (signal)  : {check_elapsed * 1e6 / args.checks:8.2f} us/check")
+    print(f"upsert (SL move): {update_elapsed * 1e6 / args.checks:8.2f} us/update")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# file: benchmarks/bench_quantization.py
+"""
+Пакетный расчет размера позиций и округление к шагу на миллионе строк: numpy-квантователь
+против поштучного calculate_position_size и против Decimal.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_quantization [--rows 1000000] [--step 0.001] [--scalar-rows 100000]
+"""
+import argparse
+import time
+from decimal import Decimal, ROUND_FLOOR
+
+import numpy as np
+
+from quantization import quantizer_for, size_positions
+from risk_sizer import calculate_position_size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--step", type=float, default=0.001)
+    # Поштучные варианты медленные: меряем на подвыборке и пересчитываем на строку
+    parser.add_argument("--scalar-rows", type=int, default=100_000)
+    args = parser.parse_args()
+    rng = np.random.default_rng(7)
+
+    entry = np.round(rng.uniform(1, 70000, args.rows), 2)
+    stop = np.round(entry * rng.uniform(0.9, 1.1, args.rows), 2)
+    equity = np.round(rng.uniform(100, 50000, args.rows), 2)
+    risk = rng.choice([0.005, 0.01, 0.02], args.rows)
+
+    start = time.perf_counter()
+    sizes = size_positions(entry, stop, equity, risk, args.step)
+    batch_elapsed = time.perf_counter() - start
+
+    quantizer = quantizer_for(args.step)
+    start = time.perf_counter()
+    quantizer.floor(sizes * 1.2345)
+    floor_elapsed = time.perf_counter() - start
+
+    n = min(args.scalar_rows, args.rows)
+    rows = list(zip(entry[:n].tolist(), stop[:n].tolist(), equity[:n].tolist(), risk[:n].tolist()))
+    start = time.perf_counter()
+    scalar_sizes = [calculate_position_size(e, s, eq, args.step, r) for e, s, eq, r in rows]
+    scalar_elapsed = time.perf_counter() - start
+
+    step_d = Decimal(repr(args.step))
+    start = time.perf_counter()
+    for value in (sizes[:n] * 1.2345).tolist():
+        (Decimal(repr(value)) / step_d).to_integral_value(rounding=ROUND_FLOOR) * step_d
+    decimal_elapsed = time.perf_counter() - start
+
+    mismatches = int(np.count_nonzero(np.asarray(scalar_sizes) != sizes[:n]))
+    print(f"rows={args.rows} step={args.step}")
+    print(f"size_positions (numpy):      {batch_elapsed * 1000:8.1f} ms total, {batch_elapsed / args.rows * 1e9:7.1f} ns/row")
+    print(f"StepQuantizer.floor (numpy): {floor_elapsed * 1000:8.1f} ms total, {floor_elapsed / args.rows * 1e9:7.1f} ns/row")
+    print(f"calculate_position_size:     {scalar_elapsed / n * 1e9:8.1f} ns/row ({n} rows)")
+    print(f"Decimal floor-to-step:       {decimal_elapsed / n * 1e9:8.1f} ns/row ({n} rows)")
+    print(f"scalar/batch mismatches:     {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# file: benchmarks/bench_trade_logger.py
+"""
+Сравнение пропускной способности журнала trade_log:
+синхронная вставка с коммитом на каждое событие против фонового BatchedLogWriter.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_trade_logger [--events 5000]
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+# БД выбирается по env-переменной на каждый вызов get_db_connection()
+os.environ["DATABASE_FILE"] = os.path.join(tempfile.mkdtemp(), "bench_trade_log.sqlite")
+
+from db_setup import setup_database
+import trade_logger
+
+PAYLOAD = {"trade_id": 42, "order_id": "1234567890", "price": 109200.5, "qty": 0.015}
+
+
+def bench_sync(n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        trade_logger.log_event("BENCH_SYNC", PAYLOAD)
+    return time.perf_counter() - start
+
+
+def bench_batched(n: int) -> tuple[float, float]:
+    writer = trade_logger.start_log_writer(echo=False)
+    start = time.perf_counter()
+    for _ in range(n):
+        trade_logger.log_event("BENCH_BATCHED", PAYLOAD)
+    enqueue_elapsed = time.perf_counter() - start
+    writer.flush()
+    total_elapsed = time.perf_counter() - start
+    trade_logger.stop_log_writer()
+    return enqueue_elapsed, total_elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=5000)
+    args = parser.parse_args()
+    n = args.events
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        setup_database()
+        sync_elapsed = bench_sync(n)
+    enqueue_elapsed, batched_elapsed = bench_batched(n)
+
+    print(f"events: {n}")
+    print(f"per-event commit : {n / sync_elapsed:>12,.0f} events/s  ({sync_elapsed * 1e6 / n:8.1f} us/event on caller)")
+    print(f"batched (caller) : {n / enqueue_elapsed:>12,.0f} events/s  ({enqueue_elapsed * 1e6 / n:8.1f} us/event on caller)")
+    print(f"batched (durable): {n / batched_elapsed:>12,.0f} events/s  (until flushed to SQLite)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,19 @@
+import asyncio
 import ccxt.async_support as ccxt
 import os
+import time
 from trade_logger import log_trade_execution, log_event
+from latency import LatencyRecorder, OUTCOME_OK, OUTCOME_ERROR, OUTCOME_RATE_LIMITED
+from read_cache import ReadCache, WRITE_INVALIDATES
+from market_metadata import (
+    MarketSnapshot, MARKET_SNAPSHOT_FILE, MARKET_REFRESH_RETRY_SEC, build_quantizers, market_quantizer, markets_etag
+)
+from rate_limiter import (
+    PriorityRateLimiter, ENDPOINT_WEIGHTS, DEFAULT_ENDPOINT_WEIGHT, LANE_PROTECTIVE, LANE_TRADING, LANE_MARKET_DATA
+)
+
+# Bybit v5 принимает не больше 10 ордеров в одном пакетном запросе (linear)
+BATCH_ORDER_LIMIT = 10
 
 class AsyncBybitWrapper:
     def __init__(self, api_key: str, secret_key: str, testnet: bool = True):
@@ -12,27 +25,154 @@ class AsyncBybitWrapper:
             'apiKey': api_key,
             'secret': secret_key,
             'options': {'defaultType': 'swap'},
+            # Лимиты соблюдает наш приоритетный лимитер; FIFO-троттлинг ccxt отменил бы приоритеты
+            'enableRateLimit': False,
         })
         if self.testnet:
             self.exchange.set_sandbox_mode(True)
+        self.rate_limiter = PriorityRateLimiter()
+        self.rate_limit_rejections = 0
+        self.read_cache = ReadCache()
+        self.latency = LatencyRecorder()
+        self.market_snapshot = MarketSnapshot(os.getenv("MARKET_SNAPSHOT_FILE", MARKET_SNAPSHOT_FILE))
+        self.markets_etag = None
+        self._quantizers = {}
+        self._market_refresh_task = None
+
+    async def _request(self, endpoint: str, lane: int, *args, units: int = 1, **kwargs):
+        """
+        Вызов метода ccxt через лимитер: ждем бюджет по весу эндпоинта в своей полосе.
+        `units` - число ордеров в пакетном запросе: Bybit считает их лимит поштучно.
+        Время самого вызова (без ожидания в лимитере) пишется в гистограмму по эндпоинту и исходу.
+        """
+        queued_at = time.perf_counter_ns()
+        await self.rate_limiter.acquire(ENDPOINT_WEIGHTS.get(endpoint, DEFAULT_ENDPOINT_WEIGHT) * units, lane)
+        started_at = time.perf_counter_ns()
+        outcome = OUTCOME_ERROR
+        try:
+            result = await getattr(self.exchange, endpoint)(*args, **kwargs)
+            outcome = OUTCOME_OK
+            return result
+        except (ccxt.RateLimitExceeded, ccxt.DDoSProtection):
+            outcome = OUTCOME_RATE_LIMITED
+            self.rate_limit_rejections += 1
+            log_event("RATE_LIMIT_REJECTED", {"endpoint": endpoint, "lane": lane})
+            raise
+        finally:
+            self.latency.record(endpoint, outcome, time.perf_counter_ns() - started_at,
+                                lane, started_at - queued_at)
+            # Запись могла исполниться даже при ошибке ответа - сбрасываем затронутые чтения всегда
+            if endpoint in WRITE_INVALIDATES:
+                self.read_cache.invalidate(*WRITE_INVALIDATES[endpoint])
+
+    async def _cached_read(self, cache_endpoint: str, key: tuple, endpoint: str, *args, **kwargs):
+        """Чтение через single-flight + TTL кэш; сам запрос идет через лимитер в полосе рыночных данных."""
+        return await self.read_cache.get(
+            cache_endpoint, key, lambda: self._request(endpoint, LANE_MARKET_DATA, *args, **kwargs)
+        )
+
+    def invalidate_reads(self, *cache_endpoints: str):
+        """Сбрасывает кэш чтений (например, после исполнения, пришедшего по WebSocket)."""
+        self.read_cache.invalidate(*(cache_endpoints or ('positions', 'balance')))
+
+    @staticmethod
+    def _order_lane(params: dict) -> int:
+        """Защитные ордера (стоп-лосс, reduce-only) идут вне очереди."""
+        params = params or {}
+        if params.get('reduceOnly') or params.get('stopLoss') or params.get('stopLossPrice'):
+            return LANE_PROTECTIVE
+        return LANE_TRADING
+
+    def latency_metrics(self) -> dict:
+        """p50/p90/p99/max и число ошибок по каждому эндпоинту биржи."""
+        return self.latency.snapshot()
+
+    def rate_limit_metrics(self) -> dict:
+        return {**self.rate_limiter.metrics(), "rejections": self.rate_limit_rejections,
+                "read_cache": self.read_cache.metrics()}
 
     async def init(self):
+        """
+        Подключение. Если на диске есть снапшот метаданных рынков, стартуем с него сразу,
+        а свежие рынки догружаем в фоне; без снапшота - обычная загрузка с биржи.
+        """
         try:
-            await self.exchange.load_markets()
+            snapshot = self.market_snapshot.load(self.testnet)
+            if snapshot:
+                self.exchange.set_markets(snapshot['markets'], snapshot.get('currencies') or None)
+                self._apply_markets(snapshot['markets'], snapshot['etag'])
+                delay = 0.0 if not self.market_snapshot.is_fresh(snapshot) else \
+                    self.market_snapshot.ttl - self.market_snapshot.age(snapshot)
+                self._market_refresh_task = asyncio.create_task(self._market_refresh_loop(delay))
+                log_event("MARKET_SNAPSHOT_LOADED", {"etag": snapshot['etag'], "markets": len(snapshot['markets']),
+                                                     "age_sec": round(self.market_snapshot.age(snapshot), 1)})
+            else:
+                await self._request('load_markets', LANE_TRADING)
+                await self._store_markets()
             print(f"Successfully connected to Bybit. Sandbox mode: {self.testnet}")
         except Exception as e:
             await self.close()
             raise
 
     async def close(self):
+        if self._market_refresh_task:
+            self._market_refresh_task.cancel()
+            self._market_refresh_task = None
         if self.exchange:
             await self.exchange.close()
 
+    def _apply_markets(self, markets: dict, etag: str):
+        self._quantizers = build_quantizers(markets)
+        self.markets_etag = etag
+
+    def _fingerprint_and_save(self, markets: dict, currencies: dict) -> tuple:
+        """Отпечаток рынков и запись снапшота - в рабочем потоке. Возвращает (etag, ошибка записи или None)."""
+        etag = markets_etag(markets)
+        if not self.market_snapshot.enabled:
+            return etag, None
+        try:
+            self.market_snapshot.save(markets, currencies, self.testnet, etag)
+        except OSError as e:
+            return etag, e
+        return etag, None
+
+    async def _store_markets(self) -> bool:
+        """Пересчитывает квантователи и пишет снапшот после загрузки рынков. True, если метаданные изменились."""
+        markets = self.exchange.markets
+        if not isinstance(markets, dict) or not markets:
+            return False
+        # Сериализация и хеш тысяч рынков, как и сам снапшот на мегабайты, - вне цикла событий
+        etag, save_error = await asyncio.to_thread(self._fingerprint_and_save, markets, self.exchange.currencies)
+        if save_error is not None:
+            log_event("MARKET_SNAPSHOT_ERROR", {"path": self.market_snapshot.path, "error": str(save_error)})
+        changed = etag != self.markets_etag
+        if changed:
+            self._apply_markets(markets, etag)
+        return changed
+
+    async def refresh_markets(self) -> bool:
+        """Перезагружает рынки с биржи и обновляет снапшот. True, если метаданные изменились."""
+        await self._request('load_markets', LANE_MARKET_DATA, True)
+        changed = await self._store_markets()
+        log_event("MARKET_METADATA_REFRESHED", {"etag": self.markets_etag, "changed": changed})
+        return changed
+
+    async def _market_refresh_loop(self, delay: float):
+        """Фоновое обновление: первое - когда снапшот устареет, дальше - раз в TTL."""
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.refresh_markets()
+                delay = self.market_snapshot.ttl
+            except Exception as e:
+                log_event("MARKET_METADATA_REFRESH_ERROR", {"error": str(e)})
+                delay = MARKET_REFRESH_RETRY_SEC
+
     # --- ДОБАВЬТЕ ЭТИ ДВА МЕТОДА ---
     async def set_leverage(self, symbol: str, leverage: int):
         """Устанавливает кредитное плечо для указанного символа."""
         try:
-            await self.exchange.set_leverage(leverage, symbol)
+            await self._request('set_leverage', LANE_TRADING, leverage, symbol)
             log_event("LEVERAGE_SET", {"symbol": symbol, "leverage": leverage})
         except Exception as e:
             log_event("LEVERAGE_ERROR", {"symbol": symbol, "error": str(e)})
@@ -43,31 +183,43 @@ class AsyncBybitWrapper:
         """Устанавливает режим маржи ('cross' или 'isolated')."""
         try:
             unified_symbol = symbol.split(':')[0]
-            await self.exchange.set_margin_mode(margin_mode, unified_symbol, params={'settleCoin': 'USDT'})
+            await self._request('set_margin_mode', LANE_TRADING, margin_mode, unified_symbol, params={'settleCoin': 'USDT'})
             log_event("MARGIN_MODE_SET", {"symbol": symbol, "mode": margin_mode})
         except Exception as e:
             log_event("MARGIN_MODE_ERROR", {"symbol": symbol, "error": str(e)})
             print(f"Warning: Failed to set margin mode for {symbol}: {e}")
     # ------------------------------------
 
+    def get_market_quantizer(self, symbol: str) -> dict:
+        """Шаги, знаки после запятой и лимиты символа из предрассчитанного индекса."""
+        quantizer = self._quantizers.get(symbol)
+        if quantizer is None:
+            try:
+                quantizer = market_quantizer(self.exchange.market(symbol))
+            except (ccxt.BadSymbol, KeyError):
+                return None
+            self._quantizers[symbol] = quantizer
+        return quantizer
+
     def get_market_precision(self, symbol: str) -> dict:
-        try:
-            market = self.exchange.market(symbol)
-            return {'price': market['precision']['price'], 'amount': market['precision']['amount']}
-        except (ccxt.BadSymbol, KeyError):
+        quantizer = self.get_market_quantizer(symbol)
+        if quantizer is None:
             return None
+        return {'price': quantizer['price'], 'amount': quantizer['amount']}
 
     async def get_usdt_balance(self) -> float:
         try:
-            balance = await self.exchange.fetch_balance()
+            balance = await self._cached_read('balance', (), 'fetch_balance')
             return float(balance.get('USDT', {}).get('total', 0.0))
         except Exception as e:
             return 0.0
 
-    async def fetch_open_positions(self) -> dict:
+    async def fetch_open_positions(self, settle_coin: str = 'USDT') -> dict:
+        """Все открытые позиции одним запросом, отфильтрованные по монете расчетов."""
         try:
-            positions = await self.exchange.fetch_positions()
-            return {p['info']['symbol']: p for p in positions if float(p.get('contracts', 0)) != 0}
+            positions = await self._cached_read('positions', (settle_coin,), 'fetch_positions', None, params={'settleCoin': settle_coin})
+            # Копии: вызывающие (событийный менеджер) меняют позиции на месте, а список живет в кэше
+            return {p['info']['symbol']: dict(p) for p in positions if float(p.get('contracts', 0)) != 0}
         except Exception:
             return {}
     
@@ -75,17 +227,40 @@ class AsyncBybitWrapper:
     async def fetch_ticker_price(self, symbol: str) -> float:
         """Получает последнюю цену для тикера."""
         try:
-            ticker = await self.exchange.fetch_ticker(symbol)
+            ticker = await self._cached_read('ticker', (symbol,), 'fetch_ticker', symbol)
             return float(ticker['last'])
         except Exception as e:
             print(f"Error fetching ticker for {symbol}: {e}")
             return 0.0
     # ---------------------------
 
+    async def fetch_tickers(self, symbols: list) -> dict:
+        """
+        Последние цены для списка тикеров одним запросом.
+        Ключи - символы в том виде, в каком их передали (id биржи или унифицированный).
+        """
+        if not symbols:
+            return {}
+        try:
+            tickers = await self._cached_read('tickers', tuple(symbols), 'fetch_tickers', symbols)
+        except Exception as e:
+            print(f"Error fetching tickers for {symbols}: {e}")
+            return {}
+        prices = {}
+        for unified_symbol, ticker in tickers.items():
+            if ticker.get('last') is None:
+                continue
+            price = float(ticker['last'])
+            prices[unified_symbol] = price
+            exchange_id = (ticker.get('info') or {}).get('symbol')
+            if exchange_id:
+                prices[exchange_id] = price
+        return {s: prices[s] for s in symbols if s in prices}
+
     async def create_market_order_with_sl(self, symbol: str, side: str, amount: float, stop_loss_price: float) -> dict:
         params = {'stopLoss': stop_loss_price}
         try:
-            order = await self.exchange.create_order(symbol, 'market', side, amount, params=params)
+            order = await self._request('create_order', LANE_PROTECTIVE, symbol, 'market', side, amount, params=params)
             log_trade_execution(order)
             return order
         except Exception as e:
@@ -96,7 +271,7 @@ class AsyncBybitWrapper:
     async def create_order(self, symbol: str, type: str, side: str, amount: float, price: float = None, params={}) -> dict:
         """Универсальный метод для создания ордеров."""
         try:
-            order = await self.exchange.create_order(symbol, type, side, amount, price, params)
+            order = await self._request('create_order', self._order_lane(params), symbol, type, side, amount, price, params)
             log_trade_execution(order)
             return order
         except Exception as e:
@@ -107,7 +282,7 @@ class AsyncBybitWrapper:
     async def create_limit_order(self, symbol: str, side: str, amount: float, price: float, params={}) -> dict:
         """Создает лимитный ордер."""
         try:
-            order = await self.exchange.create_limit_order(symbol, side, amount, price, params=params)
+            order = await self._request('create_limit_order', self._order_lane(params), symbol, side, amount, price, params=params)
             log_trade_execution(order)
             return order
         except Exception as e:
@@ -115,10 +290,39 @@ class AsyncBybitWrapper:
             log_trade_execution(error_payload)
             raise  # Перебрасываем исключение, чтобы вызывающий код мог его обработать
 
+    async def create_orders(self, orders: list) -> list:
+        """
+        Пакетное создание ордеров (по BATCH_ORDER_LIMIT за запрос).
+        `orders` - список словарей с ключами symbol, type, side, amount, price, params.
+        Возвращает список той же длины: ордер или словарь с ключом 'error' для отклоненных.
+        """
+        results = []
+        for start in range(0, len(orders), BATCH_ORDER_LIMIT):
+            chunk = orders[start:start + BATCH_ORDER_LIMIT]
+            lane = min(self._order_lane(o.get('params')) for o in chunk)
+            if self.exchange.has.get('createOrders'):
+                try:
+                    created = await self._request('create_orders', lane, chunk, units=len(chunk))
+                except Exception as e:
+                    created = [{'error': str(e)} for _ in chunk]
+            else:
+                created = await asyncio.gather(*[
+                    self._request('create_order', lane, o['symbol'], o['type'], o['side'], o['amount'], o.get('price'), o.get('params', {}))
+                    for o in chunk
+                ], return_exceptions=True)
+            for request, order in zip(chunk, created):
+                if isinstance(order, Exception) or not order or not order.get('id'):
+                    error = str(order) if isinstance(order, Exception) else (order or {}).get('error', 'rejected')
+                    order = {'symbol': request['symbol'], 'side': request['side'], 'amount': request['amount'],
+                             'price': request.get('price'), 'error': error}
+                log_trade_execution(order)
+                results.append(order)
+        return results
+
     async def edit_order(self, order_id: str, symbol: str, new_price: float) -> dict:
         """Редактирует цену существующего ордера (обычно для SL/TP)."""
         try:
-            order = await self.exchange.edit_order(order_id, symbol, params={'triggerPrice': new_price})
+            order = await self._request('edit_order', LANE_PROTECTIVE, order_id, symbol, params={'triggerPrice': new_price})
             log_event("ORDER_EDITED", order)
             return order
         except Exception as e:
@@ -127,19 +331,29 @@ class AsyncBybitWrapper:
             raise
     
     async def cancel_order(self, order_id: str, symbol: str) -> dict:
-        """Отменяет ордер."""
+        """
+        Отменяет ордер. Ошибка не пробрасывается, а возвращается в поле 'error';
+        'not_found' означает, что ордера на бирже уже нет (исполнен или отменен раньше).
+        """
         try:
-            response = await self.exchange.cancel_order(order_id, symbol)
+            response = await self._request('cancel_order', LANE_TRADING, order_id, symbol)
             log_event("ORDER_CANCELLED", response)
             return response
         except Exception as e:
-            error_payload = {'order_id': order_id, 'symbol': symbol, 'error': str(e)}
+            error_payload = {'order_id': order_id, 'symbol': symbol, 'error': str(e),
+                             'not_found': isinstance(e, ccxt.OrderNotFound)}
             log_event("ORDER_CANCEL_FAILED", error_payload)
             # Не перебрасываем исключение, т.к. ордер мог уже быть исполнен/отменен
             return error_payload
 
-    async def fetch_my_trades(self, symbol: str, limit: int = 20) -> list:
-        """Получает историю последних сделок пользователя."""
+    async def fetch_my_trades(self, symbol: str, since: int = None, limit: int = 20, until: int = None) -> list:
+        """
+        Получает историю исполнений пользователя в окне [since, until] (мс, если заданы).
+        Bybit отдает самые новые `limit` исполнений окна; более старые - запросом с меньшим until.
+        Без кэша чтений: журнал исполнений досинхронизируется, когда в нем не хватает выхода,
+        и закэшированная страница без этого исполнения навсегда исказила бы PnL сделки.
+        """
         if self.exchange.has['fetchMyTrades']:
-            return await self.exchange.fetch_my_trades(symbol, limit=limit)
+            params = {'until': until} if until is not None else {}
+            return await self._request('fetch_my_trades', LANE_MARKET_DATA, symbol, since=since, limit=limit, params=params)
         return []
\ No newline at end of file
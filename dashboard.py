@@ -2,8 +2,8 @@
 import streamlit as st
 import pandas as pd
 from streamlit_autorefresh import st_autorefresh
-from db_utils import get_db_connection
-import json
+from dashboard_data import DashboardCache, display_frames
+from performance import performance_summary
 
 # --- Конфигурация ---
 REFRESH_INTERVAL_SECONDS = 10
@@ -11,17 +11,18 @@ st.set_page_config(page_title="Trading Bot Dashboard", layout="wide")
 st_autorefresh(interval=REFRESH_INTERVAL_SECONDS * 1000, key="dashboard_refresh")
 
 # --- Функции для загрузки данных ---
-@st.cache_data(ttl=REFRESH_INTERVAL_SECONDS)
+@st.cache_resource
+def get_dashboard_cache() -> DashboardCache:
+    """Один кэш на процесс Streamlit: все вкладки и зрители делят одно инкрементальное чтение БД."""
+    return DashboardCache(min_refresh_sec=REFRESH_INTERVAL_SECONDS / 2)
+
 def load_data():
-    conn = get_db_connection()
-    active = pd.read_sql_query("SELECT * FROM managed_trades WHERE status != 'CLOSED' ORDER BY created_at DESC", conn)
-    history = pd.read_sql_query("SELECT * FROM managed_trades WHERE status = 'CLOSED' ORDER BY updated_at DESC LIMIT 50", conn)
-    # Используем left join для обогащения активных сделок живыми ценами
-    prices = pd.read_sql_query("SELECT * FROM live_prices", conn)
-    if not active.empty and not prices.empty:
-        active = pd.merge(active, prices, on='symbol', how='left')
-    conn.close()
-    return active, history
+    return display_frames(*get_dashboard_cache().get())
+
+@st.cache_data(ttl=REFRESH_INTERVAL_SECONDS)
+def load_performance():
+    # Агрегаты поддерживаются при закрытии сделок: чтение не зависит от размера истории
+    return performance_summary()
 
 # --- Основная структура дашборда ---
 st.title("🤖 Stateful Trading Bot Dashboard v2.0")
@@ -30,12 +31,7 @@ active_df, history_df = load_data()
 # --- Блок 1: Управляемые Сделки ---
 st.subheader("📊 Managed Trades")
 if not active_df.empty:
-    active_df['progress'] = active_df['executed_qty'] / active_df['total_qty']
-    # Добавим uPNL (упрощенно)
-    if 'mark_price' in active_df.columns:
-        active_df['uPNL'] = (active_df['mark_price'] - active_df['avg_entry_price']) * active_df['executed_qty']
-        active_df.loc[active_df['side'] == 'short', 'uPNL'] *= -1
-
+    # progress, mark_price и uPNL уже посчитаны в кэше для изменившихся строк
     st.dataframe(
         active_df.style.bar(subset=['progress'], align='mid', color=['#d6e8d6', '#e8d6d6']),
         use_container_width=True, hide_index=True
@@ -50,5 +46,24 @@ if not history_df.empty:
 else:
     st.info("Trade history is empty.")
 
-# --- Блок 3: Журнал Событий (опционально, если нужен) ---
+# --- Блок 3: Статистика ---
+st.subheader("🏁 Performance")
+performance = load_performance()
+total = performance['total']
+if total:
+    cols = st.columns(5)
+    cols[0].metric("Closed trades", total['trades'])
+    cols[1].metric("Realized PnL", f"{total['pnl']:.2f}")
+    cols[2].metric("Win rate", f"{total['win_rate']:.1%}")
+    cols[3].metric("Average R", f"{total['avg_r']:.2f}" if total['avg_r'] is not None else "-")
+    cols[4].metric("Profit factor", f"{total['profit_factor']:.2f}" if total['profit_factor'] is not None else "-")
+    equity_curve = pd.DataFrame(performance['equity_curve'])
+    st.line_chart(equity_curve.set_index('day')['cumulative_pnl'])
+    left, right = st.columns(2)
+    left.dataframe(pd.DataFrame(performance['by_symbol']), use_container_width=True, hide_index=True)
+    right.dataframe(pd.DataFrame(performance['by_close_reason']), use_container_width=True, hide_index=True)
+else:
+    st.info("No closed trades yet.")
+
+# --- Блок 4: Журнал Событий (опционально, если нужен) ---
 # ...
\ No newline at end of file
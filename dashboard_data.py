@@ -0,0 +1,168 @@
+# file: dashboard_data.py
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from db_utils import get_db_connection
+
+# --- Константы ---
+# Сколько закрытых сделок показывать в истории
+HISTORY_LIMIT = 50
+# Курсор - момент предыдущего чтения минус столько секунд: строка, проштампованная до чтения,
+# а закоммиченная после него, не теряется (повтор безвреден - upsert по id)
+DASHBOARD_CURSOR_OVERLAP_SEC = float(os.getenv("DASHBOARD_CURSOR_OVERLAP_SEC", "5"))
+# Не чаще одного запроса к БД за столько секунд на всех зрителей
+DASHBOARD_MIN_REFRESH_SEC = float(os.getenv("DASHBOARD_MIN_REFRESH_SEC", "5"))
+
+# Прогресс по лестнице TP берем из trade_targets (индексные выборки по trade_id), а не из JSON-колонок
+_TRADES_QUERY = """
+    SELECT mt.*,
+        (SELECT COUNT(*) FROM trade_targets tt WHERE tt.trade_id = mt.id) AS tps_total,
+        (SELECT COUNT(*) FROM trade_targets tt WHERE tt.trade_id = mt.id AND tt.status != 'pending') AS tps_done,
+        (SELECT tt.price FROM trade_targets tt WHERE tt.trade_id = mt.id AND tt.status = 'pending'
+         ORDER BY tt.tp_index LIMIT 1) AS next_tp
+    FROM managed_trades mt
+"""
+_DROPPED_COLUMNS = ['initial_tps', 'remaining_tps']
+
+
+def _utc_cursor(overlap_sec: float) -> str:
+    """Курсор в формате updated_at (ISO UTC), отмотанный на overlap_sec назад от текущего момента."""
+    return (datetime.now(timezone.utc) - timedelta(seconds=overlap_sec)).isoformat(timespec='microseconds')
+
+
+class DashboardCache:
+    """
+    Кэш таблиц дашборда, общий для всех сессий Streamlit.
+
+    Первый refresh читает открытые сделки, последние закрытые и цены целиком; дальше -
+    только строки managed_trades и live_prices с updated_at не раньше курсора (момент прошлого
+    чтения минус перекрытие; updated_at пишутся часами этой же машины). Изменившиеся
+    сделки вливаются по id: закрытые уходят из активных в историю. uPNL и прогресс
+    пересчитываются векторно только для изменившихся сделок и сделок по символам с новой ценой.
+    Нагрузка на БД не растет ни с числом зрителей, ни с размером истории.
+    """
+
+    def __init__(self, overlap_sec: float = DASHBOARD_CURSOR_OVERLAP_SEC,
+                 min_refresh_sec: float = DASHBOARD_MIN_REFRESH_SEC, history_limit: int = HISTORY_LIMIT):
+        self.overlap_sec = overlap_sec
+        self.min_refresh_sec = min_refresh_sec
+        self.history_limit = history_limit
+        self._lock = threading.Lock()
+        self.active = pd.DataFrame()
+        self.history = pd.DataFrame()
+        self.prices = pd.Series(dtype=float)    # symbol -> mark_price
+        self.cursor = None
+        self.refreshed_at = 0.0
+        self.queries = 0
+        self.rows_fetched = 0
+
+    def get(self, conn=None) -> tuple:
+        """
+        (active, history) для отрисовки; БД читается не чаще min_refresh_sec на всех вызывающих.
+        Кадры заменяются целиком, а не меняются на месте: сессия рисует полученные кадры без блокировки.
+        """
+        with self._lock:
+            if time.monotonic() - self.refreshed_at >= self.min_refresh_sec:
+                self.refresh(conn)
+            return self.active, self.history
+
+    def refresh(self, conn=None):
+        own_conn = conn is None
+        conn = conn or get_db_connection()
+        try:
+            # Курсор фиксируется до запросов: все, что закоммичено позже, попадет в следующее чтение
+            next_cursor = _utc_cursor(self.overlap_sec)
+            if self.cursor is None:
+                self._load_full(conn)
+            else:
+                self._load_changes(conn)
+            self.cursor = next_cursor
+        finally:
+            if own_conn:
+                conn.close()
+        self.refreshed_at = time.monotonic()
+
+    # --- Чтение из БД ---
+    def _query(self, conn, sql: str, params: tuple = ()) -> pd.DataFrame:
+        frame = pd.read_sql_query(sql, conn, params=params)
+        self.queries += 1
+        self.rows_fetched += len(frame)
+        return frame
+
+    def _load_full(self, conn):
+        active = self._query(conn, _TRADES_QUERY + " WHERE mt.status != 'CLOSED'")
+        history = self._query(
+            conn, _TRADES_QUERY + " WHERE mt.status = 'CLOSED' ORDER BY mt.updated_at DESC LIMIT ?",
+            (self.history_limit,)
+        )
+        prices = self._query(conn, "SELECT symbol, mark_price, updated_at FROM live_prices")
+        self.prices = prices.set_index('symbol')['mark_price']
+        self.active = self._with_derived(self._prepare(active))
+        self.history = self._prepare(history)
+
+    def _load_changes(self, conn):
+        changed = self._query(conn, _TRADES_QUERY + " WHERE mt.updated_at >= ?", (self.cursor,))
+        prices = self._query(
+            conn, "SELECT symbol, mark_price, updated_at FROM live_prices WHERE updated_at >= ?", (self.cursor,)
+        )
+
+        changed_symbols = set()
+        if not prices.empty:
+            new_prices = prices.set_index('symbol')['mark_price']
+            moved = new_prices[new_prices.ne(self.prices.reindex(new_prices.index))]
+            changed_symbols = set(moved.index)
+            self.prices = pd.concat([self.prices.drop(moved.index, errors='ignore'), moved])
+        if not changed.empty:
+            self._merge_trades(self._prepare(changed))
+        if changed_symbols and not self.active.empty:
+            # uPNL остальных сделок пересчитываем только по символам, где сдвинулась цена
+            mask = self.active['symbol'].isin(changed_symbols).to_numpy()
+            if mask.any():
+                self.active = pd.concat([self.active[~mask], self._with_derived(self.active[mask])]) \
+                    .sort_values('created_at', ascending=False)
+
+    # --- Слияние в памяти ---
+    @staticmethod
+    def _prepare(frame: pd.DataFrame) -> pd.DataFrame:
+        return frame.drop(columns=_DROPPED_COLUMNS, errors='ignore').set_index('id', drop=False)
+
+    def _merge_trades(self, changed: pd.DataFrame):
+        closed_mask = (changed['status'] == 'CLOSED').to_numpy()
+        opened = changed[~closed_mask]
+        closed = changed[closed_mask]
+
+        active = self.active.drop(changed.index, errors='ignore') if not self.active.empty else self.active
+        if not opened.empty:
+            active = pd.concat([active, self._with_derived(opened)]) if not active.empty else self._with_derived(opened)
+        self.active = active.sort_values('created_at', ascending=False) if not active.empty else active
+
+        if not closed.empty:
+            history = self.history.drop(closed.index, errors='ignore') if not self.history.empty else self.history
+            history = pd.concat([closed, history]) if not history.empty else closed
+            self.history = history.sort_values('updated_at', ascending=False).head(self.history_limit)
+
+    def _with_derived(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """Прогресс входа, живая цена и упрощенный uPNL - векторно для переданных строк."""
+        if frame.empty:
+            return frame
+        frame = frame.copy()
+        executed = pd.to_numeric(frame['executed_qty'], errors='coerce').fillna(0.0).to_numpy(dtype=float)
+        total = pd.to_numeric(frame['total_qty'], errors='coerce').to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frame['progress'] = np.where(total > 0, executed / total, 0.0)
+        mark = self.prices.reindex(frame['symbol']).to_numpy(dtype=float)
+        direction = np.where(frame['side'].to_numpy() == 'short', -1.0, 1.0)
+        entry = pd.to_numeric(frame['avg_entry_price'], errors='coerce').to_numpy(dtype=float)
+        frame['mark_price'] = mark
+        frame['uPNL'] = (mark - entry) * executed * direction
+        return frame
+
+
+def display_frames(active: pd.DataFrame, history: pd.DataFrame) -> tuple:
+    """Таблицы для отрисовки: без служебного индекса, в порядке как в прежнем дашборде."""
+    return active.reset_index(drop=True), history.reset_index(drop=True)
@@ -0,0 +1,237 @@
+# file: db_migrations.py
+import json
+import os
+import sqlite3
+
+from db_utils import insert_trade_targets
+
+# The version written by the original setup_database(); migrations start after it.
+BASE_SCHEMA_VERSION = 3
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT value FROM db_meta WHERE key = 'schema_version'").fetchone()
+    return int(row[0]) if row else BASE_SCHEMA_VERSION
+
+
+def _set_schema_version(conn: sqlite3.Connection, version: int):
+    conn.execute(
+        "INSERT INTO db_meta (key, value) VALUES ('schema_version', ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (str(version),)
+    )
+
+
+# ==============================================================================
+# Migrations. Each step receives an open connection and must be idempotent
+# (IF NOT EXISTS / INSERT OR IGNORE), so re-running a half-applied step is safe.
+# ==============================================================================
+
+def _m004_hot_path_indexes(conn: sqlite3.Connection):
+    """Indexes for the queries issued by the position manager, dashboard and log readers."""
+    # Covering index: lookup of open entry orders of a trade without touching the table.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_entry_orders_trade_status "
+        "ON entry_orders(trade_id, status, exchange_order_id)"
+    )
+    # Partial index: open trades are a small, hot subset sorted by created_at.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_managed_trades_open_created "
+        "ON managed_trades(created_at) WHERE status != 'CLOSED'"
+    )
+    # Closed history is read newest-first by updated_at; (status, updated_at) avoids a temp B-tree sort.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_managed_trades_status_updated "
+        "ON managed_trades(status, updated_at)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trade_log_timestamp ON trade_log(timestamp_utc)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trade_log_event_type ON trade_log(event_type, timestamp_utc)")
+
+
+def _m005_trade_targets(conn: sqlite3.Connection):
+    """
+    Moves the take-profit ladder out of the managed_trades JSON columns into one row per target.
+    initial_tps stays as the immutable signal snapshot; remaining_tps is no longer maintained.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS trade_targets (
+        trade_id INTEGER NOT NULL,
+        tp_index INTEGER NOT NULL,
+        price REAL NOT NULL,
+        qty REAL NOT NULL,
+        status TEXT NOT NULL CHECK(status IN ('pending', 'placed', 'filled', 'cancelled')),
+        order_id TEXT,
+        filled_at TEXT,
+        PRIMARY KEY (trade_id, tp_index),
+        FOREIGN KEY (trade_id) REFERENCES managed_trades (id)
+    ) WITHOUT ROWID;
+    """)
+    # Backfill: targets already popped from remaining_tps had their TP order placed.
+    rows = conn.execute(
+        "SELECT id, total_qty, initial_tps, remaining_tps FROM managed_trades "
+        "WHERE id NOT IN (SELECT DISTINCT trade_id FROM trade_targets)"
+    ).fetchall()
+    for trade_id, total_qty, initial_tps, remaining_tps in rows:
+        initial = json.loads(initial_tps or '[]')
+        remaining = json.loads(remaining_tps or '[]')
+        insert_trade_targets(conn, trade_id, initial, total_qty, tps_taken=len(initial) - len(remaining))
+
+
+def _m006_fills_ledger(conn: sqlite3.Connection):
+    """
+    Local ledger of exchange executions, synced incrementally with a per-symbol cursor.
+    Fills are attributed to trades by order id; realized PnL and the close reason are
+    aggregated from here instead of re-fetching recent trades from the exchange.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS fills (
+        fill_id TEXT PRIMARY KEY,
+        symbol TEXT NOT NULL,
+        order_id TEXT,
+        trade_id INTEGER,
+        kind TEXT CHECK(kind IN ('entry', 'tp', 'sl', 'other')),
+        side TEXT NOT NULL CHECK(side IN ('buy', 'sell')),
+        price REAL NOT NULL,
+        qty REAL NOT NULL,
+        fee REAL NOT NULL DEFAULT 0,
+        stop_order_type TEXT,
+        timestamp_ms INTEGER NOT NULL,
+        FOREIGN KEY (trade_id) REFERENCES managed_trades (id)
+    );
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fills_trade ON fills(trade_id, timestamp_ms)")
+    # Only unattributed fills are looked up by order id, so keep that index small.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fills_unattributed ON fills(order_id) WHERE trade_id IS NULL")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS fill_cursors (
+        symbol TEXT PRIMARY KEY,
+        since_ms INTEGER NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+    """)
+    # Order-id lookups used by fill attribution.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_entry_orders_exchange_id ON entry_orders(exchange_order_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trade_targets_order_id ON trade_targets(order_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_managed_trades_sl_order ON managed_trades(exchange_sl_order_id)")
+
+
+def _m007_daily_start_equity(conn: sqlite3.Connection):
+    """Stores the account equity at the start of each trading day; the drawdown limit is a share of it."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(daily_pnl)")}
+    if "start_equity" not in columns:
+        conn.execute("ALTER TABLE daily_pnl ADD COLUMN start_equity REAL")
+
+
+def _m008_equity_snapshots(conn: sqlite3.Connection):
+    """Sampled account equity (wallet balance + unrealized PnL), keyed by sample time."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS equity_snapshots (
+        ts_ms INTEGER PRIMARY KEY,
+        wallet_balance REAL NOT NULL,
+        unrealized_pnl REAL NOT NULL,
+        equity REAL NOT NULL
+    ) WITHOUT ROWID;
+    """)
+
+
+def _m009_updated_at_cursors(conn: sqlite3.Connection):
+    """The dashboard polls rows changed since a cursor: updated_at range scans need their own indexes."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_managed_trades_updated ON managed_trades(updated_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_live_prices_updated ON live_prices(updated_at)")
+
+
+def _m010_performance_aggregates(conn: sqlite3.Connection):
+    """
+    Closed-trade statistics maintained incrementally by TradeStore.flush, one row per
+    (dimension, key): day, symbol, close_reason and the overall total. perf_applied makes
+    recording a trade idempotent. Existing history is backfilled here with the SQL below, a
+    frozen copy of the rules in performance.record_closed_trade at the time of this migration.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS perf_aggregates (
+        dimension TEXT NOT NULL,
+        key TEXT NOT NULL,
+        trades INTEGER NOT NULL DEFAULT 0,
+        wins INTEGER NOT NULL DEFAULT 0,
+        losses INTEGER NOT NULL DEFAULT 0,
+        pnl REAL NOT NULL DEFAULT 0,
+        gross_win REAL NOT NULL DEFAULT 0,
+        gross_loss REAL NOT NULL DEFAULT 0,
+        sum_r REAL NOT NULL DEFAULT 0,
+        r_trades INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dimension, key)
+    ) WITHOUT ROWID;
+    """)
+    conn.execute("CREATE TABLE IF NOT EXISTS perf_applied (trade_id INTEGER PRIMARY KEY)")
+    # Backfill from scratch, so re-applying the step gives the same rows.
+    conn.execute("DELETE FROM perf_aggregates")
+    conn.execute("DELETE FROM perf_applied")
+    conn.execute("INSERT INTO perf_applied (trade_id) SELECT id FROM managed_trades WHERE status = 'CLOSED'")
+    # Trading day of the close: updated_at shifted back by the configured day-start hour.
+    day_shift = f"-{int(os.getenv('RISK_DAY_START_HOUR_UTC', '0'))} hours"
+    conn.execute("""
+    WITH closed AS (
+        SELECT
+            COALESCE(realized_pnl, 0) AS pnl,
+            CASE
+                WHEN realized_pnl IS NOT NULL AND avg_entry_price AND initial_sl_price
+                     AND COALESCE(NULLIF(executed_qty, 0), total_qty, 0) > 0 AND avg_entry_price != initial_sl_price
+                THEN realized_pnl / (COALESCE(NULLIF(executed_qty, 0), total_qty) * ABS(avg_entry_price - initial_sl_price))
+            END AS r_multiple,
+            COALESCE(date(updated_at, :day_shift), date('now', :day_shift)) AS day,
+            COALESCE(symbol, '?') AS symbol,
+            COALESCE(close_reason, 'UNKNOWN') AS close_reason
+        FROM managed_trades WHERE status = 'CLOSED'
+    ),
+    keyed AS (
+        SELECT 'day' AS dimension, day AS key, pnl, r_multiple FROM closed
+        UNION ALL SELECT 'symbol', symbol, pnl, r_multiple FROM closed
+        UNION ALL SELECT 'close_reason', close_reason, pnl, r_multiple FROM closed
+        UNION ALL SELECT 'all', 'all', pnl, r_multiple FROM closed
+    )
+    INSERT INTO perf_aggregates (dimension, key, trades, wins, losses, pnl, gross_win, gross_loss, sum_r, r_trades)
+    SELECT dimension, key, COUNT(*), SUM(pnl > 0), SUM(pnl < 0), SUM(pnl), SUM(MAX(pnl, 0)), SUM(MAX(-pnl, 0)),
+           COALESCE(SUM(r_multiple), 0), COUNT(r_multiple)
+    FROM keyed GROUP BY dimension, key
+    """, {"day_shift": day_shift})
+
+
+# Ordered list of (version, description, step). Append only, never renumber.
+MIGRATIONS = [
+    (4, "hot-path indexes for trade tables and trade_log", _m004_hot_path_indexes),
+    (5, "trade_targets table backfilled from the TP JSON columns", _m005_trade_targets),
+    (6, "fills ledger and per-symbol sync cursors", _m006_fills_ledger),
+    (7, "start-of-day equity for the daily drawdown gate", _m007_daily_start_equity),
+    (8, "equity_snapshots time series", _m008_equity_snapshots),
+    (9, "updated_at indexes for incremental dashboard loading", _m009_updated_at_cursors),
+    (10, "materialized performance aggregates over closed trades", _m010_performance_aggregates),
+]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> list:
+    """
+    Applies every migration newer than the current schema_version, in order.
+    Each step runs in its own transaction together with the version bump,
+    so a failure leaves the DB at the last fully applied version.
+    Returns the list of applied versions.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    applied = []
+    current = get_schema_version(conn)
+    for version, description, step in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version <= current:
+            continue
+        print(f"   ... applying migration {version}: {description}")
+        # Explicit BEGIN: the sqlite3 module would otherwise autocommit DDL statements.
+        conn.execute("BEGIN")
+        try:
+            step(conn)
+            _set_schema_version(conn, version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+        current = version
+    return applied
@@ -1,6 +1,7 @@
 # file: db_setup.py
 import sqlite3
 from db_utils import get_db_connection
+from db_migrations import apply_migrations, get_schema_version
 
 def setup_database():
     """
@@ -37,6 +38,7 @@ def setup_database():
             -- CORRECTED COLUMN DEFINITION --
             move_sl_to_be_after_tp_index INTEGER, 
             
+            -- Legacy: the live TP ladder is kept in trade_targets (migration 5)
             remaining_tps TEXT NOT NULL,
             close_reason TEXT,
             realized_pnl REAL,
@@ -97,7 +99,7 @@ def setup_database():
         # Indexes for performance
         print("6. Creating indexes for performance...")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_managed_trades_status ON managed_trades(status);")
-        # ... other indexes ...
+        # Hot-path indexes live in db_migrations.py
         print("   ... Indexes are ready.")
         
         # Schema versioning
@@ -107,6 +109,12 @@ def setup_database():
         print("   ... Schema version is set.")
 
         conn.commit()
+
+        # Versioned migrations on top of the base schema
+        print("8. Applying migrations...")
+        applied = apply_migrations(conn)
+        print(f"   ... Schema is at version {get_schema_version(conn)} ({len(applied)} migration(s) applied).")
+
         print("\n--- Database setup successfully completed! ---")
 
     except Exception as e:
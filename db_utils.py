@@ -1,9 +1,15 @@
 # file: db_utils.py
 import sqlite3
 import json
+import time
+from contextlib import contextmanager
 from datetime import datetime, timezone
 import os
 
+from metrics import DB_COMMIT_SECONDS
+
+_TRADE_INSERT_COMMIT_SECONDS = DB_COMMIT_SECONDS.labels("managed_trades")
+
 # Путь к БД теперь берется из env-переменной для гибкости и тестирования
 # Фикстура в conftest.py будет подменять эту переменную во время тестов.
 # DATABASE_FILE = os.getenv("DATABASE_FILE", "trades.sqlite") # <-- DELETE THIS LINE
@@ -24,6 +30,27 @@ def get_db_connection() -> sqlite3.Connection:
     conn.row_factory = sqlite3.Row
     return conn
 
+@contextmanager
+def timed_transaction(conn: sqlite3.Connection, commit_seconds):
+    """
+    Как `with conn:` (commit при успехе, rollback при ошибке - в том числе при ошибке
+    самого COMMIT, например "database is locked"), но время COMMIT, даже неудачного,
+    пишется в серию гистограммы db_commit_seconds.
+    """
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    started = time.perf_counter()
+    try:
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        commit_seconds.observe_since(started)
+
 def create_managed_trade(instruction: dict, total_qty: float) -> int:
     """
     Создает запись о новой сделке в таблице managed_trades.
@@ -33,8 +60,8 @@ def create_managed_trade(instruction: dict, total_qty: float) -> int:
     try:
         now_utc = datetime.now(timezone.utc).isoformat(timespec='microseconds')
         
-        # Используем `with conn:` для автоматического коммита или отката транзакции
-        with conn:
+        # Коммит или откат транзакции автоматически; время коммита - в метрики
+        with timed_transaction(conn, _TRADE_INSERT_COMMIT_SECONDS):
             cursor = conn.cursor()
             cursor.execute(
                 """
@@ -62,9 +89,27 @@ def create_managed_trade(instruction: dict, total_qty: float) -> int:
                 )
             )
             trade_id = cursor.lastrowid
+            insert_trade_targets(conn, trade_id, instruction['take_profits'], total_qty)
     finally:
         # Гарантированно закрываем соединение
         if conn:
             conn.close()
             
-    return trade_id
\ No newline at end of file
+    return trade_id
+
+def insert_trade_targets(conn: sqlite3.Connection, trade_id: int, take_profits: list, total_qty: float, tps_taken: int = 0):
+    """
+    Раскладывает лестницу тейк-профитов сделки по строкам таблицы trade_targets.
+    Объем делится поровну между целями; первые `tps_taken` целей считаются уже выставленными.
+    Вызывается внутри транзакции вызывающего кода.
+    """
+    if not take_profits:
+        return
+    qty_per_target = total_qty / len(take_profits)
+    conn.executemany(
+        "INSERT OR IGNORE INTO trade_targets (trade_id, tp_index, price, qty, status) VALUES (?, ?, ?, ?, ?)",
+        [
+            (trade_id, index, float(price), qty_per_target, 'placed' if index < tps_taken else 'pending')
+            for index, price in enumerate(take_profits)
+        ]
+    )
@@ -0,0 +1,91 @@
+# file: equity_tracker.py
+import asyncio
+import os
+import sqlite3
+import time
+
+from db_utils import get_db_connection
+from risk_controls import RISK_STATE, observe_equity
+from trade_logger import log_event
+
+# --- Константы ---
+# Как часто снимать капитал (секунды)
+EQUITY_SAMPLE_INTERVAL_SEC = float(os.getenv("EQUITY_SAMPLE_INTERVAL_SEC", "30"))
+# Сколько дней хранить снимки в equity_snapshots
+EQUITY_RETENTION_DAYS = int(os.getenv("EQUITY_RETENTION_DAYS", "30"))
+# Старые снимки удаляются раз в столько проходов
+_PRUNE_EVERY_SAMPLES = 120
+
+
+async def sample_equity(client) -> dict:
+    """
+    Снимок капитала: баланс кошелька + нереализованный PnL открытых позиций.
+    None, если баланс получить не удалось (обертка возвращает 0 при ошибке).
+    """
+    wallet_balance = await client.get_usdt_balance()
+    if not wallet_balance or wallet_balance <= 0:
+        return None
+    positions = await client.fetch_open_positions()
+    unrealized_pnl = sum(float(p.get('unrealizedPnl') or 0) for p in positions.values())
+    return {
+        "ts_ms": int(time.time() * 1000),
+        "wallet_balance": wallet_balance,
+        "unrealized_pnl": unrealized_pnl,
+        "equity": wallet_balance + unrealized_pnl,
+    }
+
+
+def record_equity_sample(sample: dict, conn: sqlite3.Connection = None):
+    """Пишет снимок в equity_snapshots и обновляет капитал, пик и базу дня в RISK_STATE."""
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO equity_snapshots (ts_ms, wallet_balance, unrealized_pnl, equity) VALUES (?, ?, ?, ?)",
+                (sample["ts_ms"], sample["wallet_balance"], sample["unrealized_pnl"], sample["equity"]),
+            )
+    except sqlite3.Error as e:
+        print(f"ERROR in record_equity_sample: {e}")
+    finally:
+        if own_conn:
+            conn.close()
+    # Память обновляем и при ошибке записи: расчет размера не должен зависеть от диска
+    RISK_STATE.record_equity(sample["equity"], at=sample["ts_ms"] / 1000)
+    observe_equity(sample["equity"])
+
+
+def prune_equity_snapshots(retention_days: int = EQUITY_RETENTION_DAYS, conn: sqlite3.Connection = None) -> int:
+    """Удаляет снимки старше retention_days. Возвращает число удаленных строк."""
+    cutoff_ms = int((time.time() - retention_days * 86400) * 1000)
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        with conn:
+            return conn.execute("DELETE FROM equity_snapshots WHERE ts_ms < ?", (cutoff_ms,)).rowcount
+    finally:
+        if own_conn:
+            conn.close()
+
+
+async def equity_tracker_loop(bybit_client, interval: float = EQUITY_SAMPLE_INTERVAL_SEC):
+    """
+    Фоновый снимок капитала по расписанию. Обработчик сигналов берет размер счета
+    из RISK_STATE.live_equity() и не ходит за балансом на биржу.
+    """
+    log_event("EQUITY_TRACKER_STARTED", {"interval": interval})
+    samples = 0
+    while True:
+        try:
+            sample = await sample_equity(bybit_client)
+            if sample is not None:
+                record_equity_sample(sample)
+                samples += 1
+                if samples % _PRUNE_EVERY_SAMPLES == 1:
+                    prune_equity_snapshots()
+        except asyncio.CancelledError:
+            log_event("EQUITY_TRACKER_STOPPED", {})
+            raise
+        except Exception as e:
+            log_event("EQUITY_TRACKER_ERROR", {"error": str(e)})
+        await asyncio.sleep(interval)
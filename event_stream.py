@@ -0,0 +1,252 @@
+# file: event_stream.py
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import time
+from collections import deque
+
+import aiohttp
+
+from db_utils import get_db_connection, timed_transaction
+from fill_ledger import FILLS_COMMIT_SECONDS, fill_from_ws, record_fills
+from trade_logger import log_event
+from trade_store import TradeStore
+from position_manager import reconcile_and_manage, symbol_lock
+
+# --- Константы ---
+BYBIT_WS_PUBLIC_URL = os.getenv("BYBIT_WS_PUBLIC_URL", "wss://stream-testnet.bybit.com/v5/public/linear")
+BYBIT_WS_PRIVATE_URL = os.getenv("BYBIT_WS_PRIVATE_URL", "wss://stream-testnet.bybit.com/v5/private")
+PRIVATE_TOPICS = ("order", "execution", "position")
+WS_PING_INTERVAL = 20
+WS_RECONNECT_MAX_DELAY = 30
+
+
+class BybitStreamClient:
+    """
+    Одно WebSocket-соединение с Bybit v5: авторизация (для приватного потока), подписка,
+    пинг и переподключение с экспоненциальной задержкой. Каждое сообщение с данными
+    передается в `on_message`; после каждого (пере)подключения вызывается `on_connect`.
+    """
+
+    def __init__(self, url: str, on_message, topics=(), api_key: str = None, secret_key: str = None, on_connect=None):
+        self.url = url
+        self.on_message = on_message
+        self.on_connect = on_connect
+        self.topics = list(topics)
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self._ws = None
+        self._stopped = False
+
+    @property
+    def connected(self) -> bool:
+        return self._ws is not None and not self._ws.closed
+
+    async def subscribe(self, topics: list):
+        new_topics = [t for t in topics if t not in self.topics]
+        if not new_topics:
+            return
+        self.topics.extend(new_topics)
+        if self.connected:
+            await self._ws.send_json({"op": "subscribe", "args": new_topics})
+
+    async def run(self):
+        delay = 1
+        async with aiohttp.ClientSession() as session:
+            while not self._stopped:
+                try:
+                    async with session.ws_connect(self.url) as ws:
+                        self._ws = ws
+                        await self._handshake(ws)
+                        delay = 1
+                        if self.on_connect:
+                            await self.on_connect()
+                        await self._read_loop(ws)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    log_event("WS_STREAM_ERROR", {"url": self.url, "error": str(e)})
+                finally:
+                    self._ws = None
+                if self._stopped:
+                    break
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, WS_RECONNECT_MAX_DELAY)
+
+    async def stop(self):
+        self._stopped = True
+        if self._ws is not None:
+            await self._ws.close()
+
+    async def _handshake(self, ws):
+        if self.api_key and self.secret_key:
+            expires = int((time.time() + 10) * 1000)
+            signature = hmac.new(
+                self.secret_key.encode(), f"GET/realtime{expires}".encode(), hashlib.sha256
+            ).hexdigest()
+            await ws.send_json({"op": "auth", "args": [self.api_key, expires, signature]})
+            reply = await ws.receive_json(timeout=10)
+            if not reply.get("success"):
+                raise ConnectionError(f"WebSocket auth rejected: {reply}")
+        if self.topics:
+            await ws.send_json({"op": "subscribe", "args": self.topics})
+
+    async def _read_loop(self, ws):
+        last_ping = time.monotonic()
+        while True:
+            try:
+                msg = await ws.receive(timeout=WS_PING_INTERVAL)
+            except asyncio.TimeoutError:
+                msg = None
+            if time.monotonic() - last_ping >= WS_PING_INTERVAL:
+                await ws.send_json({"op": "ping"})
+                last_ping = time.monotonic()
+            if msg is None:
+                continue
+            if msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.ERROR):
+                return
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            payload = json.loads(msg.data)
+            # Ответы на служебные операции (subscribe/pong) не содержат topic
+            if "topic" in payload:
+                await self.on_message(payload)
+
+
+class EventDrivenManager:
+    """
+    Событийный режим менеджера позиций (см. раздел EDA в README).
+
+    Приватные потоки order/execution/position и публичные tickers.* запускают сверку
+    сделок затронутого символа сразу по приходу события - тем же reconcile_and_manage и
+    под тем же замком символа, что и цикл опроса. Опрос остается страховкой с большим интервалом.
+    """
+
+    def __init__(self, bybit_client, store: TradeStore, api_key: str, secret_key: str,
+                 public_url: str = BYBIT_WS_PUBLIC_URL, private_url: str = BYBIT_WS_PRIVATE_URL):
+        self.bybit_client = bybit_client
+        self.store = store
+        self.positions = {}          # symbol -> live_position в формате fetch_open_positions
+        self.positions_known = False
+        self.reaction_ms = deque(maxlen=1000)
+        self._pending_symbols = set()
+        self._tasks = set()
+        self.private_stream = BybitStreamClient(
+            private_url, self.handle_private_message, topics=PRIVATE_TOPICS,
+            api_key=api_key, secret_key=secret_key, on_connect=self.resync_positions
+        )
+        self.public_stream = BybitStreamClient(public_url, self.handle_public_message)
+
+    async def run(self):
+        """Запускает оба потока; завершается отменой задачи."""
+        log_event("EVENT_MANAGER_STARTED", {})
+        await self.sync_ticker_subscriptions()
+        try:
+            await asyncio.gather(self.private_stream.run(), self.public_stream.run())
+        finally:
+            await self.private_stream.stop()
+            await self.public_stream.stop()
+            log_event("EVENT_MANAGER_STOPPED", {})
+
+    async def resync_positions(self):
+        """После (пере)подключения берем снимок позиций по REST: события за время разрыва потеряны."""
+        self.bybit_client.invalidate_reads('positions')
+        self.positions = dict(await self.bybit_client.fetch_open_positions())
+        self.positions_known = True
+        await self.sync_ticker_subscriptions()
+        for symbol in {t['symbol'] for t in self.store.open_trades()}:
+            self.trigger(symbol)
+
+    async def sync_ticker_subscriptions(self):
+        symbols = sorted({t['symbol'] for t in self.store.open_trades()})
+        await self.public_stream.subscribe([f"tickers.{s}" for s in symbols])
+
+    # --- Обработчики сообщений ---
+    async def handle_private_message(self, message: dict):
+        received = time.perf_counter()
+        topic = message.get("topic", "")
+        data = message.get("data") or []
+        if topic == "position":
+            for item in data:
+                symbol = item.get("symbol")
+                if not symbol:
+                    continue
+                if float(item.get("size") or 0) == 0:
+                    self.positions.pop(symbol, None)
+                else:
+                    self.positions[symbol] = {
+                        'symbol': symbol,
+                        'entryPrice': item.get("entryPrice") or item.get("avgPrice"),
+                        'contracts': item.get("size"),
+                        'markPrice': item.get("markPrice"),
+                        'side': 'long' if item.get("side") == "Buy" else 'short',
+                    }
+                self.trigger(symbol, received)
+        elif topic in ("order", "execution"):
+            if topic == "execution":
+                # Исполнения сразу попадают в журнал: закрытию сделки не нужен запрос к бирже
+                conn = get_db_connection()
+                try:
+                    with timed_transaction(conn, FILLS_COMMIT_SECONDS):
+                        record_fills(conn, [fill_from_ws(item) for item in data])
+                finally:
+                    conn.close()
+                # Исполнение меняет позицию и баланс: кэшированные чтения устарели
+                self.bybit_client.invalidate_reads()
+            for symbol in {item.get("symbol") for item in data if item.get("symbol")}:
+                self.trigger(symbol, received)
+
+    async def handle_public_message(self, message: dict):
+        received = time.perf_counter()
+        data = message.get("data") or {}
+        symbol = data.get("symbol")
+        mark_price = data.get("markPrice")
+        # Дельта-сообщения тикера могут не содержать markPrice
+        if not symbol or mark_price is None:
+            return
+        position = self.positions.get(symbol)
+        if position is not None:
+            position['markPrice'] = mark_price
+        if self._tp_crossed(symbol, float(mark_price)):
+            self.trigger(symbol, received)
+
+    def _tp_crossed(self, symbol: str, mark_price: float) -> bool:
+        for trade in self.store.open_trades():
+            if trade['symbol'] != symbol or trade['status'] != 'ACTIVE':
+                continue
+            pending = [t for t in self.store.get_targets(trade['id']) if t['status'] == 'pending']
+            if not pending:
+                continue
+            next_tp = pending[0]['price']
+            if (trade['side'] == 'long' and mark_price >= next_tp) or (trade['side'] == 'short' and mark_price <= next_tp):
+                return True
+        return False
+
+    # --- Сверка ---
+    def trigger(self, symbol: str, received: float = None):
+        """Планирует сверку символа; повторные события до ее начала схлопываются в одну."""
+        if not self.positions_known or symbol in self._pending_symbols:
+            return
+        self._pending_symbols.add(symbol)
+        task = asyncio.create_task(self._reconcile_symbol(symbol, received or time.perf_counter()))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _reconcile_symbol(self, symbol: str, received: float):
+        async with symbol_lock(symbol):
+            self._pending_symbols.discard(symbol)
+            trades = [t for t in self.store.open_trades() if t['symbol'] == symbol]
+            try:
+                for trade in trades:
+                    await reconcile_and_manage(trade, self.positions.get(symbol), self.bybit_client, self.store)
+            finally:
+                self.store.flush()
+        if trades:
+            self.reaction_ms.append((time.perf_counter() - received) * 1000)
+
+    async def drain(self):
+        """Дожидается завершения всех запланированных сверок (для тестов и остановки)."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
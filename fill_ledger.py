@@ -0,0 +1,225 @@
+# file: fill_ledger.py
+import asyncio
+import sqlite3
+from datetime import datetime, timezone
+
+from db_utils import get_db_connection, timed_transaction
+from metrics import DB_COMMIT_SECONDS
+from trade_logger import log_event
+
+# --- Константы ---
+# Bybit v5 отдает не больше 100 исполнений за запрос
+FILLS_PAGE_LIMIT = 100
+# Предохранитель от бесконечной подкачки за один вызов sync_fills
+FILLS_MAX_PAGES = 50
+
+STOP_LOSS_ORDER_TYPES = ('StopLoss', 'PartialStopLoss', 'TrailingStop')
+TAKE_PROFIT_ORDER_TYPES = ('TakeProfit', 'PartialTakeProfit')
+FILLS_COMMIT_SECONDS = DB_COMMIT_SECONDS.labels("fills")
+
+_INSERT_FILL_SQL = """
+    INSERT OR IGNORE INTO fills (fill_id, symbol, order_id, side, price, qty, fee, stop_order_type, timestamp_ms)
+    VALUES (:fill_id, :symbol, :order_id, :side, :price, :qty, :fee, :stop_order_type, :timestamp_ms)
+"""
+
+
+# ==============================================================================
+# 1. НОРМАЛИЗАЦИЯ
+# ==============================================================================
+def fill_from_ccxt(trade: dict) -> dict:
+    """Исполнение из fetch_my_trades (формат ccxt). Возвращает None для неполных записей."""
+    info = trade.get('info') or {}
+    fill_id = trade.get('id') or info.get('execId')
+    if not fill_id or trade.get('timestamp') is None or trade.get('price') is None:
+        return None
+    return {
+        'fill_id': str(fill_id),
+        'symbol': info.get('symbol') or trade.get('symbol'),
+        'order_id': trade.get('order') or info.get('orderId'),
+        'side': trade['side'],
+        'price': float(trade['price']),
+        'qty': float(trade.get('amount') or 0),
+        'fee': float((trade.get('fee') or {}).get('cost') or 0),
+        'stop_order_type': info.get('stopOrderType') or None,
+        'timestamp_ms': int(trade['timestamp']),
+    }
+
+
+def fill_from_ws(item: dict) -> dict:
+    """Исполнение из приватного WebSocket-топика execution (сырой формат Bybit v5)."""
+    if not item.get('execId') or not item.get('execTime'):
+        return None
+    return {
+        'fill_id': str(item['execId']),
+        'symbol': item['symbol'],
+        'order_id': item.get('orderId'),
+        'side': item['side'].lower(),
+        'price': float(item['execPrice']),
+        'qty': float(item['execQty']),
+        'fee': float(item.get('execFee') or 0),
+        'stop_order_type': item.get('stopOrderType') or None,
+        'timestamp_ms': int(item['execTime']),
+    }
+
+
+# ==============================================================================
+# 2. ЗАПИСЬ И ПРИВЯЗКА К СДЕЛКАМ
+# ==============================================================================
+def record_fills(conn: sqlite3.Connection, fills: list) -> int:
+    """
+    Добавляет исполнения в журнал (повторы игнорируются по fill_id) и привязывает
+    к сделкам все непривязанные, а не только новые: исполнение могло прийти раньше,
+    чем id его ордера попал в БД. Вызывающий управляет транзакцией. Возвращает число новых строк.
+    """
+    fills = [f for f in fills if f is not None]
+    before = conn.total_changes
+    conn.executemany(_INSERT_FILL_SQL, fills)
+    inserted = conn.total_changes - before
+    attribute_fills(conn)
+    return inserted
+
+
+def attribute_fills(conn: sqlite3.Connection):
+    """
+    Привязывает еще не привязанные исполнения к сделкам по id ордера: ордера на вход,
+    выставленные цели и стоп-лосс. Исполнения без известного ордера (стоп уровня позиции,
+    ручное закрытие) достаются единственной активной сделке символа, если она одна.
+    Вызывается и после записи id ордеров; без непривязанных исполнений ничего не делает.
+    """
+    if conn.execute("SELECT 1 FROM fills WHERE trade_id IS NULL LIMIT 1").fetchone() is None:
+        return
+    conn.execute("""
+        UPDATE fills SET kind = 'entry',
+            trade_id = (SELECT e.trade_id FROM entry_orders e WHERE e.exchange_order_id = fills.order_id)
+        WHERE trade_id IS NULL AND order_id IN (SELECT exchange_order_id FROM entry_orders)
+    """)
+    conn.execute("""
+        UPDATE fills SET kind = 'tp',
+            trade_id = (SELECT t.trade_id FROM trade_targets t WHERE t.order_id = fills.order_id)
+        WHERE trade_id IS NULL AND order_id IN (SELECT order_id FROM trade_targets WHERE order_id IS NOT NULL)
+    """)
+    conn.execute("""
+        UPDATE fills SET kind = 'sl',
+            trade_id = (SELECT m.id FROM managed_trades m WHERE m.exchange_sl_order_id = fills.order_id)
+        WHERE trade_id IS NULL AND order_id IN (SELECT exchange_sl_order_id FROM managed_trades WHERE exchange_sl_order_id IS NOT NULL)
+    """)
+    conn.execute(f"""
+        UPDATE fills SET
+            trade_id = (SELECT m.id FROM managed_trades m WHERE m.symbol = fills.symbol AND m.status = 'ACTIVE'),
+            kind = CASE
+                WHEN stop_order_type IN ({",".join("'%s'" % t for t in STOP_LOSS_ORDER_TYPES)}) THEN 'sl'
+                WHEN stop_order_type IN ({",".join("'%s'" % t for t in TAKE_PROFIT_ORDER_TYPES)}) THEN 'tp'
+                ELSE 'other' END
+        WHERE trade_id IS NULL
+          AND (SELECT COUNT(*) FROM managed_trades m WHERE m.symbol = fills.symbol AND m.status = 'ACTIVE') = 1
+    """)
+
+
+# ==============================================================================
+# 3. ИНКРЕМЕНТАЛЬНАЯ СИНХРОНИЗАЦИЯ С БИРЖЕЙ
+# ==============================================================================
+def _initial_since_ms(conn: sqlite3.Connection, symbol: str):
+    """Без курсора начинаем с момента создания самой старой незакрытой сделки символа."""
+    row = conn.execute(
+        "SELECT MIN(created_at) FROM managed_trades WHERE symbol = ? AND status != 'CLOSED'", (symbol,)
+    ).fetchone()
+    if not row or not row[0]:
+        return None
+    return int(datetime.fromisoformat(row[0]).timestamp() * 1000)
+
+
+async def sync_symbol_fills(bybit_client, symbol: str) -> int:
+    """
+    Догружает исполнения одного символа с сохраненного курсора до текущего момента.
+    Bybit отдает исполнения от новых к старым, поэтому окно [курсор, сейчас] читается
+    страницами назад: верхняя граница (until) сдвигается к самому старому исполнению
+    прочитанной страницы (включительно: дубли отсекает fill_id). Курсор переносится на
+    самое новое исполнение только после того, как окно прочитано целиком; иначе
+    следующий вызов начнет с прежнего курсора. Возвращает число новых исполнений.
+    """
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT since_ms FROM fill_cursors WHERE symbol = ?", (symbol,)).fetchone()
+        since = row['since_ms'] if row else _initial_since_ms(conn, symbol)
+    finally:
+        conn.close()
+
+    new_fills = 0
+    newest_ts = None
+    until = None
+    for _ in range(FILLS_MAX_PAGES):
+        page = await bybit_client.fetch_my_trades(symbol, since=since, limit=FILLS_PAGE_LIMIT, until=until) or []
+        fills = [f for f in (fill_from_ccxt(t) for t in page) if f is not None]
+        if fills:
+            conn = get_db_connection()
+            try:
+                with timed_transaction(conn, FILLS_COMMIT_SECONDS):
+                    new_fills += record_fills(conn, fills)
+            finally:
+                conn.close()
+            newest_ts = max([newest_ts or 0] + [f['timestamp_ms'] for f in fills])
+        if len(page) < FILLS_PAGE_LIMIT or not fills:
+            break
+        oldest_ts = min(f['timestamp_ms'] for f in fills)
+        # Целая страница с одной меткой времени: сдвигаем границу, иначе зациклимся
+        until = oldest_ts - 1 if until == oldest_ts else oldest_ts
+    else:
+        log_event("FILL_SYNC_INCOMPLETE", {"symbol": symbol, "since": since, "until": until})
+        return new_fills
+
+    if newest_ts is not None:
+        conn = get_db_connection()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO fill_cursors (symbol, since_ms, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(symbol) DO UPDATE SET since_ms = MAX(since_ms, excluded.since_ms), "
+                    "updated_at = excluded.updated_at",
+                    (symbol, newest_ts, datetime.now(timezone.utc).isoformat(timespec='microseconds'))
+                )
+        finally:
+            conn.close()
+    return new_fills
+
+
+async def sync_fills(bybit_client, symbols: list) -> int:
+    """Синхронизирует журнал исполнений для списка символов. Ошибки одного символа не мешают остальным."""
+    async def sync_one(symbol: str) -> int:
+        try:
+            return await sync_symbol_fills(bybit_client, symbol)
+        except Exception as e:
+            log_event("FILL_SYNC_ERROR", {"symbol": symbol, "error": str(e)})
+            return 0
+
+    return sum(await asyncio.gather(*[sync_one(symbol) for symbol in symbols]))
+
+
+# ==============================================================================
+# 4. PnL И ПРИЧИНА ЗАКРЫТИЯ ИЗ ЖУРНАЛА
+# ==============================================================================
+def trade_fill_summary(conn: sqlite3.Connection, trade_id: int) -> dict:
+    """
+    Одним агрегатом: реализованный PnL (денежный поток продаж минус покупок минус комиссии -
+    для полностью закрытой позиции это и есть результат), объемы входа/выхода и тип
+    последнего исполнения на выход.
+    """
+    row = conn.execute("""
+        SELECT
+            COUNT(*) AS fills,
+            COALESCE(SUM(CASE side WHEN 'sell' THEN price * qty ELSE -price * qty END), 0)
+                - COALESCE(SUM(fee), 0) AS realized_pnl,
+            COALESCE(SUM(CASE WHEN kind = 'entry' THEN qty END), 0) AS entry_qty,
+            COALESCE(SUM(CASE WHEN kind != 'entry' THEN qty END), 0) AS exit_qty,
+            (SELECT kind FROM fills l WHERE l.trade_id = :trade_id AND l.kind != 'entry'
+             ORDER BY l.timestamp_ms DESC, l.rowid DESC LIMIT 1) AS last_exit_kind
+        FROM fills WHERE trade_id = :trade_id
+    """, {"trade_id": trade_id}).fetchone()
+    return dict(row)
+
+
+CLOSE_REASONS = {'sl': 'SL_HIT', 'tp': 'TP_HIT', 'other': 'MANUAL_OR_OTHER'}
+
+def close_reason_from_summary(summary: dict) -> str:
+    if not summary['fills']:
+        return "UNKNOWN_NO_TRADES"
+    return CLOSE_REASONS.get(summary['last_exit_kind'], "MANUAL_OR_OTHER")
@@ -0,0 +1,140 @@
+# file: latency.py
+import os
+import random
+
+from trade_logger import log_event
+
+# --- Константы ---
+# Точность гистограммы: 64 подкорзины на каждое удвоение значения, относительная ошибка квантиля < 1/64 (~1.6%)
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+# Верхняя граница измерений (мкс); все, что дольше, попадает в последнюю корзину
+MAX_TRACKABLE_US = 120_000_000
+# Доля вызовов, которые дополнительно пишутся в trade_log как спаны (0 - выключено)
+LATENCY_SPAN_SAMPLE_RATE = float(os.getenv("LATENCY_SPAN_SAMPLE_RATE", "0"))
+# Вызовы дольше этого порога (мс) пишутся в trade_log всегда (0 - выключено)
+LATENCY_SLOW_SPAN_MS = float(os.getenv("LATENCY_SLOW_SPAN_MS", "2000"))
+
+OUTCOME_OK = "ok"
+OUTCOME_ERROR = "error"
+OUTCOME_RATE_LIMITED = "rate_limited"
+
+
+def _bucket_index(value_us: int) -> int:
+    """Лог-линейная корзина в стиле HdrHistogram: линейно до 128 мкс, дальше 64 подкорзины на удвоение."""
+    if value_us < SUB_BUCKET_COUNT:
+        return value_us
+    shift = value_us.bit_length() - SUB_BUCKET_BITS
+    return shift * SUB_BUCKET_HALF + (value_us >> shift)
+
+
+def _bucket_upper_value(index: int) -> int:
+    """Наибольшее значение (мкс), попадающее в корзину - его и отдаем как квантиль."""
+    if index < SUB_BUCKET_COUNT:
+        return index
+    shift = index // SUB_BUCKET_HALF - 1
+    sub_bucket = index - shift * SUB_BUCKET_HALF
+    return ((sub_bucket + 1) << shift) - 1
+
+
+_BUCKET_COUNT = _bucket_index(MAX_TRACKABLE_US) + 1
+
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек с фиксированным набором корзин: запись - пара битовых операций
+    и инкремент элемента списка, без выделения памяти. Квантили считаются только при чтении.
+    """
+
+    __slots__ = ("counts", "count", "total_us", "max_us")
+
+    def __init__(self):
+        self.counts = [0] * _BUCKET_COUNT
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def record(self, value_us: int):
+        if value_us > MAX_TRACKABLE_US:
+            value_us = MAX_TRACKABLE_US
+        elif value_us < 0:
+            value_us = 0
+        self.counts[_bucket_index(value_us)] += 1
+        self.count += 1
+        self.total_us += value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    def percentiles(self, quantiles: tuple) -> list:
+        """Значения (мкс) для отсортированных по возрастанию квантилей за один проход по корзинам."""
+        if not self.count:
+            return [0] * len(quantiles)
+        targets = [max(1, int(q * self.count + 0.999999)) for q in quantiles]
+        result = []
+        seen = 0
+        position = 0
+        for index, bucket_count in enumerate(self.counts):
+            if not bucket_count:
+                continue
+            seen += bucket_count
+            while position < len(targets) and seen >= targets[position]:
+                result.append(min(_bucket_upper_value(index), self.max_us))
+                position += 1
+            if position == len(targets):
+                break
+        return result
+
+    def summary(self) -> dict:
+        p50, p90, p99 = self.percentiles((0.5, 0.9, 0.99))
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_us / self.count / 1000, 3) if self.count else 0.0,
+            "p50_ms": p50 / 1000,
+            "p90_ms": p90 / 1000,
+            "p99_ms": p99 / 1000,
+            "max_ms": self.max_us / 1000,
+        }
+
+
+class LatencyRecorder:
+    """Гистограммы по (эндпоинт, исход) и выборочные спаны в trade_log."""
+
+    def __init__(self, span_sample_rate: float = LATENCY_SPAN_SAMPLE_RATE, slow_span_ms: float = LATENCY_SLOW_SPAN_MS,
+                 span_sink=None):
+        self.span_sample_rate = span_sample_rate
+        self.slow_span_us = slow_span_ms * 1000
+        self._span_sink = span_sink
+        self._histograms = {}   # (endpoint, outcome) -> LatencyHistogram
+
+    def record(self, endpoint: str, outcome: str, elapsed_ns: int, lane: int = None, queued_ns: int = 0):
+        value_us = elapsed_ns // 1000
+        histogram = self._histograms.get((endpoint, outcome))
+        if histogram is None:
+            histogram = self._histograms[(endpoint, outcome)] = LatencyHistogram()
+        histogram.record(value_us)
+        if (self.slow_span_us and value_us >= self.slow_span_us) or \
+                (self.span_sample_rate and random.random() < self.span_sample_rate):
+            self._emit_span(endpoint, outcome, value_us, lane, queued_ns)
+
+    def _emit_span(self, endpoint: str, outcome: str, value_us: int, lane: int, queued_ns: int):
+        sink = self._span_sink or log_event
+        sink("EXCHANGE_SPAN", {"endpoint": endpoint, "outcome": outcome, "duration_ms": round(value_us / 1000, 3),
+                               "lane": lane, "queued_ms": round(queued_ns / 1e6, 3)})
+
+    def histogram(self, endpoint: str, outcome: str = OUTCOME_OK) -> LatencyHistogram:
+        return self._histograms.get((endpoint, outcome))
+
+    def snapshot(self) -> dict:
+        """{endpoint: {"calls", "errors", <исход>: сводка квантилей}}."""
+        result = {}
+        for (endpoint, outcome), histogram in sorted(self._histograms.items()):
+            entry = result.setdefault(endpoint, {"calls": 0, "errors": 0})
+            entry["calls"] += histogram.count
+            if outcome != OUTCOME_OK:
+                entry["errors"] += histogram.count
+            entry[outcome] = histogram.summary()
+        return result
+
+    def reset(self):
+        self._histograms.clear()
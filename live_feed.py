@@ -0,0 +1,200 @@
+# file: live_feed.py
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import Counter, Gauge
+
+# --- Константы ---
+FEED_TOPICS = ("trade", "price", "event")
+# Сколько последних событий хранится для переподключения с Last-Event-ID
+FEED_REPLAY_SIZE = int(os.getenv("FEED_REPLAY_SIZE", "2000"))
+# Буфер одного клиента; переполнивший его клиент отключается (и может переподключиться с Last-Event-ID)
+FEED_CLIENT_BUFFER = int(os.getenv("FEED_CLIENT_BUFFER", "500"))
+FEED_MAX_CLIENTS = int(os.getenv("FEED_MAX_CLIENTS", "50"))
+# Комментарий-пинг, чтобы прокси не закрывали тихое соединение (секунды)
+FEED_HEARTBEAT_SEC = float(os.getenv("FEED_HEARTBEAT_SEC", "15"))
+
+FEED_DROPPED_CLIENTS = Counter("feed_dropped_clients_total", "Live feed clients disconnected for falling behind.")
+FEED_SUBSCRIBERS = Gauge("feed_subscribers", "Connected live feed clients.")
+
+
+class FeedEvent:
+    """Событие шины. JSON строится один раз, при первой отправке, и переиспользуется для всех клиентов."""
+
+    __slots__ = ("seq", "topic", "data", "ts", "_sse")
+
+    def __init__(self, seq: int, topic: str, data: dict, ts: float):
+        self.seq = seq
+        self.topic = topic
+        self.data = data
+        self.ts = ts
+        self._sse = None
+
+    def sse(self) -> str:
+        if self._sse is None:
+            payload = json.dumps({"ts": self.ts, **self.data}, default=str)
+            self._sse = f"id: {self.seq}\nevent: {self.topic}\ndata: {payload}\n\n"
+        return self._sse
+
+
+class Subscription:
+    """Ограниченный буфер одного клиента. Наполняется шиной, читается корутиной отправки."""
+
+    def __init__(self, topics: frozenset, maxsize: int):
+        self.topics = topics
+        self.maxsize = maxsize
+        self.overflowed = False
+        self.reset = False
+        self._buffer = deque()
+        self._wake = asyncio.Event()
+
+    def push(self, event: FeedEvent) -> bool:
+        """False, если буфер переполнен: клиент не успевает, и шина его отключает."""
+        if len(self._buffer) >= self.maxsize:
+            self.overflowed = True
+        else:
+            self._buffer.append(event)
+        self._wake.set()
+        return not self.overflowed
+
+    async def drain(self, timeout: float) -> list:
+        """Все накопленные события; пустой список, если за timeout ничего не пришло."""
+        if not self._buffer and not self.overflowed:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._wake.clear()
+        events = list(self._buffer)
+        self._buffer.clear()
+        return events
+
+
+class FeedBus:
+    """
+    Внутрипроцессная шина push-уведомлений: переходы сделок, живые цены и события trade_log.
+
+    publish вызывается из горячих путей и из любых потоков (писатель журнала, сторожевой поток),
+    поэтому без подписчиков это одно добавление в кольцевой буфер. Доставка подписчикам
+    идет в потоке цикла событий; из других потоков - через call_soon_threadsafe.
+    Последние FEED_REPLAY_SIZE событий доступны для переподключения по номеру.
+    """
+
+    def __init__(self, replay_size: int = FEED_REPLAY_SIZE, max_clients: int = FEED_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._history = deque(maxlen=replay_size)
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Сбрасывает историю и подписчиков (тесты, перезапуск приложения в том же процессе)."""
+        self.last_seq = 0
+        self._history.clear()
+        self._subscribers = []
+        self._loop = None
+        self._loop_thread = None
+        self.published = 0
+        self.dropped_clients = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, topic: str, data: dict):
+        with self._lock:
+            self.last_seq += 1
+            event = FeedEvent(self.last_seq, topic, data, time.time())
+            self._history.append(event)
+            self.published += 1
+            if not self._subscribers:
+                return
+        if threading.get_ident() == self._loop_thread:
+            self._deliver(event)
+        else:
+            try:
+                self._loop.call_soon_threadsafe(self._deliver, event)
+            except RuntimeError:
+                # Цикл событий уже закрыт - доставлять некому
+                pass
+
+    def _deliver(self, event: FeedEvent):
+        for subscription in list(self._subscribers):
+            if event.topic in subscription.topics and not subscription.push(event):
+                self._drop(subscription)
+
+    def _drop(self, subscription: Subscription):
+        if subscription in self._subscribers:
+            self._subscribers.remove(subscription)
+            self.dropped_clients += 1
+            FEED_DROPPED_CLIENTS.inc()
+
+    def subscribe(self, topics=FEED_TOPICS, last_event_id: int = None, maxsize: int = FEED_CLIENT_BUFFER) -> Subscription:
+        """
+        Новый подписчик; вызывается в цикле событий. С last_event_id буфер сразу заполняется
+        пропущенными событиями. Если их уже нет в истории (или они не влезают в буфер),
+        подписка помечается reset: клиенту нужно перечитать состояние целиком.
+        """
+        unknown = set(topics) - set(FEED_TOPICS)
+        if unknown:
+            raise ValueError(f"Unknown feed topics {sorted(unknown)}. Expected some of {FEED_TOPICS}.")
+        if len(self._subscribers) >= self.max_clients:
+            raise RuntimeError(f"Too many feed clients (max {self.max_clients}).")
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        subscription = Subscription(frozenset(topics), maxsize)
+        with self._lock:
+            if last_event_id is not None:
+                oldest = self._history[0].seq if self._history else self.last_seq + 1
+                missed = [e for e in self._history if e.seq > last_event_id and e.topic in subscription.topics]
+                if oldest > last_event_id + 1 or len(missed) > maxsize:
+                    subscription.reset = True
+                    missed = missed[-maxsize:]
+                for event in missed:
+                    subscription.push(event)
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self.subscriber_count,
+            "published": self.published,
+            "dropped_clients": self.dropped_clients,
+            "replay_from": self._history[0].seq if self._history else None,
+        }
+
+
+async def sse_stream(bus: FeedBus, subscription: Subscription, heartbeat: float = FEED_HEARTBEAT_SEC):
+    """
+    Поток Server-Sent Events для одной подписки. Отставший клиент получает событие overflow
+    с номером последнего доставленного события и отключается: переподключение с этим
+    Last-Event-ID догрузит пропущенное из истории шины.
+    """
+    last_seq = None
+    try:
+        if subscription.reset:
+            yield "event: reset\ndata: {}\n\n"
+        while True:
+            events = await subscription.drain(heartbeat)
+            for event in events:
+                last_seq = event.seq
+                yield event.sse()
+            if subscription.overflowed:
+                yield f"event: overflow\ndata: {json.dumps({'last_event_id': last_seq})}\n\n"
+                return
+            if not events:
+                yield ": ping\n\n"
+    finally:
+        bus.unsubscribe(subscription)
+
+
+FEED = FeedBus()
+FEED_SUBSCRIBERS.set_function(lambda: FEED.subscriber_count)
@@ -1,8 +1,10 @@
 # file: main.py
 import asyncio
 import os
+import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 import sqlite3
 
@@ -10,28 +12,76 @@ load_dotenv()
 
 from bybit_wrapper import AsyncBybitWrapper
 from risk_sizer import calculate_position_size
-from risk_controls import check_daily_drawdown
-from trade_logger import log_event
+from risk_controls import check_daily_drawdown, RISK_STATE
+from equity_tracker import equity_tracker_loop, record_equity_sample, sample_equity
+from trade_logger import log_event, start_log_writer, stop_log_writer, get_log_writer
 from signal_parser import parse_pentagon_signal
 from db_utils import get_db_connection, create_managed_trade 
-from position_manager import position_manager_loop, place_entry_grid
+from position_manager import (
+    position_manager_loop, place_entry_grid, MANAGER_LOOP_SLEEP_INTERVAL, MANAGER_SAFETY_NET_INTERVAL
+)
+from trade_store import TRADE_STORE
+from reconcile_scheduler import ReconcileScheduler
 from models import TradeInstruction
+from metrics import (
+    REGISTRY, PROMETHEUS_CONTENT_TYPE, SIGNALS_TOTAL, SIGNAL_SECONDS, SIGNAL_STAGES, OPEN_TRADES, QUEUE_DEPTH,
+    EQUITY_USD, DRAWDOWN_FROM_PEAK, monitor_event_loop_lag
+)
+from rate_limiter import LANE_NAMES
+from profiling import PROFILER, PROFILING_ENABLED, SLOW_CALLBACK_MS, SlowCallbackWatchdog
+from live_feed import FEED, FEED_TOPICS, sse_stream
+from performance import performance_summary
 
 API_KEY = os.getenv("BYBIT_KEY")
 API_SECRET = os.getenv("BYBIT_SECRET")
 if not API_KEY or not API_SECRET:
     raise RuntimeError("BYBIT_KEY and BYBIT_SECRET must be set in .env file")
+# polling - только периодическая сверка; events - WebSocket-события + редкая страховочная сверка
+MANAGER_MODE = os.getenv("MANAGER_MODE", "polling")
+# fixed - все сделки каждые MANAGER_LOOP_SLEEP_INTERVAL; adaptive - по дедлайнам ReconcileScheduler
+MANAGER_SCHEDULING = os.getenv("MANAGER_SCHEDULING", "fixed")
+# Внутридневная просадка капитала от пика (с нереализованным PnL), после которой новые сигналы отклоняются
+MAX_DRAWDOWN_FROM_PEAK_PCT = float(os.getenv("MAX_DRAWDOWN_FROM_PEAK_PCT", "0.05"))
 
 bybit_client = AsyncBybitWrapper(api_key=API_KEY, secret_key=API_SECRET, testnet=True)
 background_tasks = set()
+event_manager = None
+
+# Гейджи считаются в момент выгрузки /metrics
+OPEN_TRADES.set_function(lambda: len(TRADE_STORE.open_trades()))
+EQUITY_USD.set_function(lambda: RISK_STATE.equity or 0.0)
+DRAWDOWN_FROM_PEAK.set_function(RISK_STATE.drawdown_from_peak)
+QUEUE_DEPTH.labels("trade_log").set_function(lambda: get_log_writer().qsize() if get_log_writer() else 0)
+for _lane, _lane_name in LANE_NAMES.items():
+    QUEUE_DEPTH.labels(f"rate_limiter_{_lane_name}").set_function(
+        lambda lane=_lane: bybit_client.rate_limiter.queue_depth(lane)
+    )
+
+def start_background_task(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global event_manager
+    start_log_writer()
     await bybit_client.init()
-    manager_task = asyncio.create_task(position_manager_loop(bybit_client))
-    background_tasks.add(manager_task)
-    manager_task.add_done_callback(background_tasks.discard)
-    log_event("APP_STARTUP", {"message": "Position manager started."})
+    RISK_STATE.load()
+    scheduler = ReconcileScheduler() if MANAGER_SCHEDULING == "adaptive" else None
+    if MANAGER_MODE == "events":
+        from event_stream import EventDrivenManager
+        event_manager = EventDrivenManager(bybit_client, TRADE_STORE, API_KEY, API_SECRET)
+        start_background_task(event_manager.run())
+        start_background_task(position_manager_loop(bybit_client, sleep_interval=MANAGER_SAFETY_NET_INTERVAL, scheduler=scheduler))
+    else:
+        start_background_task(position_manager_loop(bybit_client, sleep_interval=MANAGER_LOOP_SLEEP_INTERVAL, scheduler=scheduler))
+    start_background_task(equity_tracker_loop(bybit_client))
+    start_background_task(monitor_event_loop_lag())
+    if SLOW_CALLBACK_MS > 0:
+        start_background_task(SlowCallbackWatchdog(SLOW_CALLBACK_MS).run())
+    log_event("APP_STARTUP", {"message": "Position manager started.", "mode": MANAGER_MODE})
     
     yield
     
@@ -40,6 +90,8 @@ async def lifespan(app: FastAPI):
         task.cancel()
     await bybit_client.close()
     log_event("APP_SHUTDOWN_COMPLETE", {"message": "Bybit client closed."})
+    # Дописываем остаток очереди журнала в БД перед выходом
+    stop_log_writer()
 
 app = FastAPI(title="Stateful Trading Bot", version="1.0.0", lifespan=lifespan)
 
@@ -51,15 +103,42 @@ def get_db():
         db.close()
 
 @app.post("/process_signal", status_code=202)
-@check_daily_drawdown(max_loss_pct=0.03) 
+@check_daily_drawdown(max_loss_pct=0.03, max_drawdown_from_peak_pct=MAX_DRAWDOWN_FROM_PEAK_PCT)
 async def process_signal(raw_text: str, db: sqlite3.Connection = Depends(get_db)): 
+    started = time.perf_counter()
+    result = "error"
+    try:
+        handler = _process_signal(raw_text, started)
+        # Не взведенный профилировщик стоит одного сравнения
+        response = await (PROFILER.profile("signal", handler) if PROFILER.target == "signal" else handler)
+        result = "accepted"
+        return response
+    except HTTPException:
+        result = "rejected"
+        raise
+    finally:
+        SIGNALS_TOTAL.labels(result).inc()
+        SIGNAL_SECONDS.observe_since(started)
+
+async def _process_signal(raw_text: str, stage_start: float) -> dict:
     instruction = parse_pentagon_signal(raw_text)
+    stage_start = SIGNAL_STAGES["parse"].observe_since(stage_start)
     if not instruction:
         raise HTTPException(status_code=400, detail="Signal parsing failed.")
     
     log_event("INSTRUCTION_PARSED", instruction.model_dump())
 
-    equity = await bybit_client.get_usdt_balance()
+    # Капитал берется из фонового снимка; на биржу идем, только если снимок устарел
+    equity = RISK_STATE.live_equity()
+    if equity is None:
+        sample = await sample_equity(bybit_client)
+        if not sample:
+            # Размер против нулевого капитала дал бы ложный "size is zero" - честно сообщаем о сбое
+            log_event("EQUITY_UNAVAILABLE", {"symbol": instruction.symbol})
+            raise HTTPException(status_code=503, detail="Equity unavailable: could not fetch account balance.")
+        equity = sample["equity"]
+        record_equity_sample(sample)
+    stage_start = SIGNAL_STAGES["balance_fetch"].observe_since(stage_start)
     precision = bybit_client.get_market_precision(instruction.symbol)
     if not precision or 'amount' not in precision:
         raise HTTPException(status_code=500, detail="Could not get precision for symbol {instruction.symbol}")
@@ -71,16 +150,123 @@ async def process_signal(raw_text: str, db: sqlite3.Connection = Depends(get_db)
         risk_pct=instruction.risk_pct
     )
     final_qty = total_qty * instruction.size_fraction
+    stage_start = SIGNAL_STAGES["sizing"].observe_since(stage_start)
     if final_qty <= 0:
         raise HTTPException(status_code=400, detail="Calculated position size is zero.")
 
+    # Сделка проверяется против уже открытого риска портфеля (in-memory, без запросов к БД)
+    if not TRADE_STORE.loaded:
+        TRADE_STORE.load()
+    risk_usd = final_qty * abs(risk_entry_price - instruction.stop_loss)
+    portfolio_check = TRADE_STORE.exposure.check(instruction.symbol, instruction.side, risk_usd, equity)
+    stage_start = SIGNAL_STAGES["portfolio_check"].observe_since(stage_start)
+    if not portfolio_check["allowed"]:
+        log_event("PORTFOLIO_LIMIT_REJECTED", {"symbol": instruction.symbol, "side": instruction.side,
+                                               "risk_usd": round(risk_usd, 2), **portfolio_check})
+        raise HTTPException(
+            status_code=429, detail=f"Portfolio risk limit reached: {'; '.join(portfolio_check['violations'])}"
+        )
+
     trade_id = create_managed_trade(instruction.model_dump(), final_qty) 
+    SIGNAL_STAGES["db_insert"].observe_since(stage_start)
     log_event("TRADE_CREATED_IN_DB", {"trade_id": trade_id, "qty": final_qty})
+    # Менеджер держит сделки в памяти - сообщаем ему о новой
+    TRADE_STORE.load_trade(trade_id)
+    if event_manager is not None:
+        await event_manager.sync_ticker_subscriptions()
 
-    task = asyncio.create_task(
+    start_background_task(
         place_entry_grid(trade_id, final_qty, instruction.model_dump(), bybit_client)
     )
-    background_tasks.add(task)
-    task.add_done_callback(background_tasks.discard)
 
-    return {"status": "accepted", "trade_id": trade_id}
\ No newline at end of file
+    return {"status": "accepted", "trade_id": trade_id}
+
+
+@app.get("/rate_limits")
+async def rate_limits():
+    """Состояние лимитера запросов к бирже: бюджет, глубина очередей и ожидание по полосам."""
+    return bybit_client.rate_limit_metrics()
+
+@app.get("/exposure")
+async def exposure():
+    """Открытая экспозиция и риск до стопов по символам, сторонам и корреляционным группам."""
+    return TRADE_STORE.exposure.snapshot()
+
+@app.get("/latency")
+async def latency():
+    """Гистограммы задержек вызовов биржи по эндпоинтам и исходам (ok / error / rate_limited)."""
+    return bybit_client.latency_metrics()
+
+@app.get("/metrics")
+async def metrics():
+    """Счетчики, гейджи и гистограммы стадий в текстовом формате Prometheus."""
+    return PlainTextResponse(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/feed")
+async def feed(topics: str = ",".join(FEED_TOPICS), since: int = None, last_event_id: int = Header(None)):
+    """
+    Живая лента (Server-Sent Events): переходы сделок (trade), живые цены (price) и события журнала (event).
+    Переподключение с Last-Event-ID (или ?since=) догружает пропущенные события из истории шины.
+    """
+    try:
+        subscription = FEED.subscribe(
+            [t.strip() for t in topics.split(",") if t.strip()],
+            last_event_id=since if since is not None else last_event_id,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return StreamingResponse(
+        sse_stream(FEED, subscription), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/performance")
+async def performance():
+    """Статистика закрытых сделок из материализованных агрегатов: итог, дни, символы, причины закрытия."""
+    return performance_summary()
+
+@app.get("/feed/stats")
+async def feed_stats():
+    return FEED.stats()
+
+def _require_profiling():
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled. Set PROFILING_ENABLED=1.")
+
+@app.post("/debug/profile")
+async def arm_profiler(target: str = "signal", calls: int = 10, mode: str = "cprofile"):
+    """Взводит профилировщик на следующие `calls` вызовов /process_signal (signal) или проходов менеджера (cycle)."""
+    _require_profiling()
+    try:
+        return PROFILER.arm(target, calls, mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/debug/profile")
+async def profiler_status():
+    _require_profiling()
+    return PROFILER.status()
+
+@app.delete("/debug/profile")
+async def disarm_profiler():
+    _require_profiling()
+    try:
+        PROFILER.disarm()
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PROFILER.status()
+
+@app.get("/debug/profile/report")
+async def profiler_report(format: str = "pstats"):
+    """Отчет последней сессии: pstats или collapsed stacks (вход для flamegraph.pl / speedscope)."""
+    _require_profiling()
+    try:
+        return PlainTextResponse(PROFILER.render(format))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
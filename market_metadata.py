@@ -0,0 +1,115 @@
+# file: market_metadata.py
+import hashlib
+import json
+import os
+import time
+
+from quantization import quantizer_for, step_decimals
+from trade_logger import log_event
+
+# --- Константы ---
+# Пустое значение отключает снапшот (каждый старт грузит рынки с биржи)
+MARKET_SNAPSHOT_FILE = "market_snapshot.json"
+# Через сколько секунд снапшот считается устаревшим и обновляется в фоне
+MARKET_SNAPSHOT_TTL = float(os.getenv("MARKET_SNAPSHOT_TTL", str(6 * 3600)))
+# Пауза перед повтором после неудачного фонового обновления
+MARKET_REFRESH_RETRY_SEC = float(os.getenv("MARKET_REFRESH_RETRY_SEC", "60"))
+# Версия формата файла: снапшот другой версии игнорируется
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+# ==============================================================================
+# 1. КВАНТОВАТЕЛИ РЫНКОВ
+# ==============================================================================
+def market_quantizer(market: dict) -> dict:
+    """Предрассчитанные шаги, знаки, квантователи (quantization.StepQuantizer) и лимиты одного рынка ccxt."""
+    precision = market.get('precision') or {}
+    limits = market.get('limits') or {}
+    price_step = precision.get('price')
+    amount_step = precision.get('amount')
+    return {
+        'price': price_step,
+        'amount': amount_step,
+        'price_decimals': step_decimals(price_step) if price_step else None,
+        'amount_decimals': step_decimals(amount_step) if amount_step else None,
+        'price_quantizer': quantizer_for(price_step) if price_step else None,
+        'amount_quantizer': quantizer_for(amount_step) if amount_step else None,
+        'min_amount': (limits.get('amount') or {}).get('min'),
+        'min_cost': (limits.get('cost') or {}).get('min'),
+        'contract_size': market.get('contractSize'),
+    }
+
+
+def build_quantizers(markets: dict) -> dict:
+    """
+    Индекс квантователей по унифицированному символу и по id биржи ('BTC/USDT:USDT' и 'BTCUSDT'),
+    чтобы округление в горячем пути было одним обращением к словарю.
+    """
+    quantizers = {}
+    for symbol, market in markets.items():
+        quantizer = market_quantizer(market)
+        quantizers[symbol] = quantizer
+        # id неоднозначен между spot и linear: приоритет у бессрочных контрактов
+        market_id = market.get('id')
+        if market_id and (market_id not in quantizers or market.get('swap')):
+            quantizers[market_id] = quantizer
+    return quantizers
+
+
+# ==============================================================================
+# 2. СНАПШОТ НА ДИСКЕ
+# ==============================================================================
+def markets_etag(markets: dict) -> str:
+    """Отпечаток содержимого рынков: меняется только при реальных изменениях метаданных."""
+    payload = json.dumps(markets, sort_keys=True, default=str).encode()
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+class MarketSnapshot:
+    """Файл с метаданными рынков (markets + currencies ccxt), их отпечатком и временем загрузки."""
+
+    def __init__(self, path: str, ttl: float = MARKET_SNAPSHOT_TTL, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self._clock = clock
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def load(self, testnet: bool) -> dict:
+        """Читает снапшот. None, если файла нет, он поврежден или снят с другой сети/версии."""
+        if not self.enabled or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log_event("MARKET_SNAPSHOT_ERROR", {"path": self.path, "error": str(e)})
+            return None
+        if data.get('version') != SNAPSHOT_FORMAT_VERSION or data.get('testnet') != testnet or not data.get('markets'):
+            return None
+        return data
+
+    def save(self, markets: dict, currencies: dict, testnet: bool, etag: str = None) -> str:
+        """Атомарно записывает снапшот (через временный файл). Возвращает отпечаток."""
+        etag = etag or markets_etag(markets)
+        data = {
+            'version': SNAPSHOT_FORMAT_VERSION,
+            'etag': etag,
+            'fetched_at': self._clock(),
+            'testnet': testnet,
+            'markets': markets,
+            'currencies': currencies or {},
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, default=str)
+        os.replace(tmp_path, self.path)
+        return etag
+
+    def age(self, data: dict) -> float:
+        return max(0.0, self._clock() - float(data.get('fetched_at') or 0))
+
+    def is_fresh(self, data: dict) -> bool:
+        return self.age(data) < self.ttl
@@ -0,0 +1,233 @@
+# file: metrics.py
+import asyncio
+import os
+import time
+from bisect import bisect_left
+
+# --- Константы ---
+# Границы корзин (секунды): от долей миллисекунды до десятков секунд
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Как часто замерять задержку цикла событий (секунды)
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.5"))
+METRICS_PREFIX = "springbot_"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ==============================================================================
+# 1. ТИПЫ МЕТРИК
+# ==============================================================================
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    Семейство метрик с необязательными метками. Дочерние серии создаются один раз на набор
+    значений меток и дальше переиспользуются: в горячем пути нет выделений памяти.
+    """
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry=None):
+        self.name = METRICS_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            # Серия без меток видна в выгрузке сразу, с нулем
+            self.labels()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._children.items():
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: tuple, child) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class _GaugeChild:
+    __slots__ = ("_value", "_function")
+
+    def __init__(self):
+        self._value = 0.0
+        self._function = None
+
+    def set(self, value: float):
+        self._value = value
+
+    def set_function(self, function):
+        """Значение вычисляется при выгрузке метрик (глубины очередей, число сделок)."""
+        self._function = function
+
+    @property
+    def value(self) -> float:
+        if self._function is not None:
+            try:
+                return self._function()
+            except Exception:
+                return float("nan")
+        return self._value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # последняя - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def observe_since(self, start: float) -> float:
+        """Записывает время с `start` (perf_counter) и возвращает текущий момент - удобно для цепочки стадий."""
+        now = time.perf_counter()
+        self.observe(now - start)
+        return now
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS,
+                 registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def observe_since(self, start: float) -> float:
+        return self.labels().observe_since(start)
+
+    def _render_child(self, values: tuple, child) -> list:
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += bucket_count
+            le = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ==============================================================================
+# 2. МЕТРИКИ ПРИЛОЖЕНИЯ
+# ==============================================================================
+SIGNALS_TOTAL = Counter("signals_total", "Signals received by /process_signal, by result.", ("result",))
+SIGNAL_SECONDS = Histogram("signal_seconds", "/process_signal handling time after the drawdown check.")
+SIGNAL_STAGE_SECONDS = Histogram(
+    "signal_stage_seconds",
+    "Time spent in each /process_signal stage (parse, drawdown_check, balance_fetch, sizing, portfolio_check, "
+    "db_insert, grid_placement).",
+    ("stage",),
+)
+# Серии стадий создаются заранее: в обработчике - только обращение к словарю
+SIGNAL_STAGES = {
+    stage: SIGNAL_STAGE_SECONDS.labels(stage)
+    for stage in ("parse", "drawdown_check", "balance_fetch", "sizing", "portfolio_check", "db_insert", "grid_placement")
+}
+MANAGER_CYCLES_TOTAL = Counter("manager_cycles_total", "Completed position manager reconcile passes.")
+MANAGER_CYCLE_SECONDS = Histogram("manager_cycle_seconds", "Duration of one position manager reconcile pass.")
+DB_COMMIT_SECONDS = Histogram("db_commit_seconds", "SQLite COMMIT latency (db_utils.timed_transaction), by call site.", ("site",))
+OPEN_TRADES = Gauge("open_trades", "Trades not yet CLOSED held by the position manager.")
+QUEUE_DEPTH = Gauge("queue_depth", "Items waiting in internal queues.", ("queue",))
+EQUITY_USD = Gauge("equity_usd", "Latest equity snapshot: wallet balance plus unrealized PnL.")
+DRAWDOWN_FROM_PEAK = Gauge("drawdown_from_peak_ratio", "Current equity drawdown from the intraday peak.")
+EVENT_LOOP_LAG_SECONDS = Gauge("event_loop_lag_seconds", "Most recent event loop scheduling delay.")
+EVENT_LOOP_LAG_HISTOGRAM = Histogram("event_loop_lag_histogram_seconds", "Event loop scheduling delay.")
+
+
+# ==============================================================================
+# 3. ЗАДЕРЖКА ЦИКЛА СОБЫТИЙ
+# ==============================================================================
+async def monitor_event_loop_lag(interval: float = EVENT_LOOP_LAG_INTERVAL):
+    """Насколько позже запланированного просыпается sleep - столько же ждут все корутины."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        EVENT_LOOP_LAG_SECONDS.set(lag)
+        EVENT_LOOP_LAG_HISTOGRAM.observe(lag)
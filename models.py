@@ -1,6 +1,6 @@
 # file: models.py
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 class TradeInstruction(BaseModel):
     """Структурированная инструкция, полученная из парсера."""
@@ -13,4 +13,7 @@ class TradeInstruction(BaseModel):
     risk_pct: float = Field(..., gt=0, le=0.1)
     size_fraction: float = Field(default=1.0, ge=0.1, le=1.0)
     take_profits: List[float]
-    move_sl_to_be_after_tp_index: int = 1
\ No newline at end of file
+    move_sl_to_be_after_tp_index: int = 1
+    # Сетка входа: количество ордеров и распределение цен/объемов (см. position_manager.build_entry_grid)
+    grid_orders: int = Field(default=3, ge=1, le=20)
+    grid_distribution: Literal['linear', 'geometric', 'weighted'] = 'linear'
\ No newline at end of file
@@ -0,0 +1,355 @@
+# file: paper_exchange.py
+import asyncio
+import csv
+import itertools
+import random
+import time
+
+import ccxt.async_support as ccxt
+
+# --- Константы ---
+PAPER_STARTING_BALANCE = 10_000.0
+PAPER_TAKER_FEE = 0.00055
+PAPER_MAKER_FEE = 0.0002
+PAPER_DEFAULT_PRECISION = {'amount': 0.001, 'price': 0.01}
+
+# Методы, которые в AsyncBybitWrapper глотают ошибки и возвращают значение по умолчанию;
+# остальные пробрасывают исключение (см. bybit_wrapper.py)
+_SWALLOWING_METHODS = {
+    'get_usdt_balance': 0.0, 'fetch_open_positions': {}, 'fetch_ticker_price': 0.0, 'fetch_tickers': {},
+}
+
+
+class PriceFeed:
+    """
+    Воспроизводимая лента цен: упорядоченный список тиков (timestamp_ms, symbol, price).
+    Один и тот же feed можно прогонять многократно - тики не изменяются.
+    """
+
+    def __init__(self, ticks: list):
+        self.ticks = sorted(ticks, key=lambda t: t[0])
+
+    def __iter__(self):
+        return iter(self.ticks)
+
+    def __len__(self) -> int:
+        return len(self.ticks)
+
+    @classmethod
+    def from_csv(cls, path: str) -> "PriceFeed":
+        """CSV с колонками timestamp_ms,symbol,price."""
+        with open(path, newline='') as f:
+            return cls([(int(r['timestamp_ms']), r['symbol'], float(r['price'])) for r in csv.DictReader(f)])
+
+    @classmethod
+    def random_walk(cls, start_prices: dict, steps: int, sigma: float = 0.002, step_ms: int = 1000,
+                    seed: int = 0, start_ms: int = None) -> "PriceFeed":
+        """Геометрическое случайное блуждание для каждого символа; один seed - одна и та же лента."""
+        rng = random.Random(seed)
+        start_ms = int(time.time() * 1000) if start_ms is None else start_ms
+        ticks = []
+        prices = dict(start_prices)
+        for step in range(steps):
+            ts = start_ms + step * step_ms
+            for symbol in prices:
+                prices[symbol] *= 1 + rng.gauss(0, sigma)
+                ticks.append((ts, symbol, round(prices[symbol], 8)))
+        return cls(ticks)
+
+
+class PaperExchange:
+    """
+    Биржа в памяти процесса с интерфейсом AsyncBybitWrapper (для нагрузочных прогонов
+    и сквозных тестов без сети).
+
+    Модель исполнения - по цене последнего тика, без стакана:
+        лимитный buy исполняется при цене <= лимита, sell - при цене >= лимита (по цене лимита);
+        лимитка, пересекающая цену при выставлении, исполняется сразу как taker;
+        условный ордер (stopLossPrice/triggerPrice) срабатывает при пересечении триггера
+        и исполняется по рынку; параметр stopLoss ставит стоп уровня позиции;
+        reduce-only ордер урезается до размера позиции и отменяется, если позиции нет.
+    Позиция одна на символ (one-way режим), как на Bybit.
+    Задержка (latency_ms: число или (min, max)) и доля отказов (error_rate) внедряются
+    в каждый вызов; отказ ведет себя так же, как ошибка в обертке.
+    """
+
+    def __init__(self, balance: float = PAPER_STARTING_BALANCE, precision: dict = None,
+                 latency_ms=0.0, error_rate: float = 0.0, error_methods: set = None, seed: int = 0,
+                 taker_fee: float = PAPER_TAKER_FEE, maker_fee: float = PAPER_MAKER_FEE, clock=None):
+        self.balance = balance
+        self.precision = dict(precision or PAPER_DEFAULT_PRECISION)
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.error_methods = set(error_methods) if error_methods else None
+        self.taker_fee = taker_fee
+        self.maker_fee = maker_fee
+        self._clock = clock or (lambda: int(time.time() * 1000))
+        self._rng = random.Random(seed)
+        self._ids = itertools.count(1)
+        self.prices = {}            # symbol -> последняя цена
+        self.positions = {}         # symbol -> {'side', 'contracts', 'entryPrice'}
+        self.position_stops = {}    # symbol -> цена стопа уровня позиции
+        self.orders = {}            # order_id -> ордер
+        self.trades = []            # история исполнений (формат ccxt fetch_my_trades)
+        self.calls = {}             # method -> количество вызовов
+        self.injected_errors = 0
+
+    # --- Латентность и отказы ---
+    async def _enter(self, method: str):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        latency = self.latency_ms
+        if isinstance(latency, (tuple, list)):
+            latency = self._rng.uniform(*latency)
+        if latency:
+            await asyncio.sleep(latency / 1000)
+        if self.error_rate and (self.error_methods is None or method in self.error_methods) \
+                and self._rng.random() < self.error_rate:
+            self.injected_errors += 1
+            raise ccxt.NetworkError(f"Injected failure in {method}")
+
+    async def _call(self, method: str, action):
+        """Выполняет действие с внедренными задержкой/отказом и контрактом ошибок обертки."""
+        try:
+            await self._enter(method)
+            return action()
+        except Exception:
+            if method in _SWALLOWING_METHODS:
+                return type(_SWALLOWING_METHODS[method])()
+            raise
+
+    # --- Лента цен ---
+    def set_price(self, symbol: str, price: float, timestamp_ms: int = None):
+        """Применяет тик: обновляет mark price и исполняет все ордера, которые он задел."""
+        self.prices[symbol] = price
+        self._match(symbol, timestamp_ms)
+
+    async def replay(self, feed: PriceFeed, on_tick=None):
+        """Прогоняет ленту; `on_tick(ts, symbol, price)` вызывается после каждого тика (например, цикл менеджера)."""
+        for ts, symbol, price in feed:
+            self.set_price(symbol, price, ts)
+            if on_tick is not None:
+                await on_tick(ts, symbol, price)
+
+    # --- Интерфейс AsyncBybitWrapper: служебные методы ---
+    async def init(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def set_leverage(self, symbol: str, leverage: int):
+        pass
+
+    async def set_margin_mode(self, symbol: str, margin_mode: str):
+        pass
+
+    def get_market_precision(self, symbol: str) -> dict:
+        return dict(self.precision)
+
+    def invalidate_reads(self, *cache_endpoints: str):
+        pass
+
+    def rate_limit_metrics(self) -> dict:
+        return {"calls": dict(self.calls), "injected_errors": self.injected_errors}
+
+    # --- Чтение ---
+    async def get_usdt_balance(self) -> float:
+        return await self._call('get_usdt_balance', lambda: self.balance)
+
+    async def fetch_open_positions(self, settle_coin: str = 'USDT') -> dict:
+        return await self._call('fetch_open_positions', lambda: {
+            symbol: self._position_view(symbol) for symbol, p in self.positions.items() if p['contracts'] > 0
+        })
+
+    async def fetch_ticker_price(self, symbol: str) -> float:
+        return await self._call('fetch_ticker_price', lambda: float(self.prices.get(symbol, 0.0)))
+
+    async def fetch_tickers(self, symbols: list) -> dict:
+        return await self._call('fetch_tickers', lambda: {s: self.prices[s] for s in symbols if s in self.prices})
+
+    async def fetch_my_trades(self, symbol: str, since: int = None, limit: int = 20, until: int = None) -> list:
+        def select():
+            # Как Bybit: самые новые `limit` исполнений окна [since, until], в порядке времени (как после ccxt)
+            rows = [t for t in self.trades if t['info']['symbol'] == symbol
+                    and (since is None or t['timestamp'] >= since) and (until is None or t['timestamp'] <= until)]
+            return [dict(t) for t in rows[-limit:]]
+        return await self._call('fetch_my_trades', select)
+
+    # --- Запись ---
+    async def create_market_order_with_sl(self, symbol: str, side: str, amount: float, stop_loss_price: float) -> dict:
+        try:
+            return await self.create_order(symbol, 'market', side, amount, params={'stopLoss': stop_loss_price})
+        except Exception as e:
+            return {'symbol': symbol, 'error': str(e)}
+
+    async def create_order(self, symbol: str, type: str, side: str, amount: float, price: float = None, params={}) -> dict:
+        return await self._call('create_order', lambda: self._place(symbol, type, side, amount, price, params))
+
+    async def create_limit_order(self, symbol: str, side: str, amount: float, price: float, params={}) -> dict:
+        return await self._call('create_limit_order', lambda: self._place(symbol, 'limit', side, amount, price, params))
+
+    async def create_orders(self, orders: list) -> list:
+        """Пакет: одна задержка на весь запрос, отказ - на уровне отдельных ордеров (как в обертке)."""
+        try:
+            await self._enter('create_orders')
+        except Exception as e:
+            return [{'symbol': o['symbol'], 'side': o['side'], 'amount': o['amount'], 'price': o.get('price'),
+                     'error': str(e)} for o in orders]
+        results = []
+        for o in orders:
+            try:
+                results.append(self._place(o['symbol'], o['type'], o['side'], o['amount'], o.get('price'), o.get('params', {})))
+            except Exception as e:
+                results.append({'symbol': o['symbol'], 'side': o['side'], 'amount': o['amount'],
+                                'price': o.get('price'), 'error': str(e)})
+        return results
+
+    async def edit_order(self, order_id: str, symbol: str, new_price: float) -> dict:
+        def edit():
+            order = self.orders.get(order_id)
+            if order is None or order['status'] != 'open':
+                raise ccxt.OrderNotFound(f"Order {order_id} is not open")
+            if order['trigger_price'] is not None:
+                order['trigger_price'] = new_price
+            else:
+                order['price'] = new_price
+            self._match(symbol)
+            return self._order_view(order)
+        return await self._call('edit_order', edit)
+
+    async def cancel_order(self, order_id: str, symbol: str) -> dict:
+        def cancel():
+            order = self.orders.get(order_id)
+            if order is None or order['status'] != 'open':
+                raise ccxt.OrderNotFound(f"Order {order_id} is not open")
+            order['status'] = 'canceled'
+            return self._order_view(order)
+        try:
+            return await self._call('cancel_order', cancel)
+        except Exception as e:
+            # Как в обертке: ордер мог уже исполниться, исключение не пробрасываем
+            return {'order_id': order_id, 'symbol': symbol, 'error': str(e), 'not_found': isinstance(e, ccxt.OrderNotFound)}
+
+    # --- Модель исполнения ---
+    def _place(self, symbol: str, type: str, side: str, amount: float, price: float, params: dict) -> dict:
+        params = params or {}
+        if symbol not in self.prices:
+            raise ccxt.BadSymbol(f"No price for {symbol}")
+        if side not in ('buy', 'sell'):
+            raise ccxt.InvalidOrder(f"Invalid order side '{side}'")
+        if amount <= 0:
+            raise ccxt.InvalidOrder("Order amount must be positive")
+        trigger = params.get('stopLossPrice') or params.get('triggerPrice')
+        order = {
+            'id': str(next(self._ids)), 'symbol': symbol, 'type': type, 'side': side, 'amount': float(amount),
+            'price': float(price) if price is not None else None, 'trigger_price': float(trigger) if trigger else None,
+            'reduce_only': bool(params.get('reduceOnly')), 'status': 'open', 'filled': 0.0,
+            'stop_order_type': 'StopLoss' if params.get('stopLossPrice') else ('Stop' if trigger else ''),
+        }
+        self.orders[order['id']] = order
+        if params.get('stopLoss'):
+            self.position_stops[symbol] = float(params['stopLoss'])
+        if order['trigger_price'] is None:
+            if type == 'market':
+                self._fill(order, self.prices[symbol], taker=True)
+            elif self._limit_crossed(order, self.prices[symbol]):
+                # Пересекающая лимитка исполняется сразу по лучшей для нас из двух цен
+                fill_price = min(order['price'], self.prices[symbol]) if side == 'buy' else max(order['price'], self.prices[symbol])
+                self._fill(order, fill_price, taker=True)
+        return self._order_view(order)
+
+    @staticmethod
+    def _limit_crossed(order: dict, price: float) -> bool:
+        return price <= order['price'] if order['side'] == 'buy' else price >= order['price']
+
+    @staticmethod
+    def _trigger_crossed(order: dict, price: float) -> bool:
+        # Стоп на продажу (защита лонга) срабатывает при падении, на покупку - при росте
+        return price <= order['trigger_price'] if order['side'] == 'sell' else price >= order['trigger_price']
+
+    def _match(self, symbol: str, timestamp_ms: int = None):
+        price = self.prices[symbol]
+        for order in [o for o in self.orders.values() if o['symbol'] == symbol and o['status'] == 'open']:
+            if order['trigger_price'] is not None:
+                if self._trigger_crossed(order, price):
+                    self._fill(order, price, taker=True, timestamp_ms=timestamp_ms)
+            elif order['type'] == 'limit' and self._limit_crossed(order, price):
+                self._fill(order, order['price'], taker=False, timestamp_ms=timestamp_ms)
+
+        stop = self.position_stops.get(symbol)
+        position = self.positions.get(symbol)
+        if stop is not None and position and position['contracts'] > 0:
+            hit = price <= stop if position['side'] == 'long' else price >= stop
+            if hit:
+                close_side = 'sell' if position['side'] == 'long' else 'buy'
+                order = {
+                    'id': str(next(self._ids)), 'symbol': symbol, 'type': 'market', 'side': close_side,
+                    'amount': position['contracts'], 'price': None, 'trigger_price': stop, 'reduce_only': True,
+                    'status': 'open', 'filled': 0.0, 'stop_order_type': 'StopLoss',
+                }
+                self.orders[order['id']] = order
+                self._fill(order, price, taker=True, timestamp_ms=timestamp_ms)
+
+    def _fill(self, order: dict, price: float, taker: bool, timestamp_ms: int = None):
+        symbol = order['symbol']
+        qty = order['amount'] - order['filled']
+        position = self.positions.get(symbol)
+        if order['reduce_only']:
+            closes = position and position['contracts'] > 0 and \
+                ((position['side'] == 'long') == (order['side'] == 'sell'))
+            if not closes:
+                order['status'] = 'canceled'
+                return
+            qty = min(qty, position['contracts'])
+
+        fee = qty * price * (self.taker_fee if taker else self.maker_fee)
+        self._apply_to_position(symbol, order['side'], qty, price)
+        self.balance -= fee
+        order['filled'] += qty
+        order['status'] = 'closed'
+
+        timestamp_ms = max(self._clock() if timestamp_ms is None else timestamp_ms,
+                           self.trades[-1]['timestamp'] if self.trades else 0)
+        fill_id = f"exec-{len(self.trades) + 1}"
+        self.trades.append({
+            'id': fill_id, 'order': order['id'], 'timestamp': timestamp_ms, 'symbol': symbol,
+            'side': order['side'], 'price': price, 'amount': qty, 'fee': {'cost': fee, 'currency': 'USDT'},
+            'info': {'symbol': symbol, 'execId': fill_id, 'orderId': order['id'], 'stopOrderType': order['stop_order_type']},
+        })
+
+    def _apply_to_position(self, symbol: str, side: str, qty: float, price: float):
+        direction = 'long' if side == 'buy' else 'short'
+        position = self.positions.get(symbol)
+        if not position or position['contracts'] == 0:
+            self.positions[symbol] = {'side': direction, 'contracts': qty, 'entryPrice': price}
+            return
+        if position['side'] == direction:
+            total = position['contracts'] + qty
+            position['entryPrice'] = (position['entryPrice'] * position['contracts'] + price * qty) / total
+            position['contracts'] = total
+            return
+
+        closed = min(qty, position['contracts'])
+        sign = 1 if position['side'] == 'long' else -1
+        self.balance += (price - position['entryPrice']) * closed * sign
+        position['contracts'] = round(position['contracts'] - closed, 12)
+        if position['contracts'] == 0:
+            self.position_stops.pop(symbol, None)
+        if qty > closed:
+            self.positions[symbol] = {'side': direction, 'contracts': qty - closed, 'entryPrice': price}
+
+    # --- Представления в формате обертки/ccxt ---
+    def _position_view(self, symbol: str) -> dict:
+        p = self.positions[symbol]
+        return {
+            'symbol': symbol, 'info': {'symbol': symbol}, 'side': p['side'], 'contracts': p['contracts'],
+            'entryPrice': p['entryPrice'], 'markPrice': self.prices.get(symbol),
+        }
+
+    @staticmethod
+    def _order_view(order: dict) -> dict:
+        return {
+            'id': order['id'], 'symbol': order['symbol'], 'type': order['type'], 'side': order['side'],
+            'amount': order['amount'], 'price': order['price'], 'triggerPrice': order['trigger_price'],
+            'reduceOnly': order['reduce_only'], 'status': order['status'], 'filled': order['filled'],
+        }
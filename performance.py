@@ -0,0 +1,152 @@
+# file: performance.py
+import argparse
+import sqlite3
+from datetime import datetime, timezone
+
+from db_utils import get_db_connection
+from risk_controls import trading_day
+
+# --- Константы ---
+# Срезы агрегатов: по торговому дню, символу, причине закрытия и итог по всем сделкам
+DIMENSIONS = ("day", "symbol", "close_reason", "all")
+_TOTAL_KEY = "all"
+
+_UPSERT_SQL = """
+    INSERT INTO perf_aggregates (dimension, key, trades, wins, losses, pnl, gross_win, gross_loss, sum_r, r_trades)
+    VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(dimension, key) DO UPDATE SET
+        trades = trades + 1,
+        wins = wins + excluded.wins,
+        losses = losses + excluded.losses,
+        pnl = pnl + excluded.pnl,
+        gross_win = gross_win + excluded.gross_win,
+        gross_loss = gross_loss + excluded.gross_loss,
+        sum_r = sum_r + excluded.sum_r,
+        r_trades = r_trades + excluded.r_trades
+"""
+
+
+def trade_r_multiple(trade: dict):
+    """Результат сделки в R: реализованный PnL / риск до исходного стопа. None, если риск неизвестен."""
+    qty = trade.get('executed_qty') or trade.get('total_qty') or 0
+    entry = trade.get('avg_entry_price')
+    stop = trade.get('initial_sl_price')
+    pnl = trade.get('realized_pnl')
+    if pnl is None or not entry or not stop or qty <= 0 or entry == stop:
+        return None
+    return pnl / (qty * abs(entry - stop))
+
+
+def _close_day(trade: dict) -> str:
+    try:
+        closed_at = datetime.fromisoformat(trade['updated_at'])
+        if closed_at.tzinfo is None:
+            closed_at = closed_at.replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        closed_at = datetime.now(timezone.utc)
+    return trading_day(closed_at).isoformat()
+
+
+def record_closed_trade(conn: sqlite3.Connection, trade: dict) -> bool:
+    """
+    Добавляет закрытую сделку во все срезы perf_aggregates. Вызывается внутри транзакции,
+    которая пишет статус CLOSED. Повторный вызов для той же сделки ничего не меняет
+    (учет ведется в perf_applied). Возвращает True, если сделка учтена сейчас.
+    """
+    applied = conn.execute("INSERT OR IGNORE INTO perf_applied (trade_id) VALUES (?)", (trade['id'],)).rowcount
+    if not applied:
+        return False
+    pnl = trade.get('realized_pnl') or 0.0
+    r_multiple = trade_r_multiple(trade)
+    values = (
+        1 if pnl > 0 else 0, 1 if pnl < 0 else 0, pnl, max(pnl, 0.0), max(-pnl, 0.0),
+        r_multiple or 0.0, 0 if r_multiple is None else 1,
+    )
+    keys = (
+        ("day", _close_day(trade)),
+        ("symbol", trade.get('symbol') or "?"),
+        ("close_reason", trade.get('close_reason') or "UNKNOWN"),
+        ("all", _TOTAL_KEY),
+    )
+    conn.executemany(_UPSERT_SQL, [(dimension, key) + values for dimension, key in keys])
+    return True
+
+
+def rebuild_aggregates(conn: sqlite3.Connection) -> int:
+    """Пересчитывает агрегаты с нуля по всем закрытым сделкам (бэкфилл, ремонт). Возвращает число сделок."""
+    conn.execute("DELETE FROM perf_aggregates")
+    conn.execute("DELETE FROM perf_applied")
+    cursor = conn.execute("SELECT * FROM managed_trades WHERE status = 'CLOSED' ORDER BY id")
+    columns = [d[0] for d in cursor.description]
+    count = 0
+    for row in cursor.fetchall():
+        count += record_closed_trade(conn, dict(zip(columns, row)))
+    return count
+
+
+def load_aggregates(conn: sqlite3.Connection, dimension: str = None) -> list:
+    """Строки агрегатов с производными показателями (win rate, средний R, profit factor)."""
+    sql = "SELECT * FROM perf_aggregates"
+    params = ()
+    if dimension is not None:
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension '{dimension}'. Expected one of {DIMENSIONS}.")
+        sql += " WHERE dimension = ?"
+        params = (dimension,)
+    cursor = conn.execute(sql + " ORDER BY dimension, key", params)
+    columns = [d[0] for d in cursor.description]
+    rows = []
+    for values in cursor.fetchall():
+        row = dict(zip(columns, values))
+        row['win_rate'] = row['wins'] / row['trades'] if row['trades'] else None
+        row['avg_r'] = row['sum_r'] / row['r_trades'] if row['r_trades'] else None
+        row['profit_factor'] = row['gross_win'] / row['gross_loss'] if row['gross_loss'] else None
+        rows.append(row)
+    return rows
+
+
+def performance_summary(conn: sqlite3.Connection = None) -> dict:
+    """Итог, срезы по символам и причинам закрытия, дневной PnL и кривая капитала (накопленный PnL по дням)."""
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        rows = load_aggregates(conn)
+    finally:
+        if own_conn:
+            conn.close()
+    by_dimension = {dimension: [] for dimension in DIMENSIONS}
+    for row in rows:
+        by_dimension[row.pop('dimension')].append(row)
+    cumulative = 0.0
+    equity_curve = []
+    for day in by_dimension['day']:
+        cumulative += day['pnl']
+        equity_curve.append({"day": day['key'], "cumulative_pnl": round(cumulative, 8)})
+    return {
+        "total": by_dimension['all'][0] if by_dimension['all'] else None,
+        "daily": by_dimension['day'],
+        "by_symbol": by_dimension['symbol'],
+        "by_close_reason": by_dimension['close_reason'],
+        "equity_curve": equity_curve,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialized performance aggregates over closed trades.")
+    parser.add_argument("command", choices=("rebuild", "show"))
+    args = parser.parse_args()
+    conn = get_db_connection()
+    try:
+        if args.command == "rebuild":
+            with conn:
+                count = rebuild_aggregates(conn)
+            print(f"Rebuilt performance aggregates from {count} closed trades.")
+        else:
+            for row in load_aggregates(conn):
+                print(row)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+# file: portfolio_risk.py
+import json
+import os
+
+import numpy as np
+
+
+def _optional_pct(name: str):
+    """Лимит из окружения в долях капитала; не задан - без ограничения (None)."""
+    value = os.getenv(name, "").strip()
+    return float(value) if value else None
+
+
+# --- Константы ---
+# Лимиты в долях капитала: суммарный риск до стопов, риск по символу (обе стороны)
+# и чистый направленный риск по корреляционной группе. Включаются явно: без переменной
+# окружения лимит не проверяется, и сигналы проходят как раньше
+PORTFOLIO_MAX_TOTAL_RISK_PCT = _optional_pct("PORTFOLIO_MAX_TOTAL_RISK_PCT")
+PORTFOLIO_MAX_SYMBOL_RISK_PCT = _optional_pct("PORTFOLIO_MAX_SYMBOL_RISK_PCT")
+PORTFOLIO_MAX_BUCKET_RISK_PCT = _optional_pct("PORTFOLIO_MAX_BUCKET_RISK_PCT")
+# Корреляционные группы: JSON {"BTCUSDT": "majors", "SOLUSDT": ["l1", "majors"]}.
+# Символы без явной группы попадают в DEFAULT_BUCKET: крипта в целом ходит вместе.
+PORTFOLIO_CORRELATION_BUCKETS = json.loads(os.getenv("PORTFOLIO_CORRELATION_BUCKETS", "{}"))
+DEFAULT_BUCKET = "crypto"
+_INITIAL_CAPACITY = 64
+
+
+def trade_risk(trade: dict) -> tuple:
+    """
+    (направление, риск до стопа в USD, номинал) сделки из строки managed_trades.
+    Риск = qty * расстояние от входа до текущего стопа в сторону убытка: стоп, перенесенный
+    в безубыток или в прибыль, риска не несет. До входа берется полный плановый объем
+    и худшая цена входа (как при расчете размера в /process_signal).
+    """
+    direction = -1 if trade['side'] == 'short' else 1
+    executed_qty = trade.get('executed_qty') or 0
+    if trade['status'] == 'ACTIVE' and executed_qty > 0:
+        qty = executed_qty
+    else:
+        qty = trade.get('total_qty') or 0
+    entry = trade.get('avg_entry_price') or (
+        trade['entry_range_end'] if trade['side'] == 'short' else trade['entry_range_start']
+    )
+    stop = trade.get('current_sl_price') or trade.get('initial_sl_price') or entry
+    risk = qty * max(0.0, direction * (entry - stop))
+    return direction, risk, qty * entry
+
+
+class PortfolioExposure:
+    """
+    Экспозиция открытых сделок в компактных массивах numpy.
+
+    Каждая сделка занимает слот (риск, номинал, направление, индекс символа); агрегаты
+    по символу и стороне обновляются инкрементально при открытии, переносе стопа и закрытии.
+    Проверка нового сигнала - несколько векторных операций над массивами символов
+    и одно умножение матрицы принадлежности групп на вектор чистого риска.
+    """
+
+    def __init__(self, buckets: dict = None, max_total_pct: float = PORTFOLIO_MAX_TOTAL_RISK_PCT,
+                 max_symbol_pct: float = PORTFOLIO_MAX_SYMBOL_RISK_PCT,
+                 max_bucket_pct: float = PORTFOLIO_MAX_BUCKET_RISK_PCT):
+        self.bucket_config = PORTFOLIO_CORRELATION_BUCKETS if buckets is None else buckets
+        # Лимиты по умолчанию для check(); None - лимит не проверяется
+        self.max_total_pct = max_total_pct
+        self.max_symbol_pct = max_symbol_pct
+        self.max_bucket_pct = max_bucket_pct
+        self.clear()
+
+    def clear(self):
+        self._slots = {}                     # trade_id -> слот
+        self._free_slots = []
+        self._slot_risk = np.zeros(_INITIAL_CAPACITY)
+        self._slot_notional = np.zeros(_INITIAL_CAPACITY)
+        self._slot_direction = np.zeros(_INITIAL_CAPACITY, dtype=np.int8)
+        self._slot_symbol = np.zeros(_INITIAL_CAPACITY, dtype=np.int32)
+        self._symbols = {}                   # symbol -> индекс
+        self._bucket_names = {}              # bucket -> индекс
+        self._risk = np.zeros((0, 2))        # [символ, сторона (0 - long, 1 - short)]
+        self._notional = np.zeros((0, 2))
+        self._membership = np.zeros((0, 0))  # [группа, символ] = 1, если символ в группе
+        self.total_risk = 0.0
+
+    # --- Индексы ---
+    def _symbol_buckets(self, symbol: str) -> list:
+        buckets = self.bucket_config.get(symbol, DEFAULT_BUCKET)
+        return [buckets] if isinstance(buckets, str) else list(buckets)
+
+    def _symbol_index(self, symbol: str) -> int:
+        index = self._symbols.get(symbol)
+        if index is not None:
+            return index
+        index = self._symbols[symbol] = len(self._symbols)
+        self._risk = np.vstack([self._risk, np.zeros((1, 2))])
+        self._notional = np.vstack([self._notional, np.zeros((1, 2))])
+        bucket_indexes = [self._bucket_names.setdefault(b, len(self._bucket_names)) for b in self._symbol_buckets(symbol)]
+        membership = np.zeros((len(self._bucket_names), len(self._symbols)))
+        membership[:self._membership.shape[0], :self._membership.shape[1]] = self._membership
+        membership[bucket_indexes, index] = 1.0
+        self._membership = membership
+        return index
+
+    def _allocate_slot(self) -> int:
+        if self._free_slots:
+            return self._free_slots.pop()
+        slot = len(self._slots)
+        if slot >= len(self._slot_risk):
+            grow = len(self._slot_risk)
+            self._slot_risk = np.concatenate([self._slot_risk, np.zeros(grow)])
+            self._slot_notional = np.concatenate([self._slot_notional, np.zeros(grow)])
+            self._slot_direction = np.concatenate([self._slot_direction, np.zeros(grow, dtype=np.int8)])
+            self._slot_symbol = np.concatenate([self._slot_symbol, np.zeros(grow, dtype=np.int32)])
+        return slot
+
+    def _apply(self, slot: int, sign: float):
+        """Добавляет (sign=1) или вычитает (sign=-1) вклад слота в агрегаты."""
+        side = 0 if self._slot_direction[slot] > 0 else 1
+        symbol = self._slot_symbol[slot]
+        self._risk[symbol, side] += sign * self._slot_risk[slot]
+        self._notional[symbol, side] += sign * self._slot_notional[slot]
+        self.total_risk += sign * self._slot_risk[slot]
+
+    # --- Инкрементальные обновления ---
+    def upsert(self, trade: dict):
+        """Открытие сделки или изменение ее объема/входа/стопа. Закрытая сделка удаляется."""
+        if trade['status'] == 'CLOSED':
+            self.remove(trade['id'])
+            return
+        direction, risk, notional = trade_risk(trade)
+        slot = self._slots.get(trade['id'])
+        if slot is None:
+            slot = self._allocate_slot()
+            self._slots[trade['id']] = slot
+        else:
+            self._apply(slot, -1.0)
+        self._slot_direction[slot] = direction
+        self._slot_symbol[slot] = self._symbol_index(trade['symbol'])
+        self._slot_risk[slot] = risk
+        self._slot_notional[slot] = notional
+        self._apply(slot, 1.0)
+
+    def remove(self, trade_id: int):
+        slot = self._slots.pop(trade_id, None)
+        if slot is None:
+            return
+        self._apply(slot, -1.0)
+        self._slot_risk[slot] = self._slot_notional[slot] = 0.0
+        self._free_slots.append(slot)
+        if not self._slots:
+            # Пустой портфель: обнуляем накопленную погрешность сложений/вычитаний
+            self._risk[:] = 0.0
+            self._notional[:] = 0.0
+            self.total_risk = 0.0
+
+    def rebuild(self, trades: list):
+        self.clear()
+        for trade in trades:
+            self.upsert(trade)
+
+    # --- Проверка нового сигнала ---
+    def check(self, symbol: str, side: str, risk_usd: float, equity: float,
+              max_total_pct: float = None, max_symbol_pct: float = None, max_bucket_pct: float = None) -> dict:
+        """
+        Проверяет, укладывается ли новый риск `risk_usd` в лимиты портфеля.
+        Незаданный аргумент берется из лимитов экземпляра; лимит None не проверяется.
+        Группа нарушает лимит, только если новая сделка увеличивает ее чистый риск:
+        хеджирующая сделка проходит даже при уже превышенном лимите.
+        """
+        max_total_pct = self.max_total_pct if max_total_pct is None else max_total_pct
+        max_symbol_pct = self.max_symbol_pct if max_symbol_pct is None else max_symbol_pct
+        max_bucket_pct = self.max_bucket_pct if max_bucket_pct is None else max_bucket_pct
+        direction = -1.0 if side == 'short' else 1.0
+        violations = []
+
+        total_after = self.total_risk + risk_usd
+        if max_total_pct is not None and total_after > max_total_pct * equity:
+            violations.append(f"total risk {total_after:.2f} > {max_total_pct * equity:.2f}")
+
+        index = self._symbols.get(symbol)
+        symbol_after = risk_usd + (self._risk[index].sum() if index is not None else 0.0)
+        if max_symbol_pct is not None and symbol_after > max_symbol_pct * equity:
+            violations.append(f"{symbol} risk {symbol_after:.2f} > {max_symbol_pct * equity:.2f}")
+
+        if max_bucket_pct is not None:
+            violations.extend(self._bucket_violations(symbol, index, direction * risk_usd, max_bucket_pct * equity))
+
+        return {
+            "allowed": not violations,
+            "violations": violations,
+            "total_risk": round(total_after, 2),
+            "symbol_risk": round(symbol_after, 2),
+        }
+
+    def _bucket_violations(self, symbol: str, index, signed_risk: float, limit: float) -> list:
+        """Чистый направленный риск групп: M @ (long - short) по символам, плюс новая сделка."""
+        violations = []
+        names = list(self._bucket_names)
+        symbol_buckets = self._symbol_buckets(symbol)
+        if index is not None:
+            column = self._membership[:, index]
+        else:
+            column = np.array([name in symbol_buckets for name in names], dtype=float)
+        bucket_net = self._membership @ (self._risk[:, 0] - self._risk[:, 1])
+        bucket_after = bucket_net + column * signed_risk
+        breached = (np.abs(bucket_after) > limit) & (np.abs(bucket_after) > np.abs(bucket_net))
+        for bucket_index in np.flatnonzero(breached):
+            violations.append(f"bucket '{names[bucket_index]}' net risk {bucket_after[bucket_index]:.2f} > {limit:.2f}")
+        # Группа, где еще нет ни одного символа, содержит только новый риск
+        for bucket in symbol_buckets:
+            if bucket not in self._bucket_names and abs(signed_risk) > limit:
+                violations.append(f"bucket '{bucket}' net risk {signed_risk:.2f} > {limit:.2f}")
+        return violations
+
+    def snapshot(self) -> dict:
+        """Экспозиция и риск по символам и сторонам, чистый риск по группам."""
+        names = list(self._bucket_names)
+        bucket_net = self._membership @ (self._risk[:, 0] - self._risk[:, 1]) if names else []
+        return {
+            "open_trades": len(self._slots),
+            "total_risk": round(self.total_risk, 2),
+            "symbols": {
+                symbol: {
+                    "long_notional": round(self._notional[i, 0], 2), "short_notional": round(self._notional[i, 1], 2),
+                    "long_risk": round(self._risk[i, 0], 2), "short_risk": round(self._risk[i, 1], 2),
+                }
+                for symbol, i in self._symbols.items() if self._notional[i].any() or self._risk[i].any()
+            },
+            "buckets": {name: round(float(bucket_net[i]), 2) for i, name in enumerate(names)},
+        }
@@ -1,112 +1,277 @@
 # file: position_manager.py
 import asyncio
-import json
+import math
+import os
+import time
 import numpy as np
 import sqlite3
 from datetime import datetime, timezone
 
-from db_utils import get_db_connection
+from db_utils import get_db_connection, timed_transaction
 from trade_logger import log_event
 from bybit_wrapper import AsyncBybitWrapper
-from risk_controls import update_pnl
+from trade_store import TradeStore, TRADE_STORE
+from reconcile_scheduler import ReconcileScheduler
+from quantization import SIZE_ROUNDING_SLACK, quantizer_for
+from metrics import SIGNAL_STAGES, MANAGER_CYCLES_TOTAL, MANAGER_CYCLE_SECONDS, DB_COMMIT_SECONDS
+from profiling import PROFILER
+from live_feed import FEED
+from fill_ledger import attribute_fills, sync_fills, sync_symbol_fills, trade_fill_summary, close_reason_from_summary
 
 # --- Константы ---
 MANAGER_LOOP_SLEEP_INTERVAL = 15
+# В событийном режиме (MANAGER_MODE=events) опрос - только страховочная сверка
+MANAGER_SAFETY_NET_INTERVAL = 60
 ENTRY_GRID_ORDERS = 3
+# Сколько символов сверяется параллельно за один проход
+MANAGER_MAX_CONCURRENCY = int(os.getenv("MANAGER_MAX_CONCURRENCY", "8"))
+# reactive - TP выставляется, когда менеджер увидел цену за уровнем;
+# ladder - при активации вся лестница TP и условный SL сразу выставляются на биржу одним пакетом
+TP_PLACEMENT_MODE = os.getenv("TP_PLACEMENT_MODE", "reactive")
+_ENTRY_ORDERS_COMMIT_SECONDS = DB_COMMIT_SECONDS.labels("entry_orders")
+_LIVE_PRICES_COMMIT_SECONDS = DB_COMMIT_SECONDS.labels("live_prices")
+
+# Сделки одного символа делят одну живую позицию, поэтому сверяются строго по очереди
+_symbol_locks = {}
+
+def symbol_lock(symbol: str) -> asyncio.Lock:
+    lock = _symbol_locks.get(symbol)
+    if lock is None:
+        lock = _symbol_locks[symbol] = asyncio.Lock()
+    return lock
 
 # ==============================================================================
-# 1. ЗАДАЧА РАЗМЕЩЕНИЯ ОРДЕРОВ (уже была правильной)
+# 1. ЗАДАЧА РАЗМЕЩЕНИЯ ОРДЕРОВ
 # ==============================================================================
-async def place_entry_grid(trade_id: int, total_qty: float, instruction: dict, bybit_client: AsyncBybitWrapper):
+GRID_DISTRIBUTIONS = ('linear', 'geometric', 'weighted')
+
+def build_entry_grid(instruction: dict, total_qty: float, amount_step: float) -> list:
+    """
+    Рассчитывает сетку входа: список (price, qty).
+        linear    - равные шаги цены, равные объемы;
+        geometric - равные процентные шаги цены, равные объемы;
+        weighted  - равные шаги цены, объем растет к лучшей цене входа (1, 2, ..., N).
+    Объем делится целыми числами шагов с округлением вниз: сумма сетки не превышает total_qty.
+    Нулевые после округления ордера отбрасываются.
+    """
+    grid_orders = int(instruction.get('grid_orders') or ENTRY_GRID_ORDERS)
+    distribution = instruction.get('grid_distribution') or 'linear'
+    if distribution not in GRID_DISTRIBUTIONS:
+        raise ValueError(f"Unknown grid distribution '{distribution}'. Expected one of {GRID_DISTRIBUTIONS}.")
+    quantizer = quantizer_for(amount_step)
+
+    start, end = instruction['entry_start'], instruction['entry_end']
+    if distribution == 'geometric':
+        prices = np.geomspace(start, end, grid_orders)
+    else:
+        prices = np.linspace(start, end, grid_orders)
+
+    if distribution == 'weighted':
+        # Лучшая цена для лонга - самая низкая, для шорта - самая высокая
+        order = np.argsort(prices if instruction['side'] == 'short' else -prices)
+        weights = np.empty(grid_orders)
+        weights[order] = np.arange(1, grid_orders + 1)
+    else:
+        weights = np.ones(grid_orders)
+    qtys = quantizer.split(total_qty, weights)
+
+    return [(float(price), qty) for price, qty in zip(prices, qtys) if qty > 0]
+
+
+async def place_entry_grid(trade_id: int, total_qty: float, instruction: dict, bybit_client: AsyncBybitWrapper,
+                           store: TradeStore = TRADE_STORE):
     """
     Выставляет сетку лимитных ордеров на вход для новой сделки.
-    Эта функция корректно управляет своим собственным соединением с БД.
+    Все ордера уходят одним пакетным запросом (или параллельно, если биржа не умеет пакеты),
+    а в БД записываются одной короткой транзакцией уже после ответа биржи:
+    блокировка записи SQLite не держится во время сетевых вызовов.
     """
     conn = get_db_connection()
     try:
         existing_orders = conn.execute("SELECT 1 FROM entry_orders WHERE trade_id = ?", (trade_id,)).fetchone()
-        if existing_orders:
-            log_event("GRID_PLACEMENT_SKIPPED", {"reason": "already_exists", "trade_id": trade_id})
-            return
-
-        precision = bybit_client.get_market_precision(instruction['symbol'])
-        if not precision or not precision.get('amount'):
-            log_event("GRID_PLACEMENT_ERROR", {"reason": "missing_precision", "trade_id": trade_id})
-            return
-
-        amount_step = precision.get('amount', 1e-8) # Безопасное значение по умолчанию
-        order_qty = round(total_qty / ENTRY_GRID_ORDERS, int(-np.log10(amount_step)))
-        if order_qty <= 0:
-            log_event("GRID_PLACEMENT_ERROR", {"reason": "zero_order_qty", "trade_id": trade_id})
-            return
-            
-        entry_prices = np.linspace(instruction['entry_start'], instruction['entry_end'], ENTRY_GRID_ORDERS)
-        
-        with conn:
-            for price in entry_prices:
-                try:
-                    order = await bybit_client.create_limit_order(
-                        symbol=instruction['symbol'], side=instruction['side'], amount=order_qty, price=price
-                    )
-                    log_event("ENTRY_ORDER_PLACED", {"trade_id": trade_id, "order_id": order['id'], "price": price})
-                    conn.execute(
-                        "INSERT INTO entry_orders (trade_id, exchange_order_id, status) VALUES (?, ?, ?)",
-                        (trade_id, order['id'], 'open')
-                    )
-                except Exception as e:
-                    log_event("ENTRY_ORDER_FAILED", {"trade_id": trade_id, "price": price, "error": str(e)})
     finally:
-        if conn:
+        conn.close()
+    if existing_orders:
+        log_event("GRID_PLACEMENT_SKIPPED", {"reason": "already_exists", "trade_id": trade_id})
+        return
+
+    precision = bybit_client.get_market_precision(instruction['symbol'])
+    if not precision or not precision.get('amount'):
+        log_event("GRID_PLACEMENT_ERROR", {"reason": "missing_precision", "trade_id": trade_id})
+        return
+
+    amount_step = precision.get('amount', 1e-8) # Безопасное значение по умолчанию
+    try:
+        grid = build_entry_grid(instruction, total_qty, amount_step)
+    except ValueError as e:
+        log_event("GRID_PLACEMENT_ERROR", {"reason": "bad_grid", "trade_id": trade_id, "error": str(e)})
+        return
+    if not grid:
+        log_event("GRID_PLACEMENT_ERROR", {"reason": "zero_order_qty", "trade_id": trade_id})
+        return
+
+    # Направление сделки (long/short) -> сторона ордера на вход (buy/sell)
+    entry_side = 'sell' if instruction['side'] == 'short' else 'buy'
+    started = time.perf_counter()
+    results = await bybit_client.create_orders([
+        {'symbol': instruction['symbol'], 'type': 'limit', 'side': entry_side,
+         'amount': qty, 'price': price, 'params': {}}
+        for price, qty in grid
+    ])
+    time_to_placed_ms = round((SIGNAL_STAGES["grid_placement"].observe_since(started) - started) * 1000, 1)
+
+    placed_order_ids = []
+    for (price, qty), order in zip(grid, results):
+        if order.get('error'):
+            log_event("ENTRY_ORDER_FAILED", {"trade_id": trade_id, "price": price, "error": order['error']})
+            continue
+        log_event("ENTRY_ORDER_PLACED", {"trade_id": trade_id, "order_id": order['id'], "price": price, "qty": qty})
+        placed_order_ids.append(order['id'])
+
+    if placed_order_ids:
+        conn = get_db_connection()
+        try:
+            with timed_transaction(conn, _ENTRY_ORDERS_COMMIT_SECONDS):
+                conn.executemany(
+                    "INSERT INTO entry_orders (trade_id, exchange_order_id, status) VALUES (?, ?, 'open')",
+                    [(trade_id, order_id) for order_id in placed_order_ids]
+                )
+                # Исполнения могли прийти до записи id ордеров
+                attribute_fills(conn)
+        finally:
             conn.close()
+        store.add_entry_orders(trade_id, placed_order_ids)
+
+    log_event("ENTRY_GRID_PLACED", {
+        "trade_id": trade_id, "placed": len(placed_order_ids), "failed": len(grid) - len(placed_order_ids),
+        "distribution": instruction.get('grid_distribution') or 'linear', "time_to_placed_ms": time_to_placed_ms,
+    })
 
 # ==============================================================================
-# 2. ГЛАВНЫЙ ЦИКЛ МЕНЕДЖЕРА (ИСПРАВЛЕНО)
+# 2. ГЛАВНЫЙ ЦИКЛ МЕНЕДЖЕРА
 # ==============================================================================
-async def position_manager_loop(bybit_client: AsyncBybitWrapper):
-    """Главный цикл, который управляет всеми активными и ожидающими сделками."""
-    log_event("POSITION_MANAGER_STARTED", {})
+async def position_manager_loop(bybit_client: AsyncBybitWrapper, store: TradeStore = TRADE_STORE,
+                                sleep_interval: float = MANAGER_LOOP_SLEEP_INTERVAL,
+                                scheduler: ReconcileScheduler = None):
+    """
+    Главный цикл, который управляет всеми активными и ожидающими сделками.
+    Состояние сделок читается из БД один раз при старте, дальше - из in-memory хранилища.
+    С планировщиком сверяются только сделки, чей дедлайн наступил, а пауза берется из очереди.
+    """
+    log_event("POSITION_MANAGER_STARTED", {"scheduling": "adaptive" if scheduler else "fixed"})
     while True:
         try:
-            trades_to_manage = []
-            conn = get_db_connection()
-            try:
-                # Получаем список сделок и сразу закрываем соединение
-                trades_to_manage_rows = conn.execute("SELECT * FROM managed_trades WHERE status != 'CLOSED'").fetchall()
-                trades_to_manage = [dict(row) for row in trades_to_manage_rows]
-            finally:
-                conn.close()
-            
-            if not trades_to_manage:
-                await asyncio.sleep(MANAGER_LOOP_SLEEP_INTERVAL)
-                continue
-
-            live_positions = await bybit_client.fetch_open_positions()
-            
-            active_symbols = {trade['symbol'] for trade in trades_to_manage}
-            if active_symbols:
-                # Эта функция сама управляет своим соединением
-                await update_live_prices(bybit_client, list(active_symbols))
-            
-            for trade in trades_to_manage:
-                # Передаем bybit_client, но не соединение
-                await reconcile_and_manage(trade, live_positions.get(trade['symbol']), bybit_client)
-                
+            if not store.loaded:
+                store.load()
+            if scheduler is None:
+                cycle_run = run_manager_cycle(bybit_client, store)
+            else:
+                due_trades = scheduler.due_trades(store)
+                cycle_run = run_manager_cycle(bybit_client, store, trades=due_trades, scheduler=scheduler) if due_trades else None
+            if cycle_run is None:
+                cycle = {}
+            elif PROFILER.target == "cycle":
+                cycle = await PROFILER.profile("cycle", cycle_run)
+            else:
+                cycle = await cycle_run
+            if cycle:
+                log_event("MANAGER_CYCLE_COMPLETED", cycle)
         except asyncio.CancelledError:
             log_event("POSITION_MANAGER_STOPPED", {})
             break
         except Exception as e:
             log_event("POSITION_MANAGER_ERROR", {"error": str(e), "context": "Main Loop"})
         
-        await asyncio.sleep(MANAGER_LOOP_SLEEP_INTERVAL)
+        await asyncio.sleep(scheduler.sleep_time() if scheduler else sleep_interval)
+
+
+async def run_manager_cycle(bybit_client: AsyncBybitWrapper, store: TradeStore, max_concurrency: int = MANAGER_MAX_CONCURRENCY,
+                            trades: list = None, scheduler: ReconcileScheduler = None) -> dict:
+    """
+    Один проход сверки: ни одного чтения из БД, все изменения - одной транзакцией в конце.
+    Символы сверяются параллельно (не больше max_concurrency одновременно), сделки одного
+    символа - последовательно. По умолчанию сверяются все открытые сделки, иначе - только `trades`;
+    с планировщиком им назначается следующий дедлайн. Возвращает тайминги прохода.
+    """
+    trades_to_manage = store.open_trades() if trades is None else trades
+    if not trades_to_manage:
+        return {}
+
+    cycle_start = time.perf_counter()
+    live_positions = await bybit_client.fetch_open_positions()
+    
+    trades_by_symbol = {}
+    for trade in trades_to_manage:
+        trades_by_symbol.setdefault(trade['symbol'], []).append(trade)
+    ticker_prices = {}
+    if trades_by_symbol:
+        # Эта функция сама управляет своим соединением
+        ticker_prices = await update_live_prices(bybit_client, list(trades_by_symbol))
+
+    # Журнал исполнений догружаем только там, где позиция изменилась с прошлого цикла
+    changed_symbols = []
+    for symbol, trades in trades_by_symbol.items():
+        position = live_positions.get(symbol)
+        size = abs(float(position.get('contracts') or 0)) if position else 0.0
+        if any(t['status'] == 'ACTIVE' for t in trades) and store.position_sizes.get(symbol) != size:
+            changed_symbols.append(symbol)
+        store.position_sizes[symbol] = size
+    if changed_symbols:
+        await sync_fills(bybit_client, changed_symbols)
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    try:
+        symbol_durations = await asyncio.gather(*[
+            _reconcile_symbol(trades, live_positions.get(symbol), bybit_client, store, semaphore)
+            for symbol, trades in trades_by_symbol.items()
+        ])
+    finally:
+        store.flush()
+
+    if scheduler is not None:
+        now = time.monotonic()
+        for symbol in trades_by_symbol:
+            position = live_positions.get(symbol)
+            mark_price = float(position['markPrice']) if position and position.get('markPrice') else ticker_prices.get(symbol)
+            scheduler.observe_price(symbol, mark_price, now)
+            for trade in trades_by_symbol[symbol]:
+                if store.get(trade['id']) is not None:
+                    scheduler.reschedule(trade, store.get_targets(trade['id']), mark_price, now)
+
+    cycle_end = MANAGER_CYCLE_SECONDS.observe_since(cycle_start)
+    MANAGER_CYCLES_TOTAL.inc()
+    return {
+        "trades": len(trades_to_manage),
+        "symbols": len(trades_by_symbol),
+        "duration_ms": round((cycle_end - cycle_start) * 1000, 1),
+        "slowest_symbol_ms": round(max(symbol_durations, default=0.0) * 1000, 1),
+    }
+
+
+async def _reconcile_symbol(trades: list, live_position: dict, bybit_client: AsyncBybitWrapper,
+                            store: TradeStore, semaphore: asyncio.Semaphore) -> float:
+    """Сверяет все сделки одного символа по очереди. Возвращает длительность в секундах."""
+    async with semaphore:
+        async with symbol_lock(trades[0]['symbol']):
+            start = time.perf_counter()
+            for trade in trades:
+                await reconcile_and_manage(trade, live_position, bybit_client, store)
+            return time.perf_counter() - start
 
 # ==============================================================================
-# 3. ЛОГИКА СВЕРКИ И УПРАВЛЕНИЯ (ИСПРАВЛЕНО)
+# 3. ЛОГИКА СВЕРКИ И УПРАВЛЕНИЯ
 # ==============================================================================
-async def reconcile_and_manage(trade: dict, live_position: dict, bybit_client: AsyncBybitWrapper):
+async def reconcile_and_manage(trade: dict, live_position: dict, bybit_client: AsyncBybitWrapper, store: TradeStore = None):
     """
     Центральная стейт-машина для одной сделки.
-    Больше не принимает 'conn', а создает соединения по необходимости.
+    Читает и меняет состояние через TradeStore; запись в БД делает store.flush().
+    Без store (разовый вызов) создает временное хранилище и сразу сбрасывает его в БД.
     """
+    own_store = store is None
+    if own_store:
+        store = TradeStore.for_trade(trade)
+    trade = store.get(trade['id']) or trade
+
     trade_id = trade['id']
     status = trade['status']
     now_utc = datetime.now(timezone.utc).isoformat(timespec='microseconds')
@@ -118,157 +283,282 @@ async def reconcile_and_manage(trade: dict, live_position: dict, bybit_client: A
             exec_qty = float(live_position['contracts'])
             log_event("ENTRY_DETECTED", {"trade_id": trade_id, "avg_price": avg_price, "qty": exec_qty})
             
-            sl_order = await bybit_client.create_order(
-                symbol=trade['symbol'], type='market', side='buy' if trade['side'] == 'short' else 'sell',
-                amount=exec_qty, params={'stopLoss': trade['initial_sl_price'], 'reduceOnly': True}
-            )
-            sl_order_id = sl_order.get('id')
-            
-            conn = get_db_connection()
-            try:
-                entry_orders_to_cancel = conn.execute("SELECT exchange_order_id FROM entry_orders WHERE trade_id = ? AND status = 'open'", (trade_id,)).fetchall()
-            finally:
-                conn.close()
+            if TP_PLACEMENT_MODE == 'ladder':
+                sl_order_id = await place_exit_ladder(trade, exec_qty, bybit_client, store)
+            else:
+                sl_order = await bybit_client.create_order(
+                    symbol=trade['symbol'], type='market', side='buy' if trade['side'] == 'short' else 'sell',
+                    amount=exec_qty, params={'stopLoss': trade['initial_sl_price'], 'reduceOnly': True}
+                )
+                sl_order_id = sl_order.get('id')
 
-            for order_row in entry_orders_to_cancel:
-                await bybit_client.cancel_order(order_row['exchange_order_id'], trade['symbol'])
+            await cancel_open_entry_orders(trade, bybit_client, store)
 
-            conn = get_db_connection()
-            try:
-                with conn:
-                    conn.execute(
-                        "UPDATE managed_trades SET status=?, avg_entry_price=?, executed_qty=?, exchange_sl_order_id=?, updated_at=? WHERE id=?",
-                        ('ACTIVE', avg_price, exec_qty, sl_order_id, now_utc, trade_id)
-                    )
-                    conn.execute("UPDATE entry_orders SET status='cancelled' WHERE trade_id=? AND status='open'", (trade_id,))
-                log_event("TRADE_ACTIVATED", {"trade_id": trade_id, "sl_order_id": sl_order_id})
-            finally:
-                conn.close()
+            store.update_trade(
+                trade_id, status='ACTIVE', avg_entry_price=avg_price, executed_qty=exec_qty,
+                exchange_sl_order_id=sl_order_id, updated_at=now_utc
+            )
+            log_event("TRADE_ACTIVATED", {"trade_id": trade_id, "sl_order_id": sl_order_id})
 
         # --- Состояние: ACTIVE -> CLOSED ---
         elif status == 'ACTIVE' and not live_position:
-            # ... (код выше без изменений) ...
+            if store.open_entry_orders(trade_id):
+                await cancel_open_entry_orders(trade, bybit_client, store)
             pnl, reason = await get_realized_pnl(trade, bybit_client)
+            if TP_PLACEMENT_MODE == 'ladder':
+                await cancel_resting_exits(trade, bybit_client, store)
 
-            conn = get_db_connection()
-            try:
-                with conn:
-                    # ИСПРАВЛЕНИЕ: Добавляем недостающий UPDATE-запрос
-                    conn.execute(
-                        "UPDATE managed_trades SET status='CLOSED', close_reason=?, realized_pnl=?, updated_at=? WHERE id=?",
-                        (reason, pnl, now_utc, trade_id)
-                    )
-                # Убедимся, что PnL не None перед обновлением
-                if pnl is not None:
-                    update_pnl(conn, pnl) 
-            finally:
-                conn.close()
+            # Дневной PnL (БД, затем память гейта просадки) пишет flush вместе со статусом CLOSED
+            store.update_trade(trade_id, status='CLOSED', close_reason=reason, realized_pnl=pnl, updated_at=now_utc)
             log_event("PNL_UPDATED", {"trade_id": trade_id, "pnl": pnl})
 
         # --- Состояние: ACTIVE (Управление TP / SL) ---
         elif status == 'ACTIVE' and live_position:
-            remaining_tps = json.loads(trade['remaining_tps'])
-            if not remaining_tps: return
+            if store.open_entry_orders(trade_id):
+                # Отмена при активации не прошла - повторяем, пока биржа ее не подтвердит
+                await cancel_open_entry_orders(trade, bybit_client, store)
+            targets = store.get_targets(trade_id)
+            track_exit_fills(trade, live_position, bybit_client, store, now_utc)
+            pending_targets = [t for t in targets if t['status'] == 'pending']
+            if TP_PLACEMENT_MODE == 'ladder':
+                # Лестница уже на бирже: для стопа в безубыток считаем только исполненные цели
+                tps_taken = sum(1 for t in targets if t['status'] == 'filled')
+            else:
+                tps_taken = len(targets) - len(pending_targets)
+            if not pending_targets:
+                if TP_PLACEMENT_MODE == 'ladder':
+                    await maybe_move_sl_to_breakeven(trade, tps_taken, bybit_client, store, now_utc)
+                return
 
             mark_price = float(live_position['markPrice'])
-            next_tp_price = remaining_tps[0]
+            next_target = pending_targets[0]
+            next_tp_price = next_target['price']
 
             tp_hit = (trade['side'] == 'long' and mark_price >= next_tp_price) or \
                      (trade['side'] == 'short' and mark_price <= next_tp_price)
-
             if tp_hit:
-                initial_tps_count = len(json.loads(trade['initial_tps']))
                 precision = bybit_client.get_market_precision(trade['symbol'])
                 amount_step = precision.get('amount', 1e-8)
-                tp_qty = round(trade['total_qty'] / initial_tps_count, int(-np.log10(amount_step)))
+                tp_qty = quantizer_for(amount_step).floor(next_target['qty'])
                 
+                tp_order_id = None
                 if tp_qty > 0:
-                    await bybit_client.create_limit_order(
+                    tp_order = await bybit_client.create_limit_order(
                         symbol=trade['symbol'], side='buy' if trade['side'] == 'short' else 'sell',
                         amount=tp_qty, price=next_tp_price, params={'reduceOnly': True}
                     )
+                    tp_order_id = tp_order.get('id')
                 
-                remaining_tps.pop(0)
-                conn = get_db_connection()
-                try:
-                    with conn:
-                        conn.execute("UPDATE managed_trades SET remaining_tps=?, updated_at=? WHERE id=?", (json.dumps(remaining_tps), now_utc, trade_id))
-                    log_event("TP_ORDER_PLACED", {"trade_id": trade_id, "tp_price": next_tp_price})
-                finally:
-                    conn.close()
-            
-            initial_tps_count = len(json.loads(trade['initial_tps']))
-            tps_taken = initial_tps_count - len(remaining_tps)
+                # Изменение состояния одной цели - одна строка, без перезаписи всей лестницы
+                store.update_target(trade_id, next_target['tp_index'], status='placed', order_id=tp_order_id)
+                log_event("TP_ORDER_PLACED", {"trade_id": trade_id, "tp_price": next_tp_price})
+                tps_taken += 1
             
-            if (trade.get('move_sl_to_be_after_tp_index') is not None and 
-                tps_taken >= trade['move_sl_to_be_after_tp_index'] and 
-                trade['avg_entry_price'] is not None and
-                trade['current_sl_price'] != trade['avg_entry_price']):
-                
-                new_sl_price = trade['avg_entry_price']
-                log_event("MOVING_SL_TO_BREAKEVEN", {"trade_id": trade_id, "new_sl": new_sl_price})
-                
-                await bybit_client.edit_order(
-                    trade['exchange_sl_order_id'], trade['symbol'], new_sl_price
-                )
-                conn = get_db_connection()
-                try:
-                    with conn:
-                        conn.execute("UPDATE managed_trades SET current_sl_price=?, updated_at=? WHERE id=?", (new_sl_price, now_utc, trade_id))
-                    log_event("SL_MOVE_SUCCESS", {"trade_id": trade_id})
-                finally:
-                    conn.close()
+            await maybe_move_sl_to_breakeven(trade, tps_taken, bybit_client, store, now_utc)
 
     except Exception as e:
         log_event("RECONCILE_ERROR", {"trade_id": trade_id, "error": str(e), "status": status})
+    finally:
+        if own_store:
+            store.flush()
+
+async def maybe_move_sl_to_breakeven(trade: dict, tps_taken: int, bybit_client: AsyncBybitWrapper, store: TradeStore, now_utc: str):
+    """Переносит SL в безубыток, когда взято достаточно целей."""
+    if (trade.get('move_sl_to_be_after_tp_index') is not None and 
+        tps_taken >= trade['move_sl_to_be_after_tp_index'] and 
+        trade['avg_entry_price'] is not None and
+        trade['current_sl_price'] != trade['avg_entry_price']):
+        
+        new_sl_price = trade['avg_entry_price']
+        log_event("MOVING_SL_TO_BREAKEVEN", {"trade_id": trade['id'], "new_sl": new_sl_price})
+        
+        await bybit_client.edit_order(
+            trade['exchange_sl_order_id'], trade['symbol'], new_sl_price
+        )
+        store.update_trade(trade['id'], current_sl_price=new_sl_price, updated_at=now_utc)
+        log_event("SL_MOVE_SUCCESS", {"trade_id": trade['id']})
 
 # ==============================================================================
-# 4. ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ (ИСПРАВЛЕНО)
+# 4. ЛЕСТНИЦА ВЫХОДА НА БИРЖЕ (TP_PLACEMENT_MODE=ladder)
 # ==============================================================================
-async def update_live_prices(bybit_client: AsyncBybitWrapper, symbols: list):
-    """Запрашивает и обновляет живые цены, управляя своим соединением."""
+async def place_exit_ladder(trade: dict, exec_qty: float, bybit_client: AsyncBybitWrapper, store: TradeStore) -> str:
+    """
+    Одним пакетом выставляет reduce-only лимитки на все еще не выставленные цели
+    и условный стоп-лосс на всю позицию. Объем лестницы пересчитывается на фактически
+    исполненный объем входа; каждая ступень округляется вниз до шага, последняя получает
+    остаток позиции. Пыль меньше шага закрывает стоп-лосс, выставленный на всю позицию.
+    Отклоненные цели остаются 'pending' и будут выставлены реактивно.
+    Возвращает id стоп-лосса; если биржа его отклонила - бросает исключение,
+    и активация повторится в следующем цикле (уже выставленные цели повторно не выставляются).
+    """
+    trade_id = trade['id']
+    exit_side = 'buy' if trade['side'] == 'short' else 'sell'
+    precision = bybit_client.get_market_precision(trade['symbol']) or {}
+    amount_step = precision.get('amount') or 1e-8
+    quantizer = quantizer_for(amount_step)
+
+    targets = store.get_targets(trade_id)
+    pending = [t for t in targets if t['status'] == 'pending']
+    # У уже выставленных целей qty - выставленный объем (пересчитан при выставлении)
+    placed_qty = sum(t['qty'] for t in targets if t['status'] != 'pending')
+    pending_planned = sum(t['qty'] for t in pending)
+
+    # Считаем в целых шагах объема: ступени округлены вниз, их сумма не больше позиции
+    remaining_units = quantizer.floor_units(max(exec_qty - placed_qty, 0.0) * (1 + SIZE_ROUNDING_SLACK))
+    share_per_planned = remaining_units / pending_planned if pending_planned > 0 else 0.0
+    ladder = []
+    for i, target in enumerate(pending):
+        if i == len(pending) - 1:
+            units = remaining_units
+        else:
+            units = min(math.floor(target['qty'] * share_per_planned * (1 + SIZE_ROUNDING_SLACK)), remaining_units)
+        remaining_units -= units
+        if units > 0:
+            ladder.append((target, quantizer.from_units(units)))
+
+    orders = [
+        {'symbol': trade['symbol'], 'type': 'limit', 'side': exit_side, 'amount': qty,
+         'price': target['price'], 'params': {'reduceOnly': True}}
+        for target, qty in ladder
+    ]
+    if not trade.get('exchange_sl_order_id'):
+        orders.append({
+            'symbol': trade['symbol'], 'type': 'market', 'side': exit_side, 'amount': exec_qty, 'price': None,
+            'params': {'stopLossPrice': trade['initial_sl_price'], 'reduceOnly': True}
+        })
+
+    results = await bybit_client.create_orders(orders) if orders else []
+    for (target, qty), order in zip(ladder, results):
+        if order.get('error'):
+            log_event("TP_ORDER_FAILED", {"trade_id": trade_id, "tp_price": target['price'], "error": order['error']})
+            continue
+        store.update_target(trade_id, target['tp_index'], status='placed', order_id=order['id'], qty=qty)
+    log_event("EXIT_LADDER_PLACED", {
+        "trade_id": trade_id, "tp_orders": sum(1 for o in results[:len(ladder)] if not o.get('error'))
+    })
+
+    if not trade.get('exchange_sl_order_id'):
+        sl_order = results[-1]
+        if sl_order.get('error'):
+            raise RuntimeError(f"Stop-loss order rejected: {sl_order['error']}")
+        return sl_order['id']
+    return trade['exchange_sl_order_id']
+
+
+def track_exit_fills(trade: dict, live_position: dict, bybit_client: AsyncBybitWrapper, store: TradeStore, now_utc: str) -> int:
+    """
+    Отмечает исполненные цели без запросов к бирже: закрытый объем позиции
+    (executed_qty - текущий размер) по порядку покрывает выставленные цели.
+    Возвращает количество целей, отмеченных исполненными в этом вызове.
+    """
+    if not trade.get('executed_qty'):
+        return 0
+    closed_qty = float(trade['executed_qty']) - abs(float(live_position['contracts']))
+    precision = bybit_client.get_market_precision(trade['symbol']) or {}
+    tolerance = (precision.get('amount') or 1e-8) / 2
+
+    newly_filled = 0
+    covered = 0.0
+    for target in store.get_targets(trade['id']):
+        if target['status'] not in ('placed', 'filled'):
+            break
+        covered += target['qty']
+        if covered > closed_qty + tolerance:
+            break
+        if target['status'] == 'placed':
+            store.update_target(trade['id'], target['tp_index'], status='filled', filled_at=now_utc)
+            log_event("TP_ORDER_FILLED", {"trade_id": trade['id'], "tp_index": target['tp_index'], "tp_price": target['price']})
+            newly_filled += 1
+    return newly_filled
+
+
+async def cancel_open_entry_orders(trade: dict, bybit_client: AsyncBybitWrapper, store: TradeStore) -> int:
+    """
+    Снимает с биржи открытые ордера на вход. Из учета уходят только ордера, отмену которых
+    подтвердила биржа (или которых на ней уже нет); остальные остаются для повтора.
+    Возвращает число ордеров, которые отменить не удалось.
+    """
+    confirmed = []
+    for order_id in store.open_entry_orders(trade['id']):
+        result = await bybit_client.cancel_order(order_id, trade['symbol'])
+        if isinstance(result, dict) and result.get('error') and not result.get('not_found'):
+            continue
+        confirmed.append(order_id)
+    store.cancel_entry_orders(trade['id'], confirmed)
+    return len(store.open_entry_orders(trade['id']))
+
+
+async def cancel_resting_exits(trade: dict, bybit_client: AsyncBybitWrapper, store: TradeStore):
+    """После закрытия позиции снимает с биржи оставшиеся TP и стоп-лосс."""
+    for target in store.get_targets(trade['id']):
+        if target['status'] == 'placed' and target['order_id']:
+            await bybit_client.cancel_order(target['order_id'], trade['symbol'])
+            store.update_target(trade['id'], target['tp_index'], status='cancelled')
+        elif target['status'] == 'pending':
+            store.update_target(trade['id'], target['tp_index'], status='cancelled')
+    if trade.get('exchange_sl_order_id'):
+        await bybit_client.cancel_order(trade['exchange_sl_order_id'], trade['symbol'])
+
+# ==============================================================================
+# 5. ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
+# ==============================================================================
+async def update_live_prices(bybit_client: AsyncBybitWrapper, symbols: list) -> dict:
+    """
+    Запрашивает живые цены всех символов одним запросом и пишет их одним executemany.
+    Возвращает {symbol: price}.
+    """
+    prices = {}
     conn = get_db_connection()
     try:
-        tickers = await asyncio.gather(*[bybit_client.fetch_ticker_price(s) for s in symbols])
+        tickers = await bybit_client.fetch_tickers(symbols)
         now_utc = datetime.now(timezone.utc).isoformat(timespec='microseconds')
+        prices = {symbol: price for symbol, price in tickers.items() if price > 0}
         
-        with conn:
-            for symbol, price in zip(symbols, tickers):
-                if price > 0:
-                    conn.execute(
-                        "INSERT OR REPLACE INTO live_prices (symbol, mark_price, updated_at) VALUES (?, ?, ?)",
-                        (symbol, price, now_utc)
-                    )
+        with timed_transaction(conn, _LIVE_PRICES_COMMIT_SECONDS):
+            conn.executemany(
+                "INSERT OR REPLACE INTO live_prices (symbol, mark_price, updated_at) VALUES (?, ?, ?)",
+                [(symbol, price, now_utc) for symbol, price in prices.items()]
+            )
+        if prices:
+            FEED.publish("price", {"updated_at": now_utc, "prices": prices})
     except Exception as e:
         log_event("LIVE_PRICE_UPDATE_ERROR", {"error": str(e)})
     finally:
         if conn:
             conn.close()
+    return prices
 
-async def get_realized_pnl(trade: dict, bybit_client: AsyncBybitWrapper) -> tuple[float, str]:
+async def get_realized_pnl(trade: dict, bybit_client: AsyncBybitWrapper) -> tuple[float | None, str]:
     """
-    Получает историю сделок пользователя с биржи для расчета PnL.
-    Эта функция не взаимодействует с локальной БД.
+    Реализованный PnL и причина закрытия - одним SQL-агрегатом по журналу исполнений.
+    К бирже обращаемся, только если в журнале не хватает выходов (например, событие
+    закрытия позиции обогнало событие исполнения) - и то лишь за новыми исполнениями.
+    Если выходов не хватает и после синхронизации, PnL неизвестен (None): неполный
+    денежный поток - это не результат сделки.
     """
     try:
-        my_trades = await bybit_client.fetch_my_trades(trade['symbol'], limit=20)
-        
-        trade_open_time = datetime.fromisoformat(trade['created_at'])
-        relevant_trades = [t for t in my_trades if t.get('timestamp') and datetime.fromtimestamp(t['timestamp'] / 1000, tz=timezone.utc) > trade_open_time]
-        
-        if not relevant_trades:
-            return 0.0, "UNKNOWN_NO_TRADES"
+        conn = get_db_connection()
+        try:
+            summary = trade_fill_summary(conn, trade['id'])
+        finally:
+            conn.close()
 
-        realized_pnl = sum(t.get('fee', {}).get('cost', 0) * -1 for t in relevant_trades if t.get('fee'))
+        expected_qty = float(trade.get('executed_qty') or summary['entry_qty'] or 0)
+        if expected_qty and summary['exit_qty'] < expected_qty * (1 - 1e-6):
+            await sync_symbol_fills(bybit_client, trade['symbol'])
+            conn = get_db_connection()
+            try:
+                summary = trade_fill_summary(conn, trade['id'])
+            finally:
+                conn.close()
+            if summary['exit_qty'] < expected_qty * (1 - 1e-6):
+                log_event("PNL_INCOMPLETE_FILLS", {
+                    "trade_id": trade['id'], "expected_qty": expected_qty, "exit_qty": summary['exit_qty']
+                })
+                return None, "PNL_INCOMPLETE_FILLS"
 
-        last_trade = relevant_trades[-1]
-        if last_trade.get('price') and trade.get('current_sl_price') and last_trade['price'] == trade['current_sl_price']:
-            return realized_pnl, "SL_HIT"
-        elif last_trade.get('price') and trade.get('initial_tps') and last_trade['price'] in json.loads(trade['initial_tps']):
-             return realized_pnl, "TP_HIT"
-        else:
-            return realized_pnl, "MANUAL_OR_OTHER"
+        return round(summary['realized_pnl'], 8), close_reason_from_summary(summary)
 
     except Exception as e:
         log_event("PNL_FETCH_ERROR", {"trade_id": trade['id'], "error": str(e)})
-        return 0.0, "ERROR_FETCHING_PNL"
\ No newline at end of file
+        return None, "ERROR_FETCHING_PNL"
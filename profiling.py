@@ -0,0 +1,246 @@
+# file: profiling.py
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+from trade_logger import log_event
+
+# --- Константы ---
+# Админ-эндпоинты профилирования доступны только при PROFILING_ENABLED=1
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_TARGETS = ("signal", "cycle")
+PROFILE_MODES = ("cprofile", "sampling")
+PROFILE_MAX_CALLS = 1000
+# Период семплирования стеков (секунды) в режиме sampling
+SAMPLING_INTERVAL_SEC = float(os.getenv("PROFILING_SAMPLING_INTERVAL_MS", "2")) / 1000
+# Сторожевой поток: колбэк, блокирующий цикл событий дольше порога (мс), логируется со стеком (0 - выключен)
+SLOW_CALLBACK_MS = float(os.getenv("SLOW_CALLBACK_MS", "0"))
+PSTATS_TOP_N = 40
+
+
+# ==============================================================================
+# 1. ПРОФИЛИРОВЩИК ПО ЗАПРОСУ
+# ==============================================================================
+class _StackSampler:
+    """Семплирующий профилировщик без зависимостей: поток раз в interval снимает стек потока цикла событий."""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLING_INTERVAL_SEC):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._active = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if not self._active.is_set():
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.stacks[collapse_stack(frame)] += 1
+            self.samples += 1
+
+    def enable(self):
+        self._active.set()
+
+    def disable(self):
+        self._active.clear()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(timeout=1.0)
+
+
+def collapse_stack(frame) -> str:
+    """Стек в формате collapsed stacks (корень слева, ';' между кадрами) - вход для flamegraph.pl/speedscope."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """
+    Профилирование следующих N вызовов /process_signal или N проходов менеджера.
+
+    Пока профилировщик не взведен, точки вызова проверяют только `PROFILER.target`
+    (одно сравнение атрибута) и не оборачивают корутину. Одновременные вызовы одной цели
+    профилируются одной сессией: профилировщик включен, пока идет хотя бы один из них.
+    """
+
+    def __init__(self):
+        self.target = None
+        self.mode = None
+        self.remaining = 0
+        self._active = 0
+        self._profile = None
+        self._sampler = None
+        self._session = None
+        self.last_report = None
+
+    def arm(self, target: str, calls: int, mode: str = "cprofile") -> dict:
+        if target not in PROFILE_TARGETS:
+            raise ValueError(f"Unknown profile target '{target}'. Expected one of {PROFILE_TARGETS}.")
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}'. Expected one of {PROFILE_MODES}.")
+        if not 1 <= calls <= PROFILE_MAX_CALLS:
+            raise ValueError(f"calls must be between 1 and {PROFILE_MAX_CALLS}.")
+        if self._active:
+            raise RuntimeError("A profiling session is in progress.")
+        self._reset()
+        self.target, self.mode, self.remaining = target, mode, calls
+        self._session = {"target": target, "mode": mode, "calls": 0, "wall_ms": 0.0, "armed_at": time.time()}
+        if mode == "cprofile":
+            self._profile = cProfile.Profile()
+        else:
+            self._sampler = _StackSampler(threading.get_ident())
+        log_event("PROFILER_ARMED", {"target": target, "calls": calls, "mode": mode})
+        return self.status()
+
+    def disarm(self):
+        """Сбрасывает взведенную сессию; уже идущие вызовы дорабатывают без профилировщика."""
+        if self._active:
+            raise RuntimeError("A profiling session is in progress.")
+        self._reset()
+
+    def _reset(self):
+        if self._sampler is not None:
+            self._sampler.stop()
+        self.target, self.mode, self.remaining = None, None, 0
+        self._profile = self._sampler = self._session = None
+
+    async def profile(self, target: str, coro):
+        """Выполняет корутину под профилировщиком, если он взведен на эту цель."""
+        if self.target != target or self.remaining <= 0:
+            return await coro
+        self.remaining -= 1
+        if self._active == 0:
+            if self._profile is not None:
+                self._profile.enable()
+            else:
+                self._sampler.enable()
+        self._active += 1
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self._active -= 1
+            self._session["calls"] += 1
+            self._session["wall_ms"] += (time.perf_counter() - started) * 1000
+            if self._active == 0:
+                if self._profile is not None:
+                    self._profile.disable()
+                else:
+                    self._sampler.disable()
+                if self.remaining <= 0:
+                    self._finish()
+
+    def _finish(self):
+        report = dict(self._session, finished_at=time.time())
+        if self._profile is not None:
+            report["stats"] = pstats.Stats(self._profile)
+        else:
+            # Останавливаем поток до копирования, чтобы он не менял счетчики во время чтения
+            self._sampler.stop()
+            report["stacks"] = dict(self._sampler.stacks)
+            report["samples"] = self._sampler.samples
+        self.last_report = report
+        log_event("PROFILER_FINISHED", {"target": report["target"], "mode": report["mode"],
+                                        "calls": report["calls"], "wall_ms": round(report["wall_ms"], 1)})
+        self._reset()
+
+    def status(self) -> dict:
+        return {
+            "armed": self.target is not None,
+            "target": self.target,
+            "mode": self.mode,
+            "remaining": self.remaining,
+            "last_report": {k: v for k, v in (self.last_report or {}).items() if k not in ("stats", "stacks")} or None,
+        }
+
+    def render(self, fmt: str = "pstats") -> str:
+        """
+        Отчет последней сессии: pstats - таблица по cumulative (для sampling - самые частые кадры),
+        collapsed - collapsed stacks для построения flamegraph (только sampling).
+        """
+        report = self.last_report
+        if report is None:
+            raise LookupError("No finished profiling session.")
+        if fmt == "collapsed":
+            if "stacks" not in report:
+                raise ValueError("Collapsed stacks are only available for the 'sampling' mode.")
+            return "".join(f"{stack} {count}\n" for stack, count in sorted(report["stacks"].items()))
+        if fmt != "pstats":
+            raise ValueError("Unknown format. Expected 'pstats' or 'collapsed'.")
+        if "stats" in report:
+            stream = io.StringIO()
+            stats = report["stats"]
+            stats.stream = stream
+            stats.sort_stats("cumulative").print_stats(PSTATS_TOP_N)
+            return stream.getvalue()
+        leaf_counts = Counter()
+        for stack, count in report["stacks"].items():
+            leaf_counts[stack.rsplit(";", 1)[-1]] += count
+        total = report["samples"] or 1
+        lines = [f"{report['samples']} samples, {report['calls']} calls, {report['wall_ms']:.1f} ms wall"]
+        lines += [f"{count:8d} {count / total:7.1%}  {frame}" for frame, count in leaf_counts.most_common(PSTATS_TOP_N)]
+        return "\n".join(lines) + "\n"
+
+
+PROFILER = Profiler()
+
+
+# ==============================================================================
+# 2. СТОРОЖ МЕДЛЕННЫХ КОЛБЭКОВ
+# ==============================================================================
+class SlowCallbackWatchdog:
+    """
+    Корутина в цикле событий обновляет метку времени каждые threshold/4; фоновый поток
+    проверяет ее и, если цикл не отвечал дольше порога, логирует SLOW_CALLBACK со стеком
+    потока цикла - то есть ровно того кода, который его блокирует. Один эпизод - одно событие.
+    """
+
+    def __init__(self, threshold_ms: float = SLOW_CALLBACK_MS):
+        self.threshold = threshold_ms / 1000
+        self.detected = 0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    async def run(self):
+        self._loop_thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._watch, name="slow-callback-watchdog", daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                self._last_beat = time.monotonic()
+                await asyncio.sleep(self.threshold / 4)
+        finally:
+            self._stopped.set()
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stopped.wait(self.threshold / 4):
+            beat = self._last_beat
+            blocked = time.monotonic() - beat
+            if blocked < self.threshold or beat == reported_beat:
+                continue
+            reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            self.detected += 1
+            log_event("SLOW_CALLBACK", {"blocked_ms": round(blocked * 1000, 1), "stack": stack})
@@ -0,0 +1,167 @@
+# file: quantization.py
+import math
+from decimal import Decimal
+from functools import lru_cache
+
+import numpy as np
+
+# --- Константы ---
+# Запас при округлении вниз рассчитанного (а не заданного) объема: деление во float дает
+# 9999999.999999998 вместо 1e7 или 0.19999999999999998 вместо 0.2. Относительные 1e-12 на
+# порядки больше ошибки округления float и на порядки меньше любого реального шага объема.
+SIZE_ROUNDING_SLACK = 1e-12
+
+
+@lru_cache(maxsize=None)
+def step_decimals(step: float) -> int:
+    """
+    Число знаков после запятой для шага цены/объема (0.001 -> 3, 0.5 -> 1, 1 -> 0, 10 -> 0).
+    Считается по десятичной записи, а не через log10: -log10(0.001) во float дает 2.999...
+    """
+    if not step or step <= 0:
+        return 8
+    return max(0, -Decimal(str(step)).normalize().as_tuple().exponent)
+
+
+# ==============================================================================
+# 1. КВАНТОВАТЕЛЬ ШАГА
+# ==============================================================================
+class StepQuantizer:
+    """
+    Точное округление к кратному шага (0.001, 0.5, 25, ...) для чисел и массивов numpy.
+
+    Шаг хранится как целое число единиц `units` в масштабе 10**decimals (0.5 -> 5 / 10).
+    Кратное k * step восстанавливается как k * units / scale: числитель - точное целое,
+    деление на степень десяти корректно округляется, поэтому результат - ближайший float
+    к десятичному k * step, ровно как float(Decimal). Приближенный k из деления
+    поправляется сравнением с соседними кратными, так что результат совпадает с Decimal
+    от repr(x) без погрешности float.
+    """
+
+    __slots__ = ("step", "decimals", "scale", "units")
+
+    def __init__(self, step: float):
+        if not step or step <= 0:
+            raise ValueError(f"Quantization step must be positive, got {step!r}.")
+        self.step = step
+        self.decimals = step_decimals(step)
+        self.scale = 10.0 ** self.decimals
+        self.units = int(Decimal(str(step)).scaleb(self.decimals))
+
+    def _multiple(self, k):
+        return k * self.units / self.scale
+
+    # --- Скаляры ---
+    def _floor_index(self, x: float) -> int:
+        k = math.floor(x * self.scale / self.units)
+        if self._multiple(k) > x:
+            k -= 1
+        elif self._multiple(k + 1) <= x:
+            k += 1
+        return k
+
+    def floor(self, x):
+        """Наибольшее кратное шага, не превышающее x."""
+        if isinstance(x, np.ndarray):
+            return self._floor_array(x)
+        return self._multiple(self._floor_index(x)) + 0.0
+
+    def ceil(self, x):
+        """Наименьшее кратное шага, не меньшее x."""
+        if isinstance(x, np.ndarray):
+            return -self._floor_array(-x) + 0.0
+        return -self._multiple(self._floor_index(-x)) + 0.0
+
+    def round(self, x):
+        """Ближайшее кратное шага, половина - от нуля (ROUND_HALF_UP в терминах Decimal)."""
+        if isinstance(x, np.ndarray):
+            return self._round_array(x)
+        magnitude = abs(x)
+        k = self._floor_index(magnitude)
+        if magnitude >= (2 * k + 1) * self.units / (2 * self.scale):
+            k += 1
+        return math.copysign(self._multiple(k), x) + 0.0
+
+    def floor_units(self, x):
+        """Число шагов в x с округлением вниз: целое или массив int64."""
+        if isinstance(x, np.ndarray):
+            return self._floor_index_array(x).astype(np.int64)
+        return self._floor_index(x)
+
+    def from_units(self, k):
+        """Кратное шага по числу шагов (целое или массив)."""
+        if isinstance(k, np.ndarray):
+            return self._multiple(k.astype(np.float64)) + 0.0
+        return self._multiple(k) + 0.0
+
+    # --- Массивы ---
+    def _floor_index_array(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float64)
+        k = np.floor(x * self.scale / self.units)
+        k -= self._multiple(k) > x
+        k += self._multiple(k + 1) <= x
+        return k
+
+    def _floor_array(self, x: np.ndarray) -> np.ndarray:
+        return self._multiple(self._floor_index_array(x)) + 0.0
+
+    def _round_array(self, x: np.ndarray) -> np.ndarray:
+        magnitude = np.abs(np.asarray(x, dtype=np.float64))
+        k = self._floor_index_array(magnitude)
+        k += magnitude >= (2 * k + 1) * self.units / (2 * self.scale)
+        return np.copysign(self._multiple(k), x) + 0.0
+
+    def split(self, total: float, weights) -> list:
+        """
+        Делит total на части по весам целыми числами шагов: каждая часть округлена вниз,
+        сумма частей не превышает total (остаток от округления не распределяется).
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        total_units = self._floor_index(total * (1 + SIZE_ROUNDING_SLACK))
+        shares = weights / weights.sum() * total_units
+        part_units = np.floor(shares * (1 + SIZE_ROUNDING_SLACK))
+        return [float(q) for q in self._multiple(part_units) + 0.0]
+
+    def __repr__(self):
+        return f"StepQuantizer({self.step!r})"
+
+
+@lru_cache(maxsize=None)
+def quantizer_for(step: float) -> StepQuantizer:
+    """Квантователь шага: создается один раз на шаг и переиспользуется."""
+    return StepQuantizer(step)
+
+
+def floor_to_step(x, step: float):
+    return quantizer_for(step).floor(x)
+
+
+def ceil_to_step(x, step: float):
+    return quantizer_for(step).ceil(x)
+
+
+def round_to_step(x, step: float):
+    return quantizer_for(step).round(x)
+
+
+# ==============================================================================
+# 2. ПАКЕТНЫЙ РАСЧЕТ РАЗМЕРА ПОЗИЦИЙ
+# ==============================================================================
+def size_positions(entry, stop, equity, risk_pct, amount_step: float, price_tick: float = None) -> np.ndarray:
+    """
+    Размеры позиций для многих строк (вход, стоп, капитал, риск) за один проход numpy.
+    Объем = капитал * риск / |вход - стоп|, округленный вниз до шага объема, чтобы риск
+    не превышал заданный. С price_tick расстояние до стопа выравнивается по тику цены:
+    вход и стоп лежат на сетке тиков, а вычитание во float добавляет хвост (0.000025 - 0.000024).
+    Строки с нулевым расстоянием или неположительным капиталом дают 0.
+    """
+    entry = np.asarray(entry, dtype=np.float64)
+    stop = np.asarray(stop, dtype=np.float64)
+    equity = np.asarray(equity, dtype=np.float64)
+    distance = np.abs(entry - stop)
+    if price_tick:
+        distance = quantizer_for(price_tick).round(distance)
+    valid = (distance > 0) & (equity > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        raw = np.where(valid, equity * risk_pct / np.where(valid, distance, 1.0), 0.0)
+    return quantizer_for(amount_step).floor(raw * (1 + SIZE_ROUNDING_SLACK))
@@ -0,0 +1,127 @@
+# file: rate_limiter.py
+import asyncio
+import heapq
+import itertools
+import os
+import time
+
+# --- Константы ---
+# Общий бюджет запросов к бирже в "единицах веса" в секунду (и размер разового всплеска)
+RATE_LIMIT_WEIGHT_PER_SEC = float(os.getenv("RATE_LIMIT_WEIGHT_PER_SEC", "50"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", str(RATE_LIMIT_WEIGHT_PER_SEC)))
+
+# Полосы приоритета: меньше - важнее
+LANE_PROTECTIVE = 0     # SL, перенос SL, reduce-only выходы
+LANE_TRADING = 1        # ордера на вход, отмены, настройки символа
+LANE_MARKET_DATA = 2    # тикеры, позиции, история исполнений, баланс
+LANE_NAMES = {LANE_PROTECTIVE: "protective", LANE_TRADING: "trading", LANE_MARKET_DATA: "market_data"}
+
+# Вес эндпоинта = во сколько раз его лимит Bybit v5 жестче базовых 50 запросов/с:
+# ордерные эндпоинты - 10 запросов/с на UID, чтение - 50 запросов/с.
+# Пакетные эндпоинты Bybit считает по числу ордеров, поэтому их вес - за один ордер
+# (вызывающий умножает его на размер пакета).
+ENDPOINT_WEIGHTS = {
+    'create_order': 5,
+    'create_orders': 5,
+    'create_limit_order': 5,
+    'edit_order': 5,
+    'cancel_order': 5,
+    'set_leverage': 5,
+    'set_margin_mode': 5,
+    'fetch_positions': 1,
+    'fetch_ticker': 1,
+    'fetch_tickers': 1,
+    'fetch_my_trades': 1,
+    'fetch_balance': 1,
+    'load_markets': 1,
+}
+DEFAULT_ENDPOINT_WEIGHT = 1
+
+
+class PriorityRateLimiter:
+    """
+    Взвешенный token bucket с полосами приоритета.
+
+    Запрос получает токены сразу, только если очередь пуста - иначе встает в очередь
+    по (полоса, порядок прихода). Голову очереди обслуживает одна задача-насос, поэтому
+    защитные действия обгоняют ожидающие запросы рыночных данных, но никто не превышает
+    лимит: бюджет восстанавливается со скоростью `rate` единиц в секунду до `capacity`.
+    """
+
+    def __init__(self, rate: float = RATE_LIMIT_WEIGHT_PER_SEC, capacity: float = RATE_LIMIT_BURST, clock=time.monotonic):
+        if rate <= 0 or capacity <= 0:
+            raise ValueError("Rate and capacity must be positive.")
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._waiters = []      # (lane, seq, weight, future, enqueued_at)
+        self._seq = itertools.count()
+        self._pump_task = None
+        self._lane_stats = {
+            lane: {"acquired": 0, "waited": 0, "total_wait_ms": 0.0, "max_wait_ms": 0.0, "max_queue_depth": 0}
+            for lane in LANE_NAMES
+        }
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _record(self, lane: int, wait_s: float):
+        stats = self._lane_stats[lane]
+        stats["acquired"] += 1
+        if wait_s > 0:
+            wait_ms = wait_s * 1000
+            stats["waited"] += 1
+            stats["total_wait_ms"] += wait_ms
+            stats["max_wait_ms"] = max(stats["max_wait_ms"], wait_ms)
+
+    def queue_depth(self, lane: int = None) -> int:
+        return sum(1 for w in self._waiters if not w[3].done() and (lane is None or w[0] == lane))
+
+    async def acquire(self, weight: float = DEFAULT_ENDPOINT_WEIGHT, lane: int = LANE_MARKET_DATA):
+        """Ждет, пока в бюджете не появится `weight` единиц, с учетом приоритета полосы."""
+        weight = min(weight, self.capacity)
+        self._refill()
+        if not self._waiters and self._tokens >= weight:
+            self._tokens -= weight
+            self._record(lane, 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (lane, next(self._seq), weight, future, self._clock()))
+        stats = self._lane_stats[lane]
+        stats["max_queue_depth"] = max(stats["max_queue_depth"], self.queue_depth(lane))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        # При отмене ожидающего future тоже отменяется, и насос его пропустит
+        await future
+
+    async def _pump(self):
+        while self._waiters:
+            lane, _, weight, future, enqueued_at = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            self._refill()
+            if self._tokens >= weight:
+                heapq.heappop(self._waiters)
+                self._tokens -= weight
+                self._record(lane, self._clock() - enqueued_at)
+                future.set_result(None)
+                continue
+            await asyncio.sleep((weight - self._tokens) / self.rate)
+
+    def metrics(self) -> dict:
+        """Глубина очереди и время ожидания по полосам."""
+        result = {"tokens": round(self._tokens, 3), "queue_depth": self.queue_depth()}
+        for lane, name in LANE_NAMES.items():
+            stats = self._lane_stats[lane]
+            result[name] = {
+                **stats,
+                "queue_depth": self.queue_depth(lane),
+                "avg_wait_ms": round(stats["total_wait_ms"] / stats["waited"], 3) if stats["waited"] else 0.0,
+            }
+        return result
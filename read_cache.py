@@ -0,0 +1,88 @@
+# file: read_cache.py
+import asyncio
+import os
+import time
+
+# --- Константы ---
+# Окно свежести (секунды) для каждого читающего эндпоинта; 0 - только объединение одновременных запросов
+READ_CACHE_TTLS = {
+    'balance': float(os.getenv("READ_CACHE_BALANCE_TTL", "2.0")),
+    'positions': float(os.getenv("READ_CACHE_POSITIONS_TTL", "1.0")),
+    'ticker': float(os.getenv("READ_CACHE_TICKER_TTL", "0.5")),
+    'tickers': float(os.getenv("READ_CACHE_TICKER_TTL", "0.5")),
+}
+
+# Какие кэши устаревают после пишущего вызова (ордер может исполниться сразу)
+WRITE_INVALIDATES = {
+    'create_order': ('positions', 'balance'),
+    'create_orders': ('positions', 'balance'),
+    'create_limit_order': ('positions', 'balance'),
+    'edit_order': ('positions', 'balance'),
+    'cancel_order': ('positions', 'balance'),
+    'set_leverage': ('positions', 'balance'),
+    'set_margin_mode': ('positions', 'balance'),
+}
+
+
+class ReadCache:
+    """
+    Single-flight + TTL кэш для чтений с биржи.
+
+    Одновременные одинаковые запросы ждут один вызов; успешный результат переиспользуется
+    в пределах окна свежести эндпоинта. Ошибки не кэшируются. invalidate() сбрасывает
+    и готовые значения, и результат уже летящего вызова (он мог начаться до записи).
+    """
+
+    def __init__(self, ttls: dict = None, clock=time.monotonic):
+        self.ttls = dict(READ_CACHE_TTLS if ttls is None else ttls)
+        self._clock = clock
+        self._values = {}        # (endpoint, key) -> (value, expires_at)
+        self._inflight = {}      # (endpoint, key) -> asyncio.Task
+        self._generations = {}   # endpoint -> счетчик инвалидаций
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get(self, endpoint: str, key: tuple, loader):
+        """Возвращает значение из кэша, из летящего запроса или вызывает `loader()`."""
+        cache_key = (endpoint, key)
+        entry = self._values.get(cache_key)
+        if entry is not None and entry[1] > self._clock():
+            self.hits += 1
+            return entry[0]
+
+        task = self._inflight.get(cache_key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        generation = self._generations.get(endpoint, 0)
+        ttl = self.ttls.get(endpoint, 0)
+        task = asyncio.ensure_future(loader())
+        self._inflight[cache_key] = task
+
+        def on_done(done_task):
+            if self._inflight.get(cache_key) is done_task:
+                del self._inflight[cache_key]
+            if done_task.cancelled() or done_task.exception() is not None:
+                return
+            if ttl > 0 and self._generations.get(endpoint, 0) == generation:
+                self._values[cache_key] = (done_task.result(), self._clock() + ttl)
+
+        task.add_done_callback(on_done)
+        # shield: отмена одного ожидающего не отменяет общий запрос для остальных
+        return await asyncio.shield(task)
+
+    def invalidate(self, *endpoints: str):
+        for endpoint in endpoints:
+            self._generations[endpoint] = self._generations.get(endpoint, 0) + 1
+            for cache_key in [k for k in self._values if k[0] == endpoint]:
+                del self._values[cache_key]
+            # Новые запросы не должны присоединяться к вызову, начатому до записи
+            for cache_key in [k for k in self._inflight if k[0] == endpoint]:
+                del self._inflight[cache_key]
+
+    def metrics(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                "entries": len(self._values), "inflight": len(self._inflight)}
@@ -0,0 +1,139 @@
+# file: reconcile_scheduler.py
+import heapq
+import itertools
+import math
+import os
+import time
+
+# --- Константы ---
+RECONCILE_MIN_INTERVAL = float(os.getenv("RECONCILE_MIN_INTERVAL", "1"))
+RECONCILE_MAX_INTERVAL = float(os.getenv("RECONCILE_MAX_INTERVAL", "60"))
+# Сколько "сигм" движения цены должно уместиться в интервал до ближайшего уровня
+RECONCILE_SAFETY_SIGMAS = 3.0
+# Волатильность по умолчанию (доля цены за sqrt(секунду)), пока не накоплено наблюдений
+DEFAULT_VOLATILITY = 0.0005
+VOLATILITY_EWMA_ALPHA = 0.2
+
+
+class ReconcileScheduler:
+    """
+    Очередь с приоритетом дедлайнов следующей проверки для каждой сделки.
+
+    Интервал до следующей проверки выводится из расстояния от mark price до ближайшего
+    уровня сделки (следующий TP, текущий SL или диапазон входа) и недавней волатильности
+    символа: при случайном блуждании время прохода расстояния d ~ (d / sigma)^2.
+    Сделки у уровня проверяются раз в секунду, далекие - раз в минуту.
+    """
+
+    def __init__(self, min_interval: float = RECONCILE_MIN_INTERVAL, max_interval: float = RECONCILE_MAX_INTERVAL,
+                 safety_sigmas: float = RECONCILE_SAFETY_SIGMAS):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.safety_sigmas = safety_sigmas
+        self._heap = []          # (deadline, seq, trade_id); устаревшие записи удаляются лениво
+        self._deadlines = {}     # trade_id -> актуальный дедлайн
+        self._seq = itertools.count()
+        self._volatility = {}    # symbol -> (ewma дисперсии за секунду, последняя цена, время)
+
+    def __contains__(self, trade_id: int) -> bool:
+        return trade_id in self._deadlines
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    # --- Волатильность ---
+    def observe_price(self, symbol: str, price: float, now: float = None):
+        if not price or price <= 0:
+            return
+        now = time.monotonic() if now is None else now
+        state = self._volatility.get(symbol)
+        if state is None:
+            self._volatility[symbol] = (DEFAULT_VOLATILITY ** 2, price, now)
+            return
+        variance, last_price, last_ts = state
+        dt = now - last_ts
+        if dt <= 0:
+            return
+        log_return = math.log(price / last_price)
+        variance = VOLATILITY_EWMA_ALPHA * (log_return * log_return / dt) + (1 - VOLATILITY_EWMA_ALPHA) * variance
+        self._volatility[symbol] = (variance, price, now)
+
+    def volatility(self, symbol: str) -> float:
+        state = self._volatility.get(symbol)
+        return math.sqrt(state[0]) if state else DEFAULT_VOLATILITY
+
+    # --- Интервалы ---
+    @staticmethod
+    def nearest_level_distance(trade: dict, targets: list, mark_price: float) -> float:
+        """Относительное расстояние от mark price до ближайшего уровня, на котором менеджер должен действовать."""
+        if trade['status'] == 'PENDING_ENTRY':
+            low, high = sorted((trade['entry_range_start'], trade['entry_range_end']))
+            if low <= mark_price <= high:
+                return 0.0
+            levels = [low, high]
+        else:
+            levels = [t['price'] for t in targets if t['status'] == 'pending'][:1]
+            if trade.get('current_sl_price'):
+                levels.append(trade['current_sl_price'])
+        if not levels:
+            return math.inf
+        return min(abs(level - mark_price) for level in levels) / mark_price
+
+    def interval_for(self, trade: dict, targets: list, mark_price: float) -> float:
+        if not mark_price or mark_price <= 0:
+            return self.min_interval
+        distance = self.nearest_level_distance(trade, targets, mark_price)
+        sigma = self.volatility(trade['symbol']) * self.safety_sigmas
+        interval = (distance / sigma) ** 2 if sigma > 0 else self.max_interval
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    # --- Очередь ---
+    def schedule(self, trade_id: int, deadline: float):
+        self._deadlines[trade_id] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._seq), trade_id))
+
+    def reschedule(self, trade: dict, targets: list, mark_price: float, now: float = None) -> float:
+        now = time.monotonic() if now is None else now
+        interval = self.interval_for(trade, targets, mark_price)
+        self.schedule(trade['id'], now + interval)
+        return interval
+
+    def remove(self, trade_id: int):
+        self._deadlines.pop(trade_id, None)
+
+    def pop_due(self, now: float = None) -> list:
+        now = time.monotonic() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, trade_id = heapq.heappop(self._heap)
+            if self._deadlines.get(trade_id) == deadline:
+                del self._deadlines[trade_id]
+                due.append(trade_id)
+        return due
+
+    def next_deadline(self):
+        while self._heap and self._deadlines.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def due_trades(self, store, now: float = None) -> list:
+        """Ставит в очередь новые сделки хранилища (на немедленную проверку) и возвращает созревшие."""
+        now = time.monotonic() if now is None else now
+        for trade_id in list(self._deadlines):
+            if store.get(trade_id) is None:
+                self.remove(trade_id)
+        for trade in store.open_trades():
+            if trade['id'] not in self._deadlines:
+                self.schedule(trade['id'], now)
+        return [store.get(trade_id) for trade_id in self.pop_due(now) if store.get(trade_id) is not None]
+
+    def sleep_time(self, now: float = None) -> float:
+        """
+        Сколько спать циклу до следующей проверки очереди. Не дольше min_interval,
+        чтобы новые сделки из API попадали в очередь без задержки (пустая проверка не делает REST-вызовов).
+        """
+        now = time.monotonic() if now is None else now
+        deadline = self.next_deadline()
+        if deadline is None:
+            return self.min_interval
+        return min(self.min_interval, max(0.0, deadline - now))
@@ -1,70 +1,213 @@
 # file: risk_controls.py
 import sqlite3
 import os
-from datetime import date, datetime 
+import time
+from datetime import date, datetime, timedelta, timezone
 from functools import wraps
 from fastapi import HTTPException
 
 # --- CHANGE 1: Import the central DB connection utility ---
 from db_utils import get_db_connection
+from metrics import SIGNALS_TOTAL, SIGNAL_STAGES
+from trade_logger import log_event
 
 # --- CHANGE 2: Remove the local get_db_connection() and initialize_pnl_table() functions ---
 # They are no longer needed here.
 
+# Оценка капитала, пока за торговый день не получен реальный баланс
 INITIAL_EQUITY = 1000.0
+# Час UTC, с которого начинается торговый день (граница сброса дневного PnL)
+RISK_DAY_START_HOUR_UTC = int(os.getenv("RISK_DAY_START_HOUR_UTC", "0"))
+# Снимок капитала старше этого (секунды) не используется для расчета размера и просадки от пика
+EQUITY_MAX_AGE_SEC = float(os.getenv("EQUITY_MAX_AGE_SEC", "90"))
 
-def check_daily_drawdown(max_loss_pct: float = 0.03):
+
+def trading_day(now_utc: datetime = None) -> date:
+    now_utc = now_utc or datetime.now(timezone.utc)
+    return (now_utc - timedelta(hours=RISK_DAY_START_HOUR_UTC)).date()
+
+
+def _day_start_timestamp(day: date) -> float:
+    """Unix-время начала торгового дня `day`."""
+    return datetime(day.year, day.month, day.day, RISK_DAY_START_HOUR_UTC, tzinfo=timezone.utc).timestamp()
+
+
+def _day_end_timestamp(day: date) -> float:
+    """Unix-время, когда торговый день `day` заканчивается."""
+    return _day_start_timestamp(day) + 24 * 3600
+
+
+class RiskState:
+    """
+    Дневное состояние риска в памяти: реализованный PnL, капитал на начало дня, а также
+    последний снимок капитала и его дневной пик (их поставляет equity_tracker).
+
+    Загружается из daily_pnl один раз; update_pnl и observe_equity пишут сначала в БД
+    (она остается долговременной копией), потом в память. PnL закрытой сделки пишет
+    TradeStore.flush в транзакции закрытия и после COMMIT переносит в память через
+    apply_committed_pnl. Гейт просадки читает только память.
+    При смене торгового дня значения сбрасываются и при необходимости подгружаются заново.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.loaded = False
+        self.day = None
+        self.realised_pnl = 0.0
+        self.start_equity = None
+        self.peak_equity = None
+        self.equity = None
+        self.equity_at = 0.0
+        self._day_ends_at = 0.0
+
+    def load(self, conn: sqlite3.Connection = None, now_utc: datetime = None):
+        day = trading_day(now_utc)
+        own_conn = conn is None
+        conn = conn or get_db_connection()
+        try:
+            row = conn.execute(
+                "SELECT realised_pnl, start_equity FROM daily_pnl WHERE trade_date = ?", (day,)
+            ).fetchone()
+            peak = conn.execute(
+                "SELECT MAX(equity) FROM equity_snapshots WHERE ts_ms >= ?", (int(_day_start_timestamp(day) * 1000),)
+            ).fetchone()[0]
+        except sqlite3.OperationalError as e:
+            print(f"Database error in RiskState.load: {e}")
+            row = peak = None
+        finally:
+            if own_conn:
+                conn.close()
+        self.day = day
+        self.realised_pnl = row['realised_pnl'] if row else 0.0
+        self.start_equity = row['start_equity'] if row else None
+        self.peak_equity = peak
+        self._day_ends_at = _day_end_timestamp(day)
+        self.loaded = True
+
+    def current(self, now_utc: datetime = None) -> "RiskState":
+        """Состояние на текущий торговый день: ленивая загрузка и сброс на границе дня."""
+        if now_utc is None:
+            # Горячий путь: одно сравнение с заранее посчитанной границей дня
+            if self.loaded and time.time() < self._day_ends_at:
+                return self
+        elif self.loaded and trading_day(now_utc) == self.day:
+            return self
+        self.load(now_utc=now_utc)
+        return self
+
+    def record_equity(self, equity: float, at: float = None):
+        """Новый снимок капитала (кошелек + нереализованный PnL); пик считается в пределах дня."""
+        state = self.current()
+        state.equity = equity
+        state.equity_at = at or time.time()
+        if state.peak_equity is None or equity > state.peak_equity:
+            state.peak_equity = equity
+
+    def live_equity(self, max_age: float = EQUITY_MAX_AGE_SEC):
+        """Последний снимок капитала, если он не старше max_age секунд, иначе None."""
+        if self.equity is None or time.time() - self.equity_at > max_age:
+            return None
+        return self.equity
+
+    def drawdown_from_peak(self) -> float:
+        """Текущая просадка от дневного пика капитала (доля); 0, если свежего снимка нет."""
+        equity = self.live_equity()
+        if equity is None or not self.peak_equity:
+            return 0.0
+        return max(0.0, (self.peak_equity - equity) / self.peak_equity)
+
+    def max_loss_usd(self, max_loss_pct: float) -> float:
+        equity = self.start_equity if self.start_equity else INITIAL_EQUITY
+        return equity * max_loss_pct
+
+
+RISK_STATE = RiskState()
+
+
+def check_daily_drawdown(max_loss_pct: float = 0.03, max_drawdown_from_peak_pct: float = None):
     def decorator(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            from db_utils import get_db_connection
-            today = date.today()
-            # This call now correctly uses the function from db_utils,
-            # which is properly patched by your tests.
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            current_equity = INITIAL_EQUITY
-            max_loss_usd = current_equity * max_loss_pct
-
-            try:
-                cursor.execute("SELECT realised_pnl FROM daily_pnl WHERE trade_date = ?", (today,))
-                result = cursor.fetchone()
-                realised_pnl = result['realised_pnl'] if result else 0.0
-            except sqlite3.OperationalError as e:
-                # Handle case where table might not exist in a faulty setup, but log it.
-                print(f"Database error in check_daily_drawdown: {e}")
-                realised_pnl = 0.0
-            finally:
-                conn.close()
+            started = time.perf_counter()
+            # Без I/O: состояние в памяти (БД читается один раз за торговый день)
+            state = RISK_STATE.current()
+            max_loss_usd = state.max_loss_usd(max_loss_pct)
+            realised_pnl = state.realised_pnl
 
+            SIGNAL_STAGES["drawdown_check"].observe_since(started)
             if realised_pnl <= -max_loss_usd:
+                SIGNALS_TOTAL.labels("drawdown_blocked").inc()
                 raise HTTPException(
                     status_code=429,
                     detail=f"Daily loss limit of ${max_loss_usd:.2f} reached. Realised PnL: ${realised_pnl:.2f}. No new trades allowed."
                 )
+            # Внутридневная просадка от пика учитывает и нереализованный PnL открытых позиций
+            if max_drawdown_from_peak_pct is not None:
+                drawdown = state.drawdown_from_peak()
+                if drawdown >= max_drawdown_from_peak_pct:
+                    SIGNALS_TOTAL.labels("drawdown_blocked").inc()
+                    raise HTTPException(
+                        status_code=429,
+                        detail=f"Intraday drawdown of {drawdown:.2%} from peak equity ${state.peak_equity:.2f} "
+                               f"reached the {max_drawdown_from_peak_pct:.2%} limit. No new trades allowed."
+                    )
             
             return await func(*args, **kwargs)
         return wrapper
     return decorator
 
-# --- CHANGE 3: Modify update_pnl to accept a connection object ---
+def record_daily_pnl(conn: sqlite3.Connection, pnl: float, day: date = None):
+    """Adds pnl to the day's daily_pnl row inside the caller's transaction (RISK_STATE is not touched)."""
+    conn.execute('''
+        INSERT INTO daily_pnl (trade_date, realised_pnl)
+        VALUES (?, ?)
+        ON CONFLICT(trade_date) DO UPDATE SET
+        realised_pnl = realised_pnl + excluded.realised_pnl;
+    ''', (day or trading_day(), pnl))
+
+def apply_committed_pnl(pnl: float, day: str):
+    """
+    Единственная точка, где PnL закрытой сделки попадает в память гейта просадки.
+    Вызывается только после COMMIT строки daily_pnl, поэтому память не опережает БД.
+    PnL прошедшего торгового дня в память текущего не попадает.
+    """
+    state = RISK_STATE.current()
+    if state.day == day:
+        state.realised_pnl += pnl
+
 def update_pnl(conn: sqlite3.Connection, pnl: float):
-    """Updates the PnL for the current day using the provided connection."""
-    
-    # --- НАША ОТЛАДОЧНАЯ ЛОВУШКА ---
-    now = datetime.now().strftime("%H:%M:%S.%f")
-    print(f"\nDEBUG_TRAP [{now}]: update_pnl CALLED! PNL = {pnl}\n")
-    # ---------------------------------
-    
-    today = date.today()
+    """Updates the PnL for the current day in its own transaction, then RISK_STATE (write-through)."""
+    day = RISK_STATE.current().day
+    try:
+        with conn:
+            record_daily_pnl(conn, pnl, day)
+    except Exception as e:
+        log_event("PNL_UPDATE_ERROR", {"pnl": pnl, "error": str(e)})
+        return
+    apply_committed_pnl(pnl, day)
+
+def observe_equity(equity: float, conn: sqlite3.Connection = None):
+    """Фиксирует капитал на начало торгового дня - первый полученный за день баланс."""
+    state = RISK_STATE.current()
+    if state.start_equity or not equity or equity <= 0:
+        return
+    own_conn = conn is None
+    conn = conn or get_db_connection()
     try:
         with conn:
             conn.execute('''
-                INSERT INTO daily_pnl (trade_date, realised_pnl)
-                VALUES (?, ?)
+                INSERT INTO daily_pnl (trade_date, realised_pnl, start_equity)
+                VALUES (?, 0, ?)
                 ON CONFLICT(trade_date) DO UPDATE SET
-                realised_pnl = realised_pnl + excluded.realised_pnl;
-            ''', (today, pnl))
+                start_equity = COALESCE(start_equity, excluded.start_equity);
+            ''', (state.day, equity))
+            row = conn.execute("SELECT start_equity FROM daily_pnl WHERE trade_date = ?", (state.day,)).fetchone()
     except Exception as e:
-        print(f"ERROR in update_pnl: {e}")
\ No newline at end of file
+        print(f"ERROR in observe_equity: {e}")
+        return
+    finally:
+        if own_conn:
+            conn.close()
+    state.start_equity = row['start_equity']
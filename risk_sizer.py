@@ -1,5 +1,5 @@
 # File: risk_sizer.py
-import math
+from quantization import SIZE_ROUNDING_SLACK, floor_to_step, size_positions
 
 RISK_PER_TRADE_PCT = 0.01
 
@@ -18,11 +18,11 @@ def calculate_position_size(
     risk_per_trade_usd = equity * risk_pct
     position_size = risk_per_trade_usd / price_diff
 
-    # ИЗМЕНЕНО: Используем более надежный метод округления
-    if amount_precision_step == 1:
-        # Для целых чисел (как SHIB) используем стандартное округление до целого
-        return round(position_size)
-    else:
-        # Для дробных - вычисляем количество знаков из шага
-        decimal_places = -int(math.log10(amount_precision_step))
-        return round(position_size, decimal_places)
\ No newline at end of file
+    # Округляем вниз до кратного шага (0.001, 0.5, 1, 25, ...): риск не превышает заданный
+    return floor_to_step(position_size * (1 + SIZE_ROUNDING_SLACK), amount_precision_step)
+
+
+def calculate_position_sizes(entries, stops, equities, risk_pcts, amount_precision_step: float,
+                             price_tick: float = None):
+    """Пакетный вариант calculate_position_size для массивов строк (numpy), см. quantization.size_positions."""
+    return size_positions(entries, stops, equities, risk_pcts, amount_precision_step, price_tick)
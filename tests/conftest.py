@@ -12,6 +12,8 @@ TEST_DB_FILE = "test_app_db.sqlite"
 def setup_for_every_test(monkeypatch, mocker):
     # 1. Isolate the database by deleting files
     monkeypatch.setenv("DATABASE_FILE", TEST_DB_FILE)
+    # Without a snapshot file every wrapper loads markets from the (mocked) exchange
+    monkeypatch.setenv("MARKET_SNAPSHOT_FILE", "")
     if os.path.exists(TEST_DB_FILE): os.remove(TEST_DB_FILE)
     if os.path.exists(f"{TEST_DB_FILE}-shm"): os.remove(f"{TEST_DB_FILE}-shm")
     if os.path.exists(f"{TEST_DB_FILE}-wal"): os.remove(f"{TEST_DB_FILE}-wal")
@@ -20,6 +22,14 @@ def setup_for_every_test(monkeypatch, mocker):
     from db_setup import setup_database
     setup_database()
 
+    # In-memory state must not leak between tests either
+    from trade_store import TRADE_STORE
+    TRADE_STORE.clear()
+    from risk_controls import RISK_STATE
+    RISK_STATE.reset()
+    from live_feed import FEED
+    FEED.clear()
+
     # 3. Mock external services
     mock_main_bybit_client = AsyncMock(name="main_bybit_client_mock")
     mock_main_bybit_client.set_sandbox_mode = MagicMock()
@@ -32,10 +42,15 @@ def setup_for_every_test(monkeypatch, mocker):
     mock_main_bybit_client.get_market_precision = MagicMock(return_value={'amount': 0.001, 'price': 0.01})
     
     mock_main_bybit_client.fetch_open_positions.return_value = {}
+    mock_main_bybit_client.fetch_tickers.return_value = {}
     mock_main_bybit_client.fetch_my_trades.return_value = []
+    mock_main_bybit_client.invalidate_reads = MagicMock()
+    from rate_limiter import PriorityRateLimiter
+    mock_main_bybit_client.rate_limiter = PriorityRateLimiter()
     mocker.patch('main.bybit_client', new=mock_main_bybit_client)
 
     mocker.patch('main.position_manager_loop', new_callable=AsyncMock)
+    mocker.patch('main.equity_tracker_loop', new_callable=AsyncMock)
     
     yield
 
@@ -66,6 +81,9 @@ def mock_bybit_client():
     client.get_market_precision = MagicMock(return_value={'amount': 0.001, 'price': 0.01})
 
     client.create_order.return_value = {"id": "stop_loss_order_1"}
+    client.fetch_open_positions.return_value = {}
+    client.fetch_tickers.return_value = {}
+    client.invalidate_reads = MagicMock()
     
     # --- ИСПРАВЛЕНИЕ ДЛЯ PNL ---
     # Симулируем, что fetch_my_trades возвращает одну сделку с нулевой комиссией.
@@ -21,11 +21,27 @@ def test_backtest_run(monkeypatch): # <-- ADDED monkeypatch
     # Use monkeypatch to correctly override the function in the target module
     monkeypatch.setattr("backtest_runner.bounce_prob", lambda *args, **kwargs: 1.0)
     
-    equity_curve, trades = run_backtest(prices, signals, bb_window=20, bb_std_dev=2.0)
+    equity_curve, trades = run_backtest(prices, signals, bb_window=20, bb_std_dev=2.0, amount_step=0.001)
     
     assert len(trades) > 0
     assert equity_curve[-1] != 1000.0
 
+def test_backtest_floors_size_to_amount_step(monkeypatch):
+    prices = pd.DataFrame({
+        'ts': range(100, 200),
+        'close': list(np.linspace(101, 100, 50)) + list(np.linspace(91, 90, 50)),
+        'low': list(np.linspace(100, 99, 50)) + list(np.linspace(86, 85, 50)),
+        'high': list(np.linspace(102, 101, 50)) + list(np.linspace(96, 95, 50))
+    })
+    # Risk 10 USD over a 1.3 stop -> 7.6923 contracts, floored to 7.69 with a 0.01 step
+    signals = pd.DataFrame({'ts': [150], 'side': ['long'], 'entry': [90], 'sl': [88.7]})
+    monkeypatch.setattr("backtest_runner.bounce_prob", lambda *args, **kwargs: 1.0)
+
+    _, trades = run_backtest(prices, signals, bb_window=20, bb_std_dev=2.0, amount_step=0.01)
+
+    assert trades[0]['outcome'] == 'TP'
+    assert trades[0]['pnl'] == pytest.approx(1.3 * 1.5 * 7.69)
+
 def test_metrics_calculation():
     equity_curve = [1000, 1010, 1005, 1020, 1015]
     total_r, max_dd, sharpe = calculate_metrics(equity_curve, num_days=1)
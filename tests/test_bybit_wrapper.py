@@ -1,7 +1,10 @@
+import asyncio
+import threading
 import pytest
 from unittest.mock import AsyncMock, MagicMock
 import ccxt.async_support as ccxt
 from bybit_wrapper import AsyncBybitWrapper
+from market_metadata import MarketSnapshot
 
 @pytest.fixture
 def mock_exchange():
@@ -66,4 +69,198 @@ async def test_create_order_insufficient_funds(mock_exchange, mocker):
 
     assert 'error' in result
     assert error_message in result['error']
-    mock_log.assert_called_once()
\ No newline at end of file
+    mock_log.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_fetch_tickers_is_one_request_keyed_by_requested_symbols(mock_exchange, mocker):
+    """Тестирует, что цены всех символов приходят одним запросом."""
+    mock_exchange.fetch_tickers.return_value = {
+        'BTC/USDT:USDT': {'last': 60000.0, 'info': {'symbol': 'BTCUSDT'}},
+        'ETH/USDT:USDT': {'last': 3000.0, 'info': {'symbol': 'ETHUSDT'}},
+    }
+    mocker.patch('ccxt.async_support.bybit', return_value=mock_exchange)
+
+    wrapper = AsyncBybitWrapper(api_key="dummy", secret_key="dummy", testnet=True)
+    prices = await wrapper.fetch_tickers(['BTCUSDT', 'ETH/USDT:USDT'])
+
+    assert prices == {'BTCUSDT': 60000.0, 'ETH/USDT:USDT': 3000.0}
+    mock_exchange.fetch_tickers.assert_called_once_with(['BTCUSDT', 'ETH/USDT:USDT'])
+
+
+@pytest.mark.asyncio
+async def test_fetch_open_positions_filters_by_settle_coin(mock_exchange, mocker):
+    """Тестирует, что позиции запрашиваются одним вызовом по монете расчетов."""
+    mock_exchange.fetch_positions.return_value = [
+        {'info': {'symbol': 'BTCUSDT'}, 'contracts': 0.5},
+        {'info': {'symbol': 'ETHUSDT'}, 'contracts': 0},
+    ]
+    mocker.patch('ccxt.async_support.bybit', return_value=mock_exchange)
+
+    wrapper = AsyncBybitWrapper(api_key="dummy", secret_key="dummy", testnet=True)
+    positions = await wrapper.fetch_open_positions()
+
+    assert list(positions) == ['BTCUSDT']
+    mock_exchange.fetch_positions.assert_called_once_with(None, params={'settleCoin': 'USDT'})
+
+
+@pytest.mark.asyncio
+async def test_create_orders_batches_and_marks_rejected(mock_exchange, mocker):
+    """Тестирует пакетное создание ордеров: разбиение на пакеты и отклоненные ордера."""
+    mock_exchange.has = {'createOrders': True}
+    mock_exchange.create_orders.side_effect = lambda chunk: [
+        {'id': f"o{o['price']}"} if o['price'] != 3 else {'id': None, 'info': {'msg': 'rejected'}} for o in chunk
+    ]
+    mocker.patch('ccxt.async_support.bybit', return_value=mock_exchange)
+
+    wrapper = AsyncBybitWrapper(api_key="dummy", secret_key="dummy", testnet=True)
+    orders = [
+        {'symbol': 'BTCUSDT', 'type': 'limit', 'side': 'sell', 'amount': 0.1, 'price': p, 'params': {'reduceOnly': True}}
+        for p in range(12)
+    ]
+    acquire = mocker.spy(wrapper.rate_limiter, 'acquire')
+    results = await wrapper.create_orders(orders)
+
+    assert mock_exchange.create_orders.call_count == 2
+    # Bybit считает пакет поштучно: вес ордерного эндпоинта умножается на число ордеров в пакете
+    assert [c.args[0] for c in acquire.call_args_list] == [5 * 10, 5 * 2]
+    assert len(results) == 12
+    assert results[0]['id'] == 'o0'
+    assert results[3].get('error') and results[3]['price'] == 3
+
+
+@pytest.mark.asyncio
+async def test_signal_burst_fetches_balance_once(mock_exchange, mocker):
+    """20 одновременных запросов баланса - один вызов биржи; повторный в окне свежести - из кэша."""
+
+    async def slow_balance():
+        await asyncio.sleep(0.01)
+        return {'USDT': {'total': 1000.0}}
+
+    mock_exchange.fetch_balance.side_effect = slow_balance
+    mocker.patch('ccxt.async_support.bybit', return_value=mock_exchange)
+    wrapper = AsyncBybitWrapper(api_key="dummy", secret_key="dummy", testnet=True)
+
+    balances = await asyncio.gather(*[wrapper.get_usdt_balance() for _ in range(20)])
+    assert balances == [1000.0] * 20
+    assert await wrapper.get_usdt_balance() == 1000.0
+    assert mock_exchange.fetch_balance.await_count == 1
+    assert wrapper.read_cache.coalesced == 19 and wrapper.read_cache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_order_placement_invalidates_positions_and_balance(mock_exchange, mocker):
+    """Ордер сбрасывает кэш позиций и баланса; ошибки чтения не кэшируются."""
+    mock_exchange.fetch_positions.return_value = [{'info': {'symbol': 'BTCUSDT'}, 'contracts': 1.0}]
+    mock_exchange.fetch_balance.side_effect = [Exception("timeout"), {'USDT': {'total': 500.0}}]
+    mocker.patch('ccxt.async_support.bybit', return_value=mock_exchange)
+    wrapper = AsyncBybitWrapper(api_key="dummy", secret_key="dummy", testnet=True)
+
+    assert await wrapper.get_usdt_balance() == 0.0
+    assert await wrapper.get_usdt_balance() == 500.0
+    await wrapper.fetch_open_positions()
+    await wrapper.fetch_open_positions()
+    assert mock_exchange.fetch_positions.await_count == 1
+
+    await wrapper.create_order('BTCUSDT', 'market', 'sell', 1.0, params={'reduceOnly': True})
+    await wrapper.fetch_open_positions()
+    assert mock_exchange.fetch_positions.await_count == 2
+
+
+MARKETS = {
+    'BTC/USDT:USDT': {'id': 'BTCUSDT', 'symbol': 'BTC/USDT:USDT', 'swap': True, 'contractSize': 1.0,
+                      'precision': {'amount': 0.001, 'price': 0.1}, 'limits': {'amount': {'min': 0.001}}},
+}
+
+
+@pytest.mark.asyncio
+async def test_market_snapshot_lets_next_start_skip_load_markets(mock_exchange, mocker, monkeypatch, tmp_path):
+    """Первый старт пишет снапшот; следующий стартует с него, а рынки догружает в фоне."""
+    snapshot_file = tmp_path / "markets.json"
+    monkeypatch.setenv("MARKET_SNAPSHOT_FILE", str(snapshot_file))
+    mock_exchange.markets = MARKETS
+    mock_exchange.currencies = {}
+    mocker.patch('ccxt.async_support.bybit', return_value=mock_exchange)
+
+    wrapper = AsyncBybitWrapper(api_key="dummy", secret_key="dummy", testnet=True)
+    await wrapper.init()
+    await wrapper.close()
+    assert snapshot_file.exists()
+    # Квантователь доступен и по унифицированному символу, и по id биржи
+    assert wrapper.get_market_precision('BTCUSDT') == {'price': 0.1, 'amount': 0.001}
+    assert wrapper.get_market_quantizer('BTC/USDT:USDT')['amount_decimals'] == 3
+
+    restarted_exchange = AsyncMock()
+    restarted_exchange.set_sandbox_mode = MagicMock()
+    restarted_exchange.set_markets = MagicMock()
+    mocker.patch('ccxt.async_support.bybit', return_value=restarted_exchange)
+    restarted = AsyncBybitWrapper(api_key="dummy", secret_key="dummy", testnet=True)
+    await restarted.init()
+
+    restarted_exchange.load_markets.assert_not_called()
+    restarted_exchange.set_markets.assert_called_once_with(MARKETS, None)
+    assert restarted.markets_etag == wrapper.markets_etag
+    assert restarted.get_market_precision('BTCUSDT') == {'price': 0.1, 'amount': 0.001}
+    restarted_exchange.market.assert_not_called()
+    await restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_stale_market_snapshot_refreshes_in_background(mock_exchange, mocker, monkeypatch, tmp_path):
+    """Устаревший снапшот не задерживает старт: обновление рынков уходит в фоновую задачу."""
+    snapshot_file = tmp_path / "markets.json"
+    monkeypatch.setenv("MARKET_SNAPSHOT_FILE", str(snapshot_file))
+    MarketSnapshot(str(snapshot_file), clock=lambda: 0.0).save(MARKETS, {}, testnet=True)
+    mock_exchange.set_markets = MagicMock()
+    updated = {'BTC/USDT:USDT': {**MARKETS['BTC/USDT:USDT'], 'precision': {'amount': 0.01, 'price': 0.1}}}
+    mock_exchange.markets = updated
+    mock_exchange.currencies = {}
+    mocker.patch('ccxt.async_support.bybit', return_value=mock_exchange)
+
+    wrapper = AsyncBybitWrapper(api_key="dummy", secret_key="dummy", testnet=True)
+    await wrapper.init()
+    assert wrapper.get_market_precision('BTCUSDT')['amount'] == 0.001
+    mock_exchange.load_markets.assert_not_called()
+
+    for _ in range(20):
+        await asyncio.sleep(0.01)
+        if wrapper.get_market_precision('BTCUSDT')['amount'] == 0.01:
+            break
+    await wrapper.close()
+
+    mock_exchange.load_markets.assert_awaited_once_with(True)
+    assert wrapper.get_market_precision('BTCUSDT')['amount'] == 0.01
+    assert MarketSnapshot(str(snapshot_file)).load(testnet=True)['markets'] == updated
+
+
+@pytest.mark.asyncio
+async def test_fetch_my_trades_bypasses_read_cache(mock_exchange, mocker):
+    """Повторное чтение исполнений с тем же ключом идет на биржу: досинхронизация журнала видит новый выход."""
+    mock_exchange.has = {'fetchMyTrades': True}
+    mock_exchange.fetch_my_trades.side_effect = [[], [{'id': 'exit'}]]
+    mocker.patch('ccxt.async_support.bybit', return_value=mock_exchange)
+    wrapper = AsyncBybitWrapper(api_key="dummy", secret_key="dummy", testnet=True)
+
+    assert await wrapper.fetch_my_trades('BTCUSDT', since=1_000, limit=100) == []
+    assert await wrapper.fetch_my_trades('BTCUSDT', since=1_000, limit=100) == [{'id': 'exit'}]
+    assert mock_exchange.fetch_my_trades.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_market_refresh_hashes_markets_off_the_event_loop(mock_exchange, mocker):
+    """Отпечаток рынков считается в рабочем потоке, а не в цикле событий."""
+    import bybit_wrapper
+    hashed_in = []
+
+    def recording_etag(markets):
+        hashed_in.append(threading.get_ident())
+        return "etag-1"
+
+    mocker.patch.object(bybit_wrapper, 'markets_etag', side_effect=recording_etag)
+    mock_exchange.markets = MARKETS
+    mock_exchange.currencies = {}
+    mocker.patch('ccxt.async_support.bybit', return_value=mock_exchange)
+    wrapper = AsyncBybitWrapper(api_key="dummy", secret_key="dummy", testnet=True)
+
+    assert await wrapper.refresh_markets() is True
+    assert hashed_in and threading.get_ident() not in hashed_in
+    assert wrapper.markets_etag == "etag-1"
@@ -0,0 +1,98 @@
+# file: tests/test_dashboard_data.py
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from dashboard_data import DashboardCache
+from db_utils import get_db_connection
+from trade_store import TradeStore
+from tests.test_position_manager import create_test_trade_in_db
+
+
+def _age_all_rows(minutes: int = 60):
+    """Все уже записанные строки - старая история: курсор с перекрытием их не захватывает."""
+    old = (datetime.now(timezone.utc) - timedelta(minutes=minutes)).isoformat(timespec='microseconds')
+    conn = get_db_connection()
+    try:
+        with conn:
+            conn.execute("UPDATE managed_trades SET updated_at = ?, created_at = ?", (old, old))
+            conn.execute("UPDATE live_prices SET updated_at = ?", (old,))
+    finally:
+        conn.close()
+
+
+def _set_price(symbol: str, price: float):
+    conn = get_db_connection()
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO live_prices (symbol, mark_price, updated_at) VALUES (?, ?, ?)",
+                         (symbol, price, datetime.now(timezone.utc).isoformat(timespec='microseconds')))
+    finally:
+        conn.close()
+
+
+def test_incremental_refresh_reads_only_changed_rows():
+    for _ in range(30):
+        create_test_trade_in_db(status='CLOSED')
+    trade_id = create_test_trade_in_db(status='ACTIVE', avg_price=95.0)
+    _set_price('BTCUSDT', 100.0)
+    _age_all_rows()
+
+    cache = DashboardCache(min_refresh_sec=0)
+    cache.refresh()
+    assert list(cache.active['id']) == [trade_id]
+    assert len(cache.history) == 30
+    assert cache.active.loc[trade_id, 'uPNL'] == pytest.approx(0.0)  # executed_qty еще не заполнен
+
+    fetched = cache.rows_fetched
+    cache.refresh()
+    assert cache.rows_fetched == fetched, "Без изменений повторное чтение не должно возвращать строк"
+
+    # Перенос SL и взятая цель: одна строка managed_trades
+    store = TradeStore()
+    store.load()
+    store.update_trade(trade_id, current_sl_price=95.0, executed_qty=1.0)
+    store.update_target(trade_id, 0, status='placed', order_id='tp_1')
+    store.flush()
+    cache.refresh()
+
+    assert cache.rows_fetched - fetched == 1
+    row = cache.active.loc[trade_id]
+    assert (row['current_sl_price'], row['tps_done'], row['progress']) == (95.0, 1, 1.0)
+    assert row['uPNL'] == pytest.approx(5.0)
+
+
+def test_closed_trade_moves_to_history_and_prices_update_upnl():
+    trade_id = create_test_trade_in_db(status='ACTIVE', avg_price=95.0)
+    other_id = create_test_trade_in_db(status='ACTIVE', avg_price=90.0)
+    store = TradeStore()
+    store.load()
+    store.update_trade(trade_id, executed_qty=2.0)
+    store.update_trade(other_id, executed_qty=1.0)
+    store.flush()
+    _set_price('BTCUSDT', 100.0)
+
+    cache = DashboardCache(min_refresh_sec=0)
+    cache.refresh()
+    assert cache.active.loc[trade_id, 'uPNL'] == pytest.approx(10.0)
+
+    _set_price('BTCUSDT', 110.0)
+    cache.refresh()
+    assert cache.active.loc[trade_id, 'uPNL'] == pytest.approx(30.0)
+    assert cache.active.loc[other_id, 'uPNL'] == pytest.approx(20.0)
+
+    store.update_trade(trade_id, status='CLOSED', close_reason='TP_HIT', realized_pnl=30.0)
+    store.flush()
+    cache.refresh()
+    assert list(cache.active['id']) == [other_id]
+    assert list(cache.history['id']) == [trade_id]
+
+
+def test_shared_cache_serves_many_viewers_from_one_query():
+    create_test_trade_in_db(status='ACTIVE', avg_price=95.0)
+    cache = DashboardCache(min_refresh_sec=60)
+
+    frames = [cache.get() for _ in range(20)]
+
+    assert cache.queries == 3   # активные, история, цены - один раз на всех
+    assert all(active is frames[0][0] for active, _ in frames)
@@ -0,0 +1,152 @@
+# file: tests/test_db_migrations.py
+import pytest
+
+import db_migrations
+from db_migrations import apply_migrations, get_schema_version, MIGRATIONS
+from db_utils import get_db_connection
+
+# Hot-path queries and the index each must use. The plan text differs between SQLite
+# versions ("SEARCH t" vs "SEARCH TABLE t", "INDEX" vs "COVERING INDEX"), so the test
+# only checks the index name and that nothing is scanned.
+HOT_QUERIES = [
+    ("SELECT 1 FROM entry_orders WHERE trade_id = ?", (1,), "idx_entry_orders_trade_status"),
+    ("SELECT exchange_order_id FROM entry_orders WHERE trade_id = ? AND status = 'open'", (1,),
+     "idx_entry_orders_trade_status"),
+    ("UPDATE entry_orders SET status='cancelled' WHERE trade_id=? AND status='open'", (1,),
+     "idx_entry_orders_trade_status"),
+    ("SELECT * FROM managed_trades WHERE status = 'CLOSED' ORDER BY updated_at DESC LIMIT 50", (),
+     "idx_managed_trades_status_updated"),
+    ("SELECT tp_index, price, qty, status FROM trade_targets WHERE trade_id = ? ORDER BY tp_index", (1,),
+     "PRIMARY KEY"),
+    ("UPDATE trade_targets SET status='placed', order_id=? WHERE trade_id=? AND tp_index=?", ("x", 1, 0),
+     "PRIMARY KEY"),
+    ("SELECT * FROM trade_log WHERE timestamp_utc >= ? ORDER BY timestamp_utc", ("2025-01-01",),
+     "idx_trade_log_timestamp"),
+    ("SELECT * FROM trade_log WHERE event_type = ? ORDER BY timestamp_utc DESC", ("ORDER_PLACED",),
+     "idx_trade_log_event_type"),
+]
+
+# "status != 'CLOSED'" cannot be a SEARCH: these queries scan the partial index that holds
+# only open rows, already in created_at order. Any other scan is a regression.
+OPEN_TRADES_INDEX = "idx_managed_trades_open_created"
+OPEN_TRADES_QUERIES = [
+    "SELECT * FROM managed_trades WHERE status != 'CLOSED'",
+    "SELECT * FROM managed_trades WHERE status != 'CLOSED' ORDER BY created_at DESC",
+]
+
+
+def _query_plan(query, params=()):
+    conn = get_db_connection()
+    try:
+        return [row['detail'] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+    finally:
+        conn.close()
+
+
+def test_migrations_bring_schema_to_latest_version():
+    conn = get_db_connection()
+    try:
+        assert get_schema_version(conn) == max(version for version, _, _ in MIGRATIONS)
+    finally:
+        conn.close()
+
+
+def test_apply_migrations_is_idempotent():
+    conn = get_db_connection()
+    try:
+        assert apply_migrations(conn) == []
+        # Rewind the version: every step must survive being re-applied over existing objects.
+        conn.execute("UPDATE db_meta SET value = ? WHERE key = 'schema_version'", (str(db_migrations.BASE_SCHEMA_VERSION),))
+        conn.commit()
+        assert apply_migrations(conn) == [version for version, _, _ in MIGRATIONS]
+    finally:
+        conn.close()
+
+
+def test_failed_migration_rolls_back_version(monkeypatch):
+    def broken_step(conn):
+        conn.execute("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("boom")
+
+    latest = max(version for version, _, _ in MIGRATIONS)
+    monkeypatch.setattr(db_migrations, "MIGRATIONS", MIGRATIONS + [(latest + 1, "broken", broken_step)])
+    conn = get_db_connection()
+    try:
+        with pytest.raises(RuntimeError):
+            apply_migrations(conn)
+        assert get_schema_version(conn) == latest
+        assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("query,params,index", HOT_QUERIES)
+def test_hot_queries_use_their_index(query, params, index):
+    plan = _query_plan(query, params)
+
+    assert any(index in detail for detail in plan), f"{index} not used for {query!r}: {plan}"
+    assert not any("SCAN" in detail for detail in plan), f"Scan in plan for {query!r}: {plan}"
+
+
+@pytest.mark.parametrize("query", OPEN_TRADES_QUERIES)
+def test_open_trade_queries_scan_only_the_partial_index(query):
+    plan = _query_plan(query)
+
+    assert any(OPEN_TRADES_INDEX in detail for detail in plan), f"{OPEN_TRADES_INDEX} not used for {query!r}: {plan}"
+    assert not any("SCAN" in detail and OPEN_TRADES_INDEX not in detail for detail in plan), \
+        f"Unexpected scan for {query!r}: {plan}"
+
+
+def test_trade_targets_backfill_from_json_columns():
+    conn = get_db_connection()
+    try:
+        conn.execute("""
+            INSERT INTO managed_trades (
+                instruction_id, symbol, side, status, entry_range_start, entry_range_end,
+                total_qty, initial_sl_price, current_sl_price, initial_tps, remaining_tps,
+                created_at, updated_at
+            ) VALUES ('sig', 'BTCUSDT', 'long', 'ACTIVE', 90, 100, 3.0, 85, 85, '[110, 120, 130]', '[130]', 'now', 'now')
+        """)
+        conn.execute("DELETE FROM trade_targets")
+        conn.execute("UPDATE db_meta SET value = '4' WHERE key = 'schema_version'")
+        conn.commit()
+
+        assert apply_migrations(conn) == [v for v, _, _ in MIGRATIONS if v > 4]
+        targets = [dict(r) for r in conn.execute("SELECT tp_index, price, qty, status FROM trade_targets ORDER BY tp_index")]
+    finally:
+        conn.close()
+
+    assert [t['price'] for t in targets] == [110.0, 120.0, 130.0]
+    assert [t['status'] for t in targets] == ['placed', 'placed', 'pending']
+    assert all(t['qty'] == pytest.approx(1.0) for t in targets)
+
+
+def test_performance_backfill_matches_rebuild():
+    """Migration 10 backfills with its own SQL; the result matches performance.rebuild_aggregates."""
+    from performance import rebuild_aggregates
+    conn = get_db_connection()
+    try:
+        for pnl, reason, symbol in ((12.0, 'TP_HIT', 'BTCUSDT'), (-7.5, 'SL_HIT', 'BTCUSDT'), (0.0, None, 'ETHUSDT')):
+            conn.execute("""
+                INSERT INTO managed_trades (
+                    instruction_id, symbol, side, status, entry_range_start, entry_range_end, total_qty, executed_qty,
+                    avg_entry_price, initial_sl_price, current_sl_price, initial_tps, remaining_tps,
+                    close_reason, realized_pnl, created_at, updated_at
+                ) VALUES ('sig', ?, 'long', 'CLOSED', 90, 100, 2.0, 1.0, 95, 85, 85, '[110]', '[]', ?, ?,
+                          '2026-01-01T10:00:00+00:00', '2026-01-02T10:00:00+00:00')
+            """, (symbol, reason, pnl))
+        conn.commit()
+        with conn:
+            db_migrations._m010_performance_aggregates(conn)
+        backfilled = [dict(r) for r in conn.execute("SELECT * FROM perf_aggregates ORDER BY dimension, key")]
+        with conn:
+            rebuild_aggregates(conn)
+        rebuilt = [dict(r) for r in conn.execute("SELECT * FROM perf_aggregates ORDER BY dimension, key")]
+    finally:
+        conn.close()
+
+    keys = [(r.pop('dimension'), r.pop('key')) for r in backfilled]
+    assert keys == [(r.pop('dimension'), r.pop('key')) for r in rebuilt]
+    assert ('day', '2026-01-02') in keys and ('close_reason', 'UNKNOWN') in keys
+    for backfilled_row, rebuilt_row in zip(backfilled, rebuilt):
+        assert backfilled_row == pytest.approx(rebuilt_row)
@@ -0,0 +1,125 @@
+# file: tests/test_equity_tracker.py
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from db_utils import get_db_connection
+from equity_tracker import prune_equity_snapshots, record_equity_sample, sample_equity
+from risk_controls import RISK_STATE, check_daily_drawdown
+from tests.test_api_process_signal import VALID_SIGNAL_TEXT
+
+
+@check_daily_drawdown(max_loss_pct=0.03, max_drawdown_from_peak_pct=0.05)
+async def dummy_protected_function():
+    return {"status": "allowed"}
+
+
+def _sample(equity: float, wallet_balance: float = None, ts_ms: int = None) -> dict:
+    wallet_balance = equity if wallet_balance is None else wallet_balance
+    return {"ts_ms": ts_ms or int(time.time() * 1000), "wallet_balance": wallet_balance,
+            "unrealized_pnl": equity - wallet_balance, "equity": equity}
+
+
+@pytest.mark.asyncio
+async def test_sample_equity_adds_unrealized_pnl(mock_bybit_client):
+    """Капитал = баланс кошелька + нереализованный PnL всех открытых позиций."""
+    mock_bybit_client.get_usdt_balance.return_value = 1000.0
+    mock_bybit_client.fetch_open_positions.return_value = {
+        "BTCUSDT": {"unrealizedPnl": "-40.5"}, "ETHUSDT": {"unrealizedPnl": 10.5}, "SOLUSDT": {"unrealizedPnl": None},
+    }
+    sample = await sample_equity(mock_bybit_client)
+    assert sample["wallet_balance"] == 1000.0
+    assert sample["unrealized_pnl"] == pytest.approx(-30.0)
+    assert sample["equity"] == pytest.approx(970.0)
+
+    mock_bybit_client.get_usdt_balance.return_value = 0.0
+    assert await sample_equity(mock_bybit_client) is None
+
+
+def test_record_equity_sample_tracks_peak_and_start_equity():
+    """Снимок пишется в equity_snapshots; в памяти - последний капитал, дневной пик и база дня."""
+    record_equity_sample(_sample(1000.0))
+    record_equity_sample(_sample(1100.0))
+    record_equity_sample(_sample(1045.0, wallet_balance=1000.0))
+
+    assert RISK_STATE.live_equity() == 1045.0
+    assert RISK_STATE.peak_equity == 1100.0
+    assert RISK_STATE.start_equity == 1000.0
+    assert RISK_STATE.drawdown_from_peak() == pytest.approx(0.05)
+
+    conn = get_db_connection()
+    try:
+        rows = conn.execute("SELECT equity, unrealized_pnl FROM equity_snapshots ORDER BY ts_ms").fetchall()
+    finally:
+        conn.close()
+    assert len(rows) >= 1
+    assert rows[-1]['unrealized_pnl'] == 45.0
+
+    # После перезапуска пик восстанавливается из таблицы
+    RISK_STATE.reset()
+    RISK_STATE.load()
+    assert RISK_STATE.peak_equity == 1100.0
+    assert RISK_STATE.live_equity() is None
+
+
+def test_stale_equity_is_not_used():
+    record_equity_sample(_sample(1000.0))
+    RISK_STATE.equity_at -= 3600
+    assert RISK_STATE.live_equity() is None
+    assert RISK_STATE.drawdown_from_peak() == 0.0
+
+
+def test_prune_equity_snapshots():
+    old_ts_ms = int((time.time() - 40 * 86400) * 1000)
+    record_equity_sample(_sample(900.0, ts_ms=old_ts_ms))
+    record_equity_sample(_sample(1000.0))
+    assert prune_equity_snapshots(retention_days=30) == 1
+
+
+@pytest.mark.asyncio
+async def test_dd_blocks_on_drawdown_from_peak():
+    """Гейт отклоняет сигналы, когда капитал с учетом нереализованного PnL упал от пика на лимит."""
+    record_equity_sample(_sample(1000.0))
+    record_equity_sample(_sample(960.0, wallet_balance=1000.0))
+    assert await dummy_protected_function() == {"status": "allowed"}
+
+    record_equity_sample(_sample(945.0, wallet_balance=1000.0))
+    with pytest.raises(HTTPException) as exc_info:
+        await dummy_protected_function()
+    assert exc_info.value.status_code == 429
+    assert "drawdown" in exc_info.value.detail
+
+
+def test_process_signal_sizes_from_live_equity(test_app_client, mock_place_entry_grid):
+    """При свежем снимке обработчик не запрашивает баланс у биржи."""
+    import main
+    record_equity_sample(_sample(1000.0))
+    main.bybit_client.get_usdt_balance.reset_mock()
+
+    response = test_app_client.post("/process_signal", params={"raw_text": VALID_SIGNAL_TEXT})
+
+    assert response.status_code == 202, response.text
+    main.bybit_client.get_usdt_balance.assert_not_called()
+
+
+def test_process_signal_falls_back_to_exchange_balance(test_app_client, mock_place_entry_grid):
+    """Без свежего снимка баланс берется с биржи и сразу становится снимком."""
+    import main
+    response = test_app_client.post("/process_signal", params={"raw_text": VALID_SIGNAL_TEXT})
+
+    assert response.status_code == 202, response.text
+    main.bybit_client.get_usdt_balance.assert_called()
+    assert RISK_STATE.live_equity() == 1000.0
+
+
+def test_process_signal_returns_503_when_equity_unavailable(test_app_client, mock_place_entry_grid):
+    """Нет снимка и баланс недоступен: 503, а не размер против нулевого капитала."""
+    import main
+    main.bybit_client.get_usdt_balance.return_value = 0.0
+
+    response = test_app_client.post("/process_signal", params={"raw_text": VALID_SIGNAL_TEXT})
+
+    assert response.status_code == 503
+    assert "Equity unavailable" in response.json()['detail']
+    mock_place_entry_grid.assert_not_called()
@@ -0,0 +1,150 @@
+# file: tests/test_event_stream.py
+import asyncio
+import json
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from event_stream import EventDrivenManager
+from trade_store import TradeStore
+from tests.test_position_manager import create_test_trade_in_db
+
+# Записанные сообщения приватного потока Bybit v5 (сокращены до используемых полей)
+RECORDED_PRIVATE_MESSAGES = [
+    {"topic": "order", "creationTime": 1720000000000, "data": [
+        {"symbol": "BTCUSDT", "orderId": "entry_1", "side": "Buy", "orderStatus": "Filled", "avgPrice": "95.5"}
+    ]},
+    {"topic": "position", "creationTime": 1720000000001, "data": [
+        {"symbol": "BTCUSDT", "side": "Buy", "size": "1", "entryPrice": "95.5", "markPrice": "96"}
+    ]},
+]
+RECORDED_PUBLIC_MESSAGES = [
+    {"topic": "tickers.BTCUSDT", "type": "snapshot", "data": {"symbol": "BTCUSDT", "markPrice": "100", "lastPrice": "100"}},
+    {"topic": "tickers.BTCUSDT", "type": "delta", "data": {"symbol": "BTCUSDT", "lastPrice": "105"}},
+    {"topic": "tickers.BTCUSDT", "type": "delta", "data": {"symbol": "BTCUSDT", "markPrice": "111", "lastPrice": "111"}},
+]
+RECORDED_CLOSE_MESSAGES = [
+    {"topic": "position", "creationTime": 1720000000009, "data": [
+        {"symbol": "BTCUSDT", "side": "", "size": "0", "entryPrice": "0", "markPrice": "84"}
+    ]},
+]
+
+
+class ReplayServer:
+    """Локальная замена WebSocket-серверов Bybit: отвечает на auth/subscribe и проигрывает записанные сообщения."""
+
+    def __init__(self):
+        self.private_ws = None
+        self.public_ws = None
+        self.subscriptions = []
+        self.private_ready = asyncio.Event()
+        self.public_ready = asyncio.Event()
+
+    async def handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        is_private = request.path == "/private"
+        async for msg in ws:
+            data = json.loads(msg.data)
+            if data["op"] == "auth":
+                await ws.send_json({"op": "auth", "success": True})
+            elif data["op"] == "subscribe":
+                self.subscriptions.extend(data["args"])
+                await ws.send_json({"op": "subscribe", "success": True})
+                if is_private:
+                    self.private_ws = ws
+                    self.private_ready.set()
+                else:
+                    self.public_ws = ws
+                    self.public_ready.set()
+        return ws
+
+    async def replay(self, ws, messages):
+        for message in messages:
+            await ws.send_str(json.dumps(message))
+
+
+@pytest_asyncio.fixture
+async def replay_server():
+    server = ReplayServer()
+    app = web.Application()
+    app.router.add_get("/private", server.handle)
+    app.router.add_get("/public", server.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    server.base_url = f"http://127.0.0.1:{port}"
+    yield server
+    await runner.cleanup()
+
+
+async def _wait_for(predicate, timeout=3.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "condition not reached in time"
+        await asyncio.sleep(0.005)
+
+
+@pytest.mark.asyncio
+async def test_event_mode_drives_full_trade_lifecycle(replay_server, mock_bybit_client):
+    """
+    PENDING_ENTRY -> ACTIVE -> TP -> CLOSED только по событиям потока, без цикла опроса.
+    """
+    trade_id = create_test_trade_in_db(status='PENDING_ENTRY')
+    store = TradeStore()
+    store.load()
+    mock_bybit_client.fetch_open_positions.return_value = {}
+    mock_bybit_client.create_limit_order.return_value = {"id": "tp_1"}
+
+    manager = EventDrivenManager(
+        mock_bybit_client, store, api_key="key", secret_key="secret",
+        public_url=f"{replay_server.base_url}/public", private_url=f"{replay_server.base_url}/private",
+    )
+    task = asyncio.create_task(manager.run())
+    try:
+        await asyncio.wait_for(replay_server.private_ready.wait(), 3)
+        await asyncio.wait_for(replay_server.public_ready.wait(), 3)
+        assert "tickers.BTCUSDT" in replay_server.subscriptions
+        await _wait_for(lambda: manager.positions_known)
+
+        await replay_server.replay(replay_server.private_ws, RECORDED_PRIVATE_MESSAGES)
+        await _wait_for(lambda: store.get(trade_id)['status'] == 'ACTIVE')
+        assert store.get(trade_id)['avg_entry_price'] == 95.5
+
+        await replay_server.replay(replay_server.public_ws, RECORDED_PUBLIC_MESSAGES)
+        await _wait_for(lambda: store.get_targets(trade_id)[0]['status'] == 'placed')
+        mock_bybit_client.create_limit_order.assert_called_once()
+
+        await replay_server.replay(replay_server.private_ws, RECORDED_CLOSE_MESSAGES)
+        await _wait_for(lambda: store.get(trade_id) is None)
+        await manager.drain()
+    finally:
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    # Реакция на событие - миллисекунды, а не интервал опроса
+    assert manager.reaction_ms and max(manager.reaction_ms) < 1000
+
+
+@pytest.mark.asyncio
+async def test_ticker_without_crossing_does_not_trigger_reconcile(mock_bybit_client, mocker):
+    trade_id = create_test_trade_in_db(status='ACTIVE', avg_price=95.0)
+    store = TradeStore()
+    store.load()
+    mock_bybit_client.create_limit_order.return_value = {"id": "tp_1"}
+    manager = EventDrivenManager(mock_bybit_client, store, api_key="key", secret_key="secret")
+    manager.positions = {'BTCUSDT': {'entryPrice': '95.0', 'contracts': '1.0', 'markPrice': '100'}}
+    manager.positions_known = True
+    trigger = mocker.spy(manager, 'trigger')
+
+    await manager.handle_public_message({"topic": "tickers.BTCUSDT", "data": {"symbol": "BTCUSDT", "markPrice": "105"}})
+    trigger.assert_not_called()
+
+    await manager.handle_public_message({"topic": "tickers.BTCUSDT", "data": {"symbol": "BTCUSDT", "markPrice": "110"}})
+    trigger.assert_called_once()
+    await manager.drain()
+    assert manager.positions['BTCUSDT']['markPrice'] == "110"
+    assert store.get_targets(trade_id)[0]['status'] == 'placed'
@@ -0,0 +1,183 @@
+# file: tests/test_fill_ledger.py
+import pytest
+
+from db_utils import get_db_connection
+from fill_ledger import (
+    FILLS_PAGE_LIMIT, fill_from_ws, record_fills, sync_symbol_fills, trade_fill_summary, close_reason_from_summary
+)
+from position_manager import reconcile_and_manage
+from risk_controls import RISK_STATE
+from tests.test_position_manager import create_test_trade_in_db
+from trade_store import TradeStore
+
+
+def _ccxt_fill(fill_id, ts, side='sell', price=100.0, amount=0.1, order=None, fee=0.0, stop_order_type=''):
+    return {
+        'id': fill_id, 'order': order, 'timestamp': ts, 'side': side, 'price': price, 'amount': amount,
+        'fee': {'cost': fee}, 'symbol': 'BTC/USDT:USDT',
+        'info': {'symbol': 'BTCUSDT', 'stopOrderType': stop_order_type},
+    }
+
+
+def _fill(fill_id, ts, side, price, qty, order_id):
+    return {'fill_id': fill_id, 'symbol': 'BTCUSDT', 'order_id': order_id, 'side': side, 'price': price,
+            'qty': qty, 'fee': 0.0, 'stop_order_type': None, 'timestamp_ms': ts}
+
+
+def _prepare_active_trade():
+    """Активная лонг-сделка: ордер на вход entry_1, выставленная цель tp_1, стоп sl_1."""
+    trade_id = create_test_trade_in_db(status='ACTIVE', avg_price=95.0, sl_order_id='sl_1')
+    conn = get_db_connection()
+    with conn:
+        conn.execute("UPDATE managed_trades SET executed_qty = 1.0 WHERE id = ?", (trade_id,))
+        conn.execute("INSERT INTO entry_orders (trade_id, exchange_order_id, status) VALUES (?, 'entry_1', 'filled')", (trade_id,))
+        conn.execute("UPDATE trade_targets SET status = 'placed', order_id = 'tp_1' WHERE trade_id = ? AND tp_index = 0", (trade_id,))
+    conn.close()
+    return trade_id
+
+
+def _bybit_history(fills):
+    """fetch_my_trades как у Bybit: самые новые `limit` исполнений окна [since, until], по возрастанию времени."""
+    def fetch(symbol, since=None, limit=20, until=None):
+        window = [f for f in fills if (since is None or f['timestamp'] >= since) and (until is None or f['timestamp'] <= until)]
+        return sorted(window, key=lambda f: f['timestamp'])[-limit:]
+    return fetch
+
+
+@pytest.mark.asyncio
+async def test_sync_pages_backwards_from_newest_and_keeps_cursor(mock_bybit_client):
+    """Больше страницы новых исполнений: окно читается назад по until, ничего не теряется, курсор - на самом новом."""
+    history = [_ccxt_fill(f"f{i}", 1_000 + i // 2) for i in range(2 * FILLS_PAGE_LIMIT + 30)]
+    mock_bybit_client.fetch_my_trades.side_effect = _bybit_history(history)
+
+    assert await sync_symbol_fills(mock_bybit_client, 'BTCUSDT') == len(history)
+
+    calls = mock_bybit_client.fetch_my_trades.call_args_list
+    assert [c.kwargs['until'] for c in calls] == [None, 1_065, 1_016]
+    newest = history[-1]['timestamp']
+    conn = get_db_connection()
+    assert conn.execute("SELECT since_ms FROM fill_cursors WHERE symbol = 'BTCUSDT'").fetchone()[0] == newest
+    assert conn.execute("SELECT COUNT(*) FROM fills").fetchone()[0] == len(history)
+    conn.close()
+
+    mock_bybit_client.fetch_my_trades.reset_mock()
+    assert await sync_symbol_fills(mock_bybit_client, 'BTCUSDT') == 0
+    assert mock_bybit_client.fetch_my_trades.call_args.kwargs['since'] == newest
+
+
+@pytest.mark.asyncio
+async def test_interrupted_sync_keeps_cursor_until_window_is_read(mock_bybit_client):
+    """Ошибка на странице посередине окна: курсор не двигается, следующий вызов дочитывает старые исполнения."""
+    history = [_ccxt_fill(f"f{i}", 1_000 + i) for i in range(FILLS_PAGE_LIMIT + 10)]
+    fetch = _bybit_history(history)
+    mock_bybit_client.fetch_my_trades.side_effect = [fetch('BTCUSDT', limit=FILLS_PAGE_LIMIT), Exception("timeout")]
+
+    with pytest.raises(Exception):
+        await sync_symbol_fills(mock_bybit_client, 'BTCUSDT')
+    conn = get_db_connection()
+    assert conn.execute("SELECT COUNT(*) FROM fill_cursors").fetchone()[0] == 0
+    conn.close()
+
+    mock_bybit_client.fetch_my_trades.side_effect = fetch
+    assert await sync_symbol_fills(mock_bybit_client, 'BTCUSDT') == 10
+    conn = get_db_connection()
+    assert conn.execute("SELECT COUNT(*) FROM fills").fetchone()[0] == len(history)
+    conn.close()
+
+
+def test_fills_attributed_by_order_id_and_pnl_aggregated():
+    """Вход и цель привязываются по id ордера, стоп уровня позиции - к единственной активной сделке."""
+    trade_id = _prepare_active_trade()
+
+    conn = get_db_connection()
+    with conn:
+        record_fills(conn, [
+            {**_fill('e1', 1_000, 'buy', 95.0, 1.0, 'entry_1'), 'fee': 0.05},
+            {**_fill('t1', 2_000, 'sell', 110.0, 0.5, 'tp_1'), 'fee': 0.03},
+            {**_fill('s1', 3_000, 'sell', 95.0, 0.5, 'position_sl'), 'stop_order_type': 'StopLoss'},
+        ])
+    summary = trade_fill_summary(conn, trade_id)
+    kinds = dict(conn.execute("SELECT fill_id, kind FROM fills WHERE trade_id = ?", (trade_id,)).fetchall())
+    conn.close()
+
+    assert kinds == {'e1': 'entry', 't1': 'tp', 's1': 'sl'}
+    assert summary['entry_qty'] == 1.0 and summary['exit_qty'] == 1.0
+    assert summary['realized_pnl'] == pytest.approx(0.5 * 110 + 0.5 * 95 - 95 - 0.08)
+    assert close_reason_from_summary(summary) == 'SL_HIT'
+
+
+@pytest.mark.asyncio
+async def test_close_uses_ledger_without_exchange_round_trip(mock_bybit_client):
+    """Если журнал полон (исполнения пришли из WebSocket), закрытие сделки не ходит на биржу."""
+    trade_id = _prepare_active_trade()
+    conn = get_db_connection()
+    with conn:
+        record_fills(conn, [
+            fill_from_ws({'execId': 'e1', 'orderId': 'entry_1', 'symbol': 'BTCUSDT', 'side': 'Buy',
+                          'execPrice': '95', 'execQty': '1.0', 'execFee': '0', 'execTime': '1000'}),
+            fill_from_ws({'execId': 't1', 'orderId': 'tp_1', 'symbol': 'BTCUSDT', 'side': 'Sell',
+                          'execPrice': '110', 'execQty': '1.0', 'execFee': '0', 'execTime': '2000'}),
+        ])
+    trade = dict(conn.execute("SELECT * FROM managed_trades WHERE id = ?", (trade_id,)).fetchone())
+    conn.close()
+
+    await reconcile_and_manage(trade, None, mock_bybit_client)
+
+    mock_bybit_client.fetch_my_trades.assert_not_called()
+    conn = get_db_connection()
+    trade = dict(conn.execute("SELECT * FROM managed_trades WHERE id = ?", (trade_id,)).fetchone())
+    conn.close()
+    assert trade['status'] == 'CLOSED'
+    assert trade['close_reason'] == 'TP_HIT'
+    assert trade['realized_pnl'] == pytest.approx(15.0)
+
+
+@pytest.mark.asyncio
+async def test_missing_exit_fills_close_without_realized_pnl(mock_bybit_client):
+    """Выход не найден и после синхронизации: сделка закрывается с NULL PnL, а не с минусом суммы входа."""
+    trade_id = _prepare_active_trade()
+    conn = get_db_connection()
+    with conn:
+        record_fills(conn, [
+            fill_from_ws({'execId': 'e1', 'orderId': 'entry_1', 'symbol': 'BTCUSDT', 'side': 'Buy',
+                          'execPrice': '95', 'execQty': '1.0', 'execFee': '0', 'execTime': '1000'}),
+        ])
+    trade = dict(conn.execute("SELECT * FROM managed_trades WHERE id = ?", (trade_id,)).fetchone())
+    conn.close()
+    mock_bybit_client.fetch_my_trades.side_effect = _bybit_history([])
+    realised_before = RISK_STATE.current().realised_pnl
+
+    await reconcile_and_manage(trade, None, mock_bybit_client)
+
+    mock_bybit_client.fetch_my_trades.assert_called()
+    conn = get_db_connection()
+    trade = dict(conn.execute("SELECT * FROM managed_trades WHERE id = ?", (trade_id,)).fetchone())
+    daily_rows = conn.execute("SELECT COUNT(*) FROM daily_pnl WHERE realised_pnl != 0").fetchone()[0]
+    conn.close()
+    assert trade['status'] == 'CLOSED'
+    assert trade['close_reason'] == 'PNL_INCOMPLETE_FILLS'
+    assert trade['realized_pnl'] is None
+    assert daily_rows == 0
+    assert RISK_STATE.current().realised_pnl == realised_before
+
+
+def test_fills_that_arrive_before_their_order_id_are_attributed_later():
+    """Исполнение пришло раньше записи id ордера: привязка при следующей синхронизации и при flush."""
+    trade_id = create_test_trade_in_db(status='PENDING_ENTRY')
+    conn = get_db_connection()
+    with conn:
+        record_fills(conn, [_fill('e1', 1_000, 'buy', 95.0, 1.0, 'entry_1'), _fill('t1', 2_000, 'sell', 110.0, 0.5, 'tp_1')])
+        conn.execute("INSERT INTO entry_orders (trade_id, exchange_order_id, status) VALUES (?, 'entry_1', 'open')", (trade_id,))
+    with conn:
+        assert record_fills(conn, []) == 0
+    conn.close()
+
+    store = TradeStore()
+    store.load()
+    store.update_target(trade_id, 0, status='placed', order_id='tp_1')
+    store.flush()
+
+    conn = get_db_connection()
+    kinds = dict(conn.execute("SELECT fill_id, kind FROM fills WHERE trade_id = ?", (trade_id,)).fetchall())
+    conn.close()
+    assert kinds == {'e1': 'entry', 't1': 'tp'}
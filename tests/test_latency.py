@@ -0,0 +1,57 @@
+# file: tests/test_latency.py
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+import ccxt.async_support as ccxt
+
+from bybit_wrapper import AsyncBybitWrapper
+from latency import LatencyHistogram, LatencyRecorder
+
+
+def test_histogram_percentiles_within_bucket_precision():
+    """Квантили лог-линейной гистограммы отличаются от точных не больше чем на ширину корзины (~1.6%)."""
+    histogram = LatencyHistogram()
+    values = list(range(1, 100_001))  # 1 мкс .. 100 мс
+    for value in values:
+        histogram.record(value)
+
+    p50, p90, p99 = histogram.percentiles((0.5, 0.9, 0.99))
+    for measured, exact in ((p50, 50_000), (p90, 90_000), (p99, 99_000)):
+        assert exact <= measured <= exact * (1 + 1 / 64)
+    assert histogram.summary()['max_ms'] == 100.0
+    assert histogram.summary()['count'] == len(values)
+
+
+def test_recorder_samples_slow_spans_only():
+    """Медленный вызов пишется спаном всегда, быстрые - только по выборке (здесь выключена)."""
+    sink = MagicMock()
+    recorder = LatencyRecorder(span_sample_rate=0, slow_span_ms=100, span_sink=sink)
+    recorder.record('fetch_positions', 'ok', 5_000_000)
+    recorder.record('fetch_positions', 'ok', 250_000_000, lane=2, queued_ns=1_000_000)
+
+    sink.assert_called_once_with("EXCHANGE_SPAN", {"endpoint": "fetch_positions", "outcome": "ok",
+                                                   "duration_ms": 250.0, "lane": 2, "queued_ms": 1.0})
+    assert recorder.snapshot()['fetch_positions']['calls'] == 2
+
+
+@pytest.mark.asyncio
+async def test_wrapper_times_every_call_by_endpoint_and_outcome(mocker):
+    """Каждый вызов биржи попадает в гистограмму своего эндпоинта; ошибки считаются отдельно."""
+    exchange = AsyncMock()
+    exchange.set_sandbox_mode = MagicMock()
+    exchange.create_order.side_effect = [{'id': '1'}, ccxt.InsufficientFunds("no money"), ccxt.RateLimitExceeded("slow down")]
+    mocker.patch('ccxt.async_support.bybit', return_value=exchange)
+    mocker.patch('bybit_wrapper.log_trade_execution')
+    wrapper = AsyncBybitWrapper(api_key="dummy", secret_key="dummy", testnet=True)
+
+    await wrapper.create_order('BTCUSDT', 'limit', 'buy', 0.1, 60000.0)
+    for error in (ccxt.InsufficientFunds, ccxt.RateLimitExceeded):
+        with pytest.raises(error):
+            await wrapper.create_order('BTCUSDT', 'limit', 'buy', 0.1, 60000.0)
+    await wrapper.fetch_open_positions()
+
+    metrics = wrapper.latency_metrics()
+    assert metrics['create_order']['calls'] == 3 and metrics['create_order']['errors'] == 2
+    assert metrics['create_order']['ok']['count'] == 1
+    assert metrics['create_order']['error']['count'] == 1
+    assert metrics['create_order']['rate_limited']['count'] == 1
+    assert metrics['fetch_positions'] == {"calls": 1, "errors": 0, "ok": metrics['fetch_positions']['ok']}
@@ -0,0 +1,115 @@
+# file: tests/test_live_feed.py
+import asyncio
+import json
+import threading
+
+import pytest
+
+from live_feed import FEED, FeedBus, sse_stream
+
+
+async def _collect(stream, n: int) -> list:
+    return [await asyncio.wait_for(stream.__anext__(), 1.0) for _ in range(n)]
+
+
+@pytest.mark.asyncio
+async def test_subscribers_get_only_their_topics():
+    bus = FeedBus()
+    trades = bus.subscribe(["trade"])
+    everything = bus.subscribe()
+
+    bus.publish("price", {"prices": {"BTCUSDT": 100.0}})
+    bus.publish("trade", {"id": 1, "status": "ACTIVE"})
+
+    assert [e.topic for e in await trades.drain(0.1)] == ["trade"]
+    assert [e.topic for e in await everything.drain(0.1)] == ["price", "trade"]
+    assert await trades.drain(0.01) == []
+
+
+@pytest.mark.asyncio
+async def test_sse_stream_formats_events_and_unsubscribes():
+    bus = FeedBus()
+    stream = sse_stream(bus, bus.subscribe(["trade"]), heartbeat=0.01)
+    bus.publish("trade", {"id": 7, "status": "CLOSED"})
+
+    message, ping = await _collect(stream, 2)
+    lines = message.strip().split("\n")
+    assert lines[:2] == ["id: 1", "event: trade"]
+    assert json.loads(lines[2][len("data: "):])["status"] == "CLOSED"
+    assert ping == ": ping\n\n"
+
+    await stream.aclose()
+    assert bus.subscriber_count == 0
+
+
+@pytest.mark.asyncio
+async def test_slow_consumer_is_dropped_and_can_resume_from_cursor():
+    bus = FeedBus(replay_size=100)
+    slow = bus.subscribe(maxsize=3)
+    fast = bus.subscribe(maxsize=100)
+    for i in range(10):
+        bus.publish("event", {"n": i})
+
+    # Отставший клиент отключен, быстрый получил все
+    assert bus.subscriber_count == 1 and bus.dropped_clients == 1
+    assert len(await fast.drain(0.1)) == 10
+
+    stream = sse_stream(bus, slow)
+    messages = await _collect(stream, 4)
+    assert messages[-1].startswith("event: overflow")
+    last_event_id = json.loads(messages[-1].split("data: ")[1])["last_event_id"]
+    assert last_event_id == 3
+
+    resumed = bus.subscribe(last_event_id=last_event_id)
+    assert [e.data["n"] for e in await resumed.drain(0.1)] == list(range(3, 10))
+    assert not resumed.reset
+
+
+@pytest.mark.asyncio
+async def test_replay_gap_marks_reset():
+    bus = FeedBus(replay_size=5)
+    for i in range(20):
+        bus.publish("event", {"n": i})
+
+    subscription = bus.subscribe(last_event_id=2)
+
+    assert subscription.reset
+    assert [e.seq for e in await subscription.drain(0.1)] == [16, 17, 18, 19, 20]
+
+
+@pytest.mark.asyncio
+async def test_publish_from_another_thread():
+    bus = FeedBus()
+    subscription = bus.subscribe()
+    thread = threading.Thread(target=bus.publish, args=("event", {"from": "writer-thread"}))
+    thread.start()
+    thread.join()
+
+    events = await subscription.drain(1.0)
+    assert [e.data for e in events] == [{"from": "writer-thread"}]
+
+
+@pytest.mark.asyncio
+async def test_trade_transitions_and_log_events_are_published():
+    from trade_store import TradeStore
+    from trade_logger import log_event
+    from tests.test_position_manager import create_test_trade_in_db
+
+    trade_id = create_test_trade_in_db(status='ACTIVE', avg_price=95.0)
+    store = TradeStore()
+    store.load()
+    subscription = FEED.subscribe(["trade", "event"])
+
+    store.update_trade(trade_id, status='CLOSED', close_reason='SL_HIT')
+    store.update_trade(trade_id, updated_at='later')     # без значимых для ленты полей
+    log_event("SL_MOVE_SUCCESS", {"trade_id": trade_id})
+
+    trade_event, log_entry = await subscription.drain(0.1)
+    assert (trade_event.topic, trade_event.data["status"], trade_event.data["changed"]) == \
+        ("trade", "CLOSED", ["close_reason", "status"])
+    assert (log_entry.topic, log_entry.data["event_type"]) == ("event", "SL_MOVE_SUCCESS")
+
+
+def test_feed_rejects_unknown_topics(test_app_client):
+    response = test_app_client.get("/feed", params={"topics": "trade,orders"})
+    assert response.status_code == 400
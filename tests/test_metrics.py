@@ -0,0 +1,72 @@
+# file: tests/test_metrics.py
+import sqlite3
+
+import pytest
+
+from db_utils import timed_transaction
+from metrics import Counter, Gauge, Histogram, Registry, SIGNAL_STAGES
+from tests.test_api_process_signal import VALID_SIGNAL_TEXT
+
+
+def test_registry_renders_prometheus_text():
+    """Гистограмма выгружается накопительными корзинами с +Inf, _sum и _count; гейдж - через функцию."""
+    registry = Registry()
+    requests = Counter("requests_total", "Requests.", ("result",), registry=registry)
+    depth = Gauge("depth", "Queue depth.", registry=registry)
+    latency = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0), registry=registry)
+
+    requests.labels("ok").inc()
+    requests.labels("ok").inc(2)
+    depth.set_function(lambda: 7)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+    assert '# TYPE springbot_requests_total counter' in lines
+    assert 'springbot_requests_total{result="ok"} 3' in lines
+    assert 'springbot_depth 7' in lines
+    assert 'springbot_latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'springbot_latency_seconds_bucket{le="1.0"} 3' in lines
+    assert 'springbot_latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'springbot_latency_seconds_sum 3.65' in lines
+    assert 'springbot_latency_seconds_count 4' in lines
+
+
+class _LockedOnCommit(sqlite3.Connection):
+    def commit(self):
+        raise sqlite3.OperationalError("database is locked")
+
+
+def test_timed_transaction_rolls_back_a_failed_commit():
+    """Неудачный COMMIT откатывается (соединение не остается в открытой транзакции) и все равно замеряется."""
+    commit_seconds = Histogram("commit_seconds", "Commit latency.", registry=Registry())
+    conn = sqlite3.connect(":memory:", factory=_LockedOnCommit)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+
+    with pytest.raises(sqlite3.OperationalError):
+        with timed_transaction(conn, commit_seconds.labels()):
+            conn.execute("INSERT INTO t VALUES (1)")
+
+    assert not conn.in_transaction
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    assert commit_seconds.labels().count == 1
+    conn.close()
+
+
+def test_metrics_endpoint_exposes_signal_stages(test_app_client, mock_place_entry_grid):
+    """Каждая стадия /process_signal попадает в свою гистограмму; /metrics отдает текст Prometheus."""
+    before = {stage: child.count for stage, child in SIGNAL_STAGES.items()}
+    response = test_app_client.post("/process_signal", params={"raw_text": VALID_SIGNAL_TEXT})
+    assert response.status_code == 202
+
+    for stage in ("parse", "drawdown_check", "balance_fetch", "sizing", "db_insert"):
+        assert SIGNAL_STAGES[stage].count == before[stage] + 1
+
+    metrics = test_app_client.get("/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain")
+    body = metrics.text
+    assert "springbot_open_trades 1" in body
+    assert 'springbot_queue_depth{queue="rate_limiter_protective"} 0' in body
+    assert 'springbot_signal_stage_seconds_count{stage="db_insert"}' in body
+    assert 'springbot_signals_total{result="accepted"}' in body
@@ -0,0 +1,90 @@
+# file: tests/test_paper_exchange.py
+import pytest
+
+from db_utils import get_db_connection, create_managed_trade
+from paper_exchange import PaperExchange, PriceFeed
+from position_manager import place_entry_grid, run_manager_cycle
+from trade_store import TradeStore
+
+
+@pytest.mark.asyncio
+async def test_matching_reduce_only_and_stop_loss():
+    exchange = PaperExchange(balance=1000.0, taker_fee=0.0, maker_fee=0.0)
+    exchange.set_price('BTCUSDT', 100.0)
+
+    entry = await exchange.create_limit_order('BTCUSDT', 'buy', 1.0, 95.0)
+    assert entry['status'] == 'open'
+    exchange.set_price('BTCUSDT', 94.0)
+    positions = await exchange.fetch_open_positions()
+    assert positions['BTCUSDT']['contracts'] == 1.0 and positions['BTCUSDT']['entryPrice'] == 95.0
+
+    # reduce-only урезается до размера позиции
+    tp = await exchange.create_limit_order('BTCUSDT', 'sell', 5.0, 100.0, params={'reduceOnly': True})
+    sl = await exchange.create_order('BTCUSDT', 'market', 'sell', 1.0, params={'stopLossPrice': 90.0, 'reduceOnly': True})
+    assert sl['status'] == 'open' and sl['triggerPrice'] == 90.0
+
+    exchange.set_price('BTCUSDT', 101.0)
+    assert exchange.orders[tp['id']]['filled'] == 1.0
+    assert await exchange.fetch_open_positions() == {}
+    assert exchange.balance == pytest.approx(1005.0)
+
+    # Позиции нет - сработавший reduce-only стоп отменяется, а не открывает шорт
+    exchange.set_price('BTCUSDT', 89.0)
+    assert exchange.orders[sl['id']]['status'] == 'canceled'
+    assert await exchange.fetch_open_positions() == {}
+    assert [t['order'] for t in await exchange.fetch_my_trades('BTCUSDT', limit=100)] == [entry['id'], tp['id']]
+
+
+@pytest.mark.asyncio
+async def test_error_injection_follows_wrapper_contract():
+    exchange = PaperExchange(error_rate=1.0, error_methods={'fetch_open_positions', 'create_limit_order'})
+    exchange.set_price('BTCUSDT', 100.0)
+
+    assert await exchange.fetch_open_positions() == {}
+    with pytest.raises(Exception):
+        await exchange.create_limit_order('BTCUSDT', 'buy', 1.0, 95.0)
+    assert exchange.injected_errors == 2
+
+
+def test_random_walk_feed_is_replayable():
+    a = PriceFeed.random_walk({'BTCUSDT': 100.0, 'ETHUSDT': 10.0}, steps=50, seed=7, start_ms=0)
+    b = PriceFeed.random_walk({'BTCUSDT': 100.0, 'ETHUSDT': 10.0}, steps=50, seed=7, start_ms=0)
+    assert a.ticks == b.ticks and len(a) == 100
+
+
+@pytest.mark.asyncio
+async def test_full_trade_lifecycle_on_paper_exchange(mocker):
+    """
+    Сквозной прогон без моков: сетка входа -> активация с лестницей -> TP1 -> стоп в безубыток
+    -> выход по стопу, PnL и причина закрытия - из журнала исполнений.
+    """
+    mocker.patch('position_manager.TP_PLACEMENT_MODE', 'ladder')
+    exchange = PaperExchange(balance=1000.0, taker_fee=0.0, maker_fee=0.0)
+    exchange.set_price('BTCUSDT', 105.0)
+    instruction = {'signal_id': 's1', 'symbol': 'BTCUSDT', 'side': 'long', 'entry_start': 90.0, 'entry_end': 100.0,
+                   'stop_loss': 85.0, 'take_profits': [110.0, 120.0], 'move_sl_to_be_after_tp_index': 1,
+                   'grid_orders': 3}
+    trade_id = create_managed_trade(instruction, 0.9)
+    store = TradeStore()
+    store.load()
+    await place_entry_grid(trade_id, 0.9, instruction, exchange, store)
+
+    async def cycle(price):
+        exchange.set_price('BTCUSDT', price)
+        await run_manager_cycle(exchange, store)
+
+    await cycle(94.0)     # исполнились лимитки 95 и 100 -> активация, остаток сетки снят
+    trade = store.get(trade_id)
+    assert trade['status'] == 'ACTIVE' and trade['executed_qty'] == pytest.approx(0.6)
+    await cycle(111.0)    # TP1 исполнен биржей -> стоп в безубыток
+    assert store.get(trade_id)['current_sl_price'] == pytest.approx(97.5)
+    await cycle(97.0)     # стоп сработал -> сделка закрыта
+
+    conn = get_db_connection()
+    trade = dict(conn.execute("SELECT * FROM managed_trades WHERE id = ?", (trade_id,)).fetchone())
+    conn.close()
+    assert trade['status'] == 'CLOSED'
+    assert trade['close_reason'] == 'SL_HIT'
+    # 0.3 по 110 + 0.3 по 97 - 0.6 по 97.5
+    assert trade['realized_pnl'] == pytest.approx(0.3 * 110 + 0.3 * 97 - 0.6 * 97.5)
+    assert exchange.balance == pytest.approx(1000.0 + trade['realized_pnl'])
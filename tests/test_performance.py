@@ -0,0 +1,90 @@
+# file: tests/test_performance.py
+import pytest
+
+from db_utils import get_db_connection
+from performance import load_aggregates, performance_summary, rebuild_aggregates, trade_r_multiple
+from trade_store import TradeStore
+from tests.test_position_manager import create_test_trade_in_db
+
+
+def _close(store: TradeStore, trade_id: int, pnl: float, reason: str):
+    store.update_trade(trade_id, status='CLOSED', close_reason=reason, realized_pnl=pnl, executed_qty=1.0)
+
+
+def _aggregates(dimension: str) -> dict:
+    conn = get_db_connection()
+    try:
+        return {row['key']: row for row in load_aggregates(conn, dimension)}
+    finally:
+        conn.close()
+
+
+def test_trade_r_multiple():
+    trade = {'executed_qty': 2.0, 'avg_entry_price': 100.0, 'initial_sl_price': 95.0, 'realized_pnl': 15.0}
+    assert trade_r_multiple(trade) == 1.5
+    assert trade_r_multiple({**trade, 'realized_pnl': None}) is None
+
+
+def test_closing_trades_updates_aggregates_incrementally():
+    """Закрытие в TradeStore.flush обновляет все срезы в той же транзакции; повторный учет невозможен."""
+    ids = [create_test_trade_in_db(status='ACTIVE', avg_price=95.0) for _ in range(3)]
+    store = TradeStore()
+    store.load()
+    _close(store, ids[0], 20.0, 'TP_HIT')
+    _close(store, ids[1], -10.0, 'SL_HIT')
+    store.flush()
+    _close(store, ids[2], 5.0, 'TP_HIT')
+    store.flush()
+
+    total = _aggregates('all')['all']
+    assert (total['trades'], total['wins'], total['losses']) == (3, 2, 1)
+    assert total['pnl'] == pytest.approx(15.0)
+    assert total['win_rate'] == pytest.approx(2 / 3)
+    assert total['profit_factor'] == pytest.approx(2.5)
+    # Риск до стопа: 1.0 * |95 - 85| = 10 -> R = 2.0, -1.0, 0.5
+    assert total['avg_r'] == pytest.approx(0.5)
+
+    by_reason = _aggregates('close_reason')
+    assert (by_reason['TP_HIT']['trades'], by_reason['SL_HIT']['pnl']) == (2, -10.0)
+    assert _aggregates('symbol')['BTCUSDT']['trades'] == 3
+
+    summary = performance_summary()
+    assert len(summary['daily']) == 1
+    assert summary['equity_curve'][-1]['cumulative_pnl'] == pytest.approx(15.0)
+
+    # Повторный учет той же сделки ничего не меняет
+    from performance import record_closed_trade
+    conn = get_db_connection()
+    try:
+        with conn:
+            trade = dict(conn.execute("SELECT * FROM managed_trades WHERE id = ?", (ids[0],)).fetchone())
+            assert record_closed_trade(conn, trade) is False
+    finally:
+        conn.close()
+    assert _aggregates('all')['all']['trades'] == 3
+
+
+def test_rebuild_matches_incremental_aggregates():
+    ids = [create_test_trade_in_db(status='ACTIVE', avg_price=95.0) for _ in range(4)]
+    store = TradeStore()
+    store.load()
+    for trade_id, pnl in zip(ids, (12.0, -7.5, 3.0, 0.0)):
+        _close(store, trade_id, pnl, 'TP_HIT' if pnl > 0 else 'SL_HIT')
+        store.flush()
+    incremental = {(d, k): row for d in ('all', 'symbol', 'close_reason', 'day') for k, row in _aggregates(d).items()}
+
+    conn = get_db_connection()
+    try:
+        with conn:
+            assert rebuild_aggregates(conn) == 4
+    finally:
+        conn.close()
+    rebuilt = {(d, k): row for d in ('all', 'symbol', 'close_reason', 'day') for k, row in _aggregates(d).items()}
+
+    assert rebuilt == incremental
+
+
+def test_performance_endpoint(test_app_client):
+    response = test_app_client.get("/performance")
+    assert response.status_code == 200
+    assert response.json()['total'] is None
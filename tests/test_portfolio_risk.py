@@ -0,0 +1,111 @@
+# file: tests/test_portfolio_risk.py
+import time
+import pytest
+
+from portfolio_risk import PortfolioExposure, trade_risk
+from trade_store import TradeStore, TRADE_STORE
+from tests.test_api_process_signal import VALID_SIGNAL_TEXT
+
+
+def _trade(trade_id, symbol='BTCUSDT', side='long', qty=1.0, entry=100.0, sl=95.0, status='ACTIVE'):
+    return {
+        'id': trade_id, 'symbol': symbol, 'side': side, 'status': status, 'total_qty': qty,
+        'executed_qty': qty if status == 'ACTIVE' else 0.0, 'avg_entry_price': entry if status == 'ACTIVE' else None,
+        'entry_range_start': entry, 'entry_range_end': entry, 'initial_sl_price': sl, 'current_sl_price': sl,
+    }
+
+
+def test_risk_at_stop_follows_stop_moves():
+    """Риск = qty * расстояние до стопа в сторону убытка; стоп в безубытке риска не несет."""
+    assert trade_risk(_trade(1, qty=2.0, entry=100.0, sl=95.0)) == (1, 10.0, 200.0)
+    assert trade_risk(_trade(2, side='short', qty=2.0, entry=100.0, sl=104.0)) == (-1, 8.0, 200.0)
+    assert trade_risk(_trade(3, qty=2.0, entry=100.0, sl=101.0))[1] == 0.0
+
+
+def test_incremental_updates_match_full_rebuild():
+    """Открытие, перенос стопа и закрытие через TradeStore дают те же агрегаты, что и пересчет с нуля."""
+    store = TradeStore()
+    trades = [_trade(i, symbol=s, side=side, sl=105.0 if side == 'short' else 95.0) for i, (s, side) in
+              enumerate([('BTCUSDT', 'long'), ('ETHUSDT', 'long'), ('BTCUSDT', 'short'), ('SOLUSDT', 'long')], start=1)]
+    for trade in trades:
+        store.trades[trade['id']] = trade
+        store.exposure.upsert(trade)
+    assert store.exposure.total_risk == pytest.approx(20.0)
+
+    store.update_trade(2, current_sl_price=100.0)      # ETH в безубытке
+    store.update_trade(3, status='CLOSED')
+    store.update_trade(4, updated_at='now')              # не влияет на риск
+
+    rebuilt = PortfolioExposure()
+    rebuilt.rebuild([t for t in trades if t['status'] != 'CLOSED'])
+    assert store.exposure.snapshot() == rebuilt.snapshot()
+    assert store.exposure.snapshot()['total_risk'] == 10.0
+    assert store.exposure.snapshot()['buckets'] == {'crypto': 10.0}
+
+
+def test_correlated_longs_blocked_but_hedge_allowed():
+    """Пятый коррелированный лонг превышает лимит группы, а шорт в той же группе ее разгружает."""
+    exposure = PortfolioExposure(buckets={'BTCUSDT': 'majors', 'ETHUSDT': 'majors', 'DOGEUSDT': 'memes'})
+    for trade_id, symbol in enumerate(['BTCUSDT', 'ETHUSDT', 'BTCUSDT'], start=1):
+        exposure.upsert(_trade(trade_id, symbol=symbol))     # риск 5$ на сделку
+
+    equity = 1000.0
+    blocked = exposure.check('ETHUSDT', 'long', 16.0, equity, max_total_pct=1.0, max_symbol_pct=1.0, max_bucket_pct=0.03)
+    assert not blocked['allowed']
+    assert any("bucket 'majors'" in v for v in blocked['violations'])
+
+    assert exposure.check('ETHUSDT', 'short', 16.0, equity, max_total_pct=1.0, max_symbol_pct=1.0,
+                          max_bucket_pct=0.03)['allowed']
+    assert exposure.check('DOGEUSDT', 'long', 16.0, equity, max_total_pct=1.0, max_symbol_pct=1.0,
+                          max_bucket_pct=0.03)['allowed']
+    total = exposure.check('DOGEUSDT', 'long', 16.0, equity, max_total_pct=0.03, max_symbol_pct=1.0, max_bucket_pct=1.0)
+    assert total['violations'] == ["total risk 31.00 > 30.00"]
+
+
+def test_check_is_fast_with_hundreds_of_open_trades():
+    exposure = PortfolioExposure(max_total_pct=0.05, max_symbol_pct=0.02, max_bucket_pct=0.03)
+    for trade_id in range(500):
+        side = 'long' if trade_id % 3 else 'short'
+        exposure.upsert(_trade(trade_id, symbol=f"SYM{trade_id % 150}USDT", side=side, sl=95.0 if side == 'long' else 105.0))
+
+    runs = 2000
+    started = time.perf_counter()
+    for i in range(runs):
+        exposure.check(f"SYM{i % 150}USDT", 'long', 5.0, 100_000.0)
+    assert (time.perf_counter() - started) / runs < 0.001
+
+
+def test_process_signal_rejected_by_portfolio_limit(test_app_client, mock_place_entry_grid, monkeypatch):
+    """Сигнал, превышающий включенный лимит суммарного риска портфеля, отклоняется до создания сделки."""
+    monkeypatch.setattr(TRADE_STORE.exposure, 'max_total_pct', 0.05)
+    TRADE_STORE.loaded = True
+    for trade_id in range(1, 11):
+        TRADE_STORE.exposure.upsert(_trade(trade_id, symbol=f"ALT{trade_id}USDT", side='short', qty=1.0, entry=100.0, sl=105.0))
+
+    response = test_app_client.post("/process_signal", params={"raw_text": VALID_SIGNAL_TEXT})
+
+    assert response.status_code == 429
+    assert "total risk" in response.json()['detail']
+    mock_place_entry_grid.assert_not_called()
+    assert test_app_client.get("/exposure").json()['total_risk'] == 50.0
+
+
+def test_limits_are_off_by_default():
+    """Без настроенных лимитов проверка ничего не отклоняет."""
+    exposure = PortfolioExposure()
+    exposure.upsert(_trade(1, qty=10.0))
+    assert exposure.check('BTCUSDT', 'long', 500.0, 1000.0) == {
+        "allowed": True, "violations": [], "total_risk": 550.0, "symbol_risk": 550.0,
+    }
+
+
+def test_default_config_accepts_signals_the_baseline_accepted(test_app_client, mock_place_entry_grid):
+    """Риск 5% (выше бывшего лимита 2% на символ) и вторая сделка по тому же символу проходят без настроек."""
+    signal = VALID_SIGNAL_TEXT.replace("0.5%", "5%")
+
+    first = test_app_client.post("/process_signal", params={"raw_text": signal})
+    second = test_app_client.post("/process_signal", params={"raw_text": signal})
+
+    assert first.status_code == 202, first.json()
+    assert second.status_code == 202, second.json()
+    assert mock_place_entry_grid.call_count == 2
@@ -7,7 +7,7 @@ from unittest.mock import AsyncMock
 # Импортируем тестируемую функцию
 from position_manager import reconcile_and_manage
 # Импортируем утилиту для получения соединения
-from db_utils import get_db_connection
+from db_utils import get_db_connection, insert_trade_targets
 
 # --- Вспомогательная функция для создания тестовых сделок в БД ---
 
@@ -35,6 +35,9 @@ def create_test_trade_in_db(status='PENDING_ENTRY', avg_price=None, sl_price=85.
             sl_order_id, initial_tps_json, remaining_tps_json, move_sl_idx, now_utc_iso, now_utc_iso
         ))
         trade_id = cursor.lastrowid
+        # Лестница TP теперь живет в trade_targets: уже снятые из remaining_tps цели считаем выставленными
+        remaining = json.loads(remaining_tps_json)
+        insert_trade_targets(conn, trade_id, [110, 120], total_qty, tps_taken=2 - len(remaining))
         conn.commit()
     finally:
         conn.close()
@@ -142,4 +145,282 @@ async def test_reconcile_moves_sl_to_breakeven(mock_bybit_client):
     
     mock_bybit_client.edit_order.assert_called_once_with(
         'sl_initial_123', 'BTCUSDT', 95.0
-    )
\ No newline at end of file
+    )
+
+@pytest.mark.asyncio
+async def test_reconcile_tp_hit_updates_single_target(mock_bybit_client):
+    """
+    Тестирует, что срабатывание TP меняет ровно одну строку в trade_targets.
+    """
+    mock_bybit_client.create_limit_order.return_value = {"id": "tp_order_1"}
+    trade_id = create_test_trade_in_db(status='ACTIVE', avg_price=95.0, sl_order_id='sl_1', move_sl_idx=2)
+
+    conn = get_db_connection()
+    trade_before = dict(conn.execute("SELECT * FROM managed_trades WHERE id = ?", (trade_id,)).fetchone())
+    conn.close()
+
+    live_position_mock = {'symbol': 'BTCUSDT', 'entryPrice': '95.0', 'contracts': '1.0', 'markPrice': '111.0'}
+    await reconcile_and_manage(trade_before, live_position_mock, mock_bybit_client)
+
+    conn = get_db_connection()
+    targets = [dict(r) for r in conn.execute("SELECT * FROM trade_targets WHERE trade_id = ? ORDER BY tp_index", (trade_id,))]
+    conn.close()
+
+    assert [t['status'] for t in targets] == ['placed', 'pending']
+    assert targets[0]['order_id'] == 'tp_order_1'
+    mock_bybit_client.create_limit_order.assert_called_once_with(
+        symbol='BTCUSDT', side='sell', amount=0.5, price=110.0, params={'reduceOnly': True}
+    )
+    # move_sl_idx=2: после первого TP стоп не двигаем
+    mock_bybit_client.edit_order.assert_not_called()
+
+
+# === Группа тестов для параллельного прохода run_manager_cycle ===
+
+@pytest.mark.asyncio
+async def test_manager_cycle_runs_symbols_concurrently_and_serializes_same_symbol(mock_bybit_client, mocker):
+    """
+    Разные символы сверяются параллельно, сделки одного символа - строго по очереди.
+    """
+    import asyncio
+    from position_manager import run_manager_cycle
+    from trade_store import TradeStore
+
+    store = TradeStore()
+    store.trades = {
+        1: {'id': 1, 'symbol': 'BTCUSDT', 'status': 'ACTIVE'},
+        2: {'id': 2, 'symbol': 'BTCUSDT', 'status': 'ACTIVE'},
+        3: {'id': 3, 'symbol': 'ETHUSDT', 'status': 'ACTIVE'},
+        4: {'id': 4, 'symbol': 'SOLUSDT', 'status': 'ACTIVE'},
+    }
+    in_flight = {}
+    max_in_flight = {}
+
+    async def slow_reconcile(trade, live_position, client, store):
+        symbol = trade['symbol']
+        in_flight[symbol] = in_flight.get(symbol, 0) + 1
+        max_in_flight[symbol] = max(max_in_flight.get(symbol, 0), in_flight[symbol])
+        await asyncio.sleep(0.05)
+        in_flight[symbol] -= 1
+
+    mock_bybit_client.fetch_open_positions.return_value = {}
+    mocker.patch('position_manager.reconcile_and_manage', side_effect=slow_reconcile)
+    mocker.patch('position_manager.update_live_prices', new_callable=AsyncMock)
+
+    cycle = await run_manager_cycle(mock_bybit_client, store, max_concurrency=8)
+
+    assert max_in_flight == {'BTCUSDT': 1, 'ETHUSDT': 1, 'SOLUSDT': 1}
+    assert cycle['trades'] == 4 and cycle['symbols'] == 3
+    # Время прохода определяется самым медленным символом (2 x 50 мс), а не суммой (4 x 50 мс)
+    assert cycle['duration_ms'] < 180
+    assert cycle['slowest_symbol_ms'] >= 95
+
+
+@pytest.mark.asyncio
+async def test_update_live_prices_uses_one_bulk_request(mock_bybit_client):
+    """
+    Цены всех символов запрашиваются одним вызовом и пишутся одной пачкой.
+    """
+    from position_manager import update_live_prices
+    mock_bybit_client.fetch_tickers.return_value = {'BTCUSDT': 60000.0, 'ETHUSDT': 3000.0, 'XRPUSDT': 0.0}
+
+    prices = await update_live_prices(mock_bybit_client, ['BTCUSDT', 'ETHUSDT', 'XRPUSDT'])
+
+    mock_bybit_client.fetch_tickers.assert_awaited_once_with(['BTCUSDT', 'ETHUSDT', 'XRPUSDT'])
+    mock_bybit_client.fetch_ticker_price.assert_not_called()
+    assert prices == {'BTCUSDT': 60000.0, 'ETHUSDT': 3000.0}
+    conn = get_db_connection()
+    rows = {r['symbol']: r['mark_price'] for r in conn.execute("SELECT * FROM live_prices")}
+    conn.close()
+    assert rows == {'BTCUSDT': 60000.0, 'ETHUSDT': 3000.0}
+
+
+# === Группа тестов для режима лестницы на бирже (TP_PLACEMENT_MODE=ladder) ===
+
+def _load_trade(trade_id):
+    conn = get_db_connection()
+    try:
+        trade = dict(conn.execute("SELECT * FROM managed_trades WHERE id = ?", (trade_id,)).fetchone())
+        targets = [dict(r) for r in conn.execute("SELECT * FROM trade_targets WHERE trade_id = ? ORDER BY tp_index", (trade_id,))]
+    finally:
+        conn.close()
+    return trade, targets
+
+
+@pytest.mark.asyncio
+async def test_ladder_mode_places_all_exits_in_one_batch_on_activation(mock_bybit_client, mocker):
+    """
+    При активации все цели и условный SL выставляются одним пакетом, объем - по факту входа.
+    """
+    mocker.patch('position_manager.TP_PLACEMENT_MODE', 'ladder')
+    mock_bybit_client.create_orders.return_value = [{'id': 'tp_1'}, {'id': 'tp_2'}, {'id': 'sl_1'}]
+    trade_id = create_test_trade_in_db(status='PENDING_ENTRY')
+    trade, _ = _load_trade(trade_id)
+
+    live_position = {'symbol': 'BTCUSDT', 'entryPrice': '95.0', 'contracts': '0.8', 'markPrice': '96.0'}
+    await reconcile_and_manage(trade, live_position, mock_bybit_client)
+
+    mock_bybit_client.create_orders.assert_awaited_once()
+    orders = mock_bybit_client.create_orders.call_args.args[0]
+    assert [(o['type'], o['price'], o['amount']) for o in orders] == [
+        ('limit', 110, 0.4), ('limit', 120, 0.4), ('market', None, 0.8)
+    ]
+    assert all(o['params']['reduceOnly'] for o in orders)
+    assert orders[-1]['params']['stopLossPrice'] == 85.0
+    mock_bybit_client.create_order.assert_not_called()
+
+    trade, targets = _load_trade(trade_id)
+    assert trade['status'] == 'ACTIVE' and trade['exchange_sl_order_id'] == 'sl_1'
+    assert [(t['status'], t['order_id'], t['qty']) for t in targets] == [('placed', 'tp_1', 0.4), ('placed', 'tp_2', 0.4)]
+
+
+@pytest.mark.asyncio
+async def test_ladder_mode_tracks_fills_from_position_size_and_moves_sl(mock_bybit_client, mocker):
+    """
+    Активная сделка в режиме лестницы: исполнение цели видно по уменьшению позиции,
+    без отдельных запросов ордеров; после первой цели стоп уходит в безубыток.
+    """
+    mocker.patch('position_manager.TP_PLACEMENT_MODE', 'ladder')
+    mock_bybit_client.create_orders.return_value = [{'id': 'tp_1'}, {'id': 'tp_2'}, {'id': 'sl_1'}]
+    trade_id = create_test_trade_in_db(status='PENDING_ENTRY', move_sl_idx=1)
+    trade, _ = _load_trade(trade_id)
+    await reconcile_and_manage(trade, {'symbol': 'BTCUSDT', 'entryPrice': '95.0', 'contracts': '1.0', 'markPrice': '96.0'}, mock_bybit_client)
+
+    # Цена ниже цели: ничего не исполнено, стоп на месте
+    trade, _ = _load_trade(trade_id)
+    await reconcile_and_manage(trade, {'symbol': 'BTCUSDT', 'entryPrice': '95.0', 'contracts': '1.0', 'markPrice': '105.0'}, mock_bybit_client)
+    mock_bybit_client.edit_order.assert_not_called()
+
+    # Первая цель исполнилась на бирже: позиция уменьшилась вдвое
+    trade, _ = _load_trade(trade_id)
+    await reconcile_and_manage(trade, {'symbol': 'BTCUSDT', 'entryPrice': '95.0', 'contracts': '0.5', 'markPrice': '111.0'}, mock_bybit_client)
+
+    trade, targets = _load_trade(trade_id)
+    assert [t['status'] for t in targets] == ['filled', 'placed']
+    assert targets[0]['filled_at'] is not None
+    assert trade['current_sl_price'] == 95.0
+    mock_bybit_client.edit_order.assert_called_once_with('sl_1', 'BTCUSDT', 95.0)
+    mock_bybit_client.create_limit_order.assert_not_called()
+
+    # Позиция закрыта стопом: оставшаяся цель и SL снимаются с биржи
+    await reconcile_and_manage(trade, None, mock_bybit_client)
+    trade, targets = _load_trade(trade_id)
+    assert trade['status'] == 'CLOSED'
+    assert [t['status'] for t in targets] == ['filled', 'cancelled']
+    mock_bybit_client.cancel_order.assert_any_call('tp_2', 'BTCUSDT')
+    mock_bybit_client.cancel_order.assert_any_call('sl_1', 'BTCUSDT')
+
+
+@pytest.mark.asyncio
+async def test_ladder_mode_retries_only_rejected_stop_loss(mock_bybit_client, mocker):
+    """
+    Если биржа отклонила SL, сделка остается в PENDING_ENTRY, а повторная активация
+    не выставляет уже принятые цели второй раз.
+    """
+    mocker.patch('position_manager.TP_PLACEMENT_MODE', 'ladder')
+    mock_bybit_client.create_orders.side_effect = [
+        [{'id': 'tp_1'}, {'id': 'tp_2'}, {'error': 'rejected'}],
+        [{'id': 'sl_1'}],
+    ]
+    trade_id = create_test_trade_in_db(status='PENDING_ENTRY')
+    live_position = {'symbol': 'BTCUSDT', 'entryPrice': '95.0', 'contracts': '1.0', 'markPrice': '96.0'}
+
+    trade, _ = _load_trade(trade_id)
+    await reconcile_and_manage(trade, live_position, mock_bybit_client)
+    trade, targets = _load_trade(trade_id)
+    assert trade['status'] == 'PENDING_ENTRY'
+    assert [t['status'] for t in targets] == ['placed', 'placed']
+
+    await reconcile_and_manage(trade, live_position, mock_bybit_client)
+    retry_orders = mock_bybit_client.create_orders.call_args.args[0]
+    assert [o['type'] for o in retry_orders] == ['market']
+    trade, _ = _load_trade(trade_id)
+    assert trade['status'] == 'ACTIVE' and trade['exchange_sl_order_id'] == 'sl_1'
+
+
+@pytest.mark.asyncio
+async def test_ladder_rungs_are_floored_and_never_exceed_position(mock_bybit_client, mocker):
+    """
+    Ступени округляются вниз до шага и в сумме не превышают позиции; пыль закрывает стоп.
+    При повторе уже выставленная цель учитывается по выставленному объему.
+    """
+    mocker.patch('position_manager.TP_PLACEMENT_MODE', 'ladder')
+    mock_bybit_client.get_market_precision.return_value = {'amount': 0.1, 'price': 0.01}
+    mock_bybit_client.create_orders.side_effect = [
+        [{'id': 'tp_1'}, {'error': 'rejected'}, {'error': 'rejected'}],
+        [{'id': 'tp_2'}, {'id': 'sl_1'}],
+    ]
+    trade_id = create_test_trade_in_db(status='PENDING_ENTRY')
+    live_position = {'symbol': 'BTCUSDT', 'entryPrice': '95.0', 'contracts': '0.25', 'markPrice': '96.0'}
+
+    trade, _ = _load_trade(trade_id)
+    await reconcile_and_manage(trade, live_position, mock_bybit_client)
+    orders = mock_bybit_client.create_orders.call_args.args[0]
+    # Округление к ближайшему дало бы 0.1 + 0.2 = 0.3 > 0.25
+    assert [o['amount'] for o in orders] == [0.1, 0.1, 0.25]
+
+    trade, _ = _load_trade(trade_id)
+    await reconcile_and_manage(trade, live_position, mock_bybit_client)
+    retry_orders = mock_bybit_client.create_orders.call_args.args[0]
+    assert [(o['price'], o['amount']) for o in retry_orders] == [(120, 0.1), (None, 0.25)]
+    _, targets = _load_trade(trade_id)
+    assert [(t['status'], t['qty']) for t in targets] == [('placed', 0.1), ('placed', 0.1)]
+
+
+# === Группа тестов для сетки входа ===
+
+@pytest.mark.parametrize("distribution, side, expected", [
+    ('linear', 'long', [(100.0, 0.2), (105.0, 0.2), (110.0, 0.2)]),
+    ('geometric', 'long', [(100.0, 0.2), (104.881, 0.2), (110.0, 0.2)]),
+    # Лонг: больше объема на нижней (лучшей) цене; шорт - на верхней
+    ('weighted', 'long', [(100.0, 0.3), (105.0, 0.2), (110.0, 0.1)]),
+    ('weighted', 'short', [(100.0, 0.1), (105.0, 0.2), (110.0, 0.3)]),
+])
+def test_build_entry_grid_distributions(distribution, side, expected):
+    from position_manager import build_entry_grid
+    instruction = {'side': side, 'entry_start': 100.0, 'entry_end': 110.0, 'grid_orders': 3, 'grid_distribution': distribution}
+
+    grid = build_entry_grid(instruction, 0.6, 0.001)
+
+    assert [(round(p, 3), q) for p, q in grid] == expected
+    assert sum(q for _, q in grid) <= 0.6 + 1e-9
+
+
+@pytest.mark.asyncio
+async def test_place_entry_grid_one_batch_and_no_db_lock_during_io(mock_bybit_client):
+    """
+    Сетка уходит одним пакетом; пока ждем биржу, БД свободна для записи другими.
+    """
+    import sqlite3
+    import os
+    from position_manager import place_entry_grid
+    from trade_store import TradeStore
+
+    trade_id = create_test_trade_in_db(status='PENDING_ENTRY')
+    store = TradeStore()
+    store.load()
+
+    async def exchange_round_trip(orders):
+        other = sqlite3.connect(os.environ['DATABASE_FILE'], timeout=0)
+        try:
+            other.execute("BEGIN IMMEDIATE")
+            other.rollback()
+        finally:
+            other.close()
+        return [{'id': f'entry_{i}'} for i in range(len(orders) - 1)] + [{'error': 'rejected'}]
+
+    mock_bybit_client.create_orders.side_effect = exchange_round_trip
+    instruction = {'symbol': 'BTCUSDT', 'side': 'long', 'entry_start': 90.0, 'entry_end': 100.0,
+                   'grid_orders': 5, 'grid_distribution': 'linear'}
+
+    await place_entry_grid(trade_id, 1.0, instruction, mock_bybit_client, store)
+
+    mock_bybit_client.create_orders.assert_awaited_once()
+    assert len(mock_bybit_client.create_orders.call_args.args[0]) == 5
+    assert {o['side'] for o in mock_bybit_client.create_orders.call_args.args[0]} == {'buy'}
+    mock_bybit_client.create_limit_order.assert_not_called()
+    conn = get_db_connection()
+    rows = [r['exchange_order_id'] for r in conn.execute("SELECT exchange_order_id FROM entry_orders WHERE trade_id = ?", (trade_id,))]
+    conn.close()
+    assert rows == ['entry_0', 'entry_1', 'entry_2', 'entry_3']
+    assert store.open_entry_orders(trade_id) == rows
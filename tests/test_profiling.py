@@ -0,0 +1,81 @@
+# file: tests/test_profiling.py
+import asyncio
+import time
+import pytest
+
+from profiling import PROFILER, SlowCallbackWatchdog
+from tests.test_api_process_signal import VALID_SIGNAL_TEXT
+
+
+@pytest.fixture(autouse=True)
+def clean_profiler():
+    PROFILER.disarm()
+    PROFILER.last_report = None
+    yield
+    PROFILER.disarm()
+    PROFILER.last_report = None
+
+
+def _busy(seconds: float):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_profile_endpoints_are_disabled_by_default(test_app_client):
+    assert test_app_client.post("/debug/profile", params={"target": "signal"}).status_code == 404
+
+
+def test_cprofile_covers_next_n_signals(test_app_client, mock_place_entry_grid, mocker):
+    """Взведенный на 2 вызова профилировщик снимает ровно 2 сигнала и отдает pstats."""
+    mocker.patch('main.PROFILING_ENABLED', True)
+    armed = test_app_client.post("/debug/profile", params={"target": "signal", "calls": 2})
+    assert armed.status_code == 200 and armed.json()["remaining"] == 2
+
+    for _ in range(3):
+        assert test_app_client.post("/process_signal", params={"raw_text": VALID_SIGNAL_TEXT}).status_code == 202
+
+    status = test_app_client.get("/debug/profile").json()
+    assert status["armed"] is False
+    assert status["last_report"]["calls"] == 2
+    report = test_app_client.get("/debug/profile/report", params={"format": "pstats"})
+    assert report.status_code == 200
+    assert "_process_signal" in report.text
+    assert test_app_client.get("/debug/profile/report", params={"format": "collapsed"}).status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_sampling_mode_collects_collapsed_stacks():
+    """Семплирующий режим снимает стеки потока цикла событий во время профилируемого прохода."""
+    async def hot_cycle():
+        _busy(0.1)
+        return {"trades": 1}
+
+    PROFILER.arm("cycle", 1, mode="sampling")
+    assert await PROFILER.profile("signal", asyncio.sleep(0, result="untouched")) == "untouched"
+    assert await PROFILER.profile("cycle", hot_cycle()) == {"trades": 1}
+
+    collapsed = PROFILER.render("collapsed")
+    assert PROFILER.target is None
+    assert any("hot_cycle" in line and "_busy" in line for line in collapsed.splitlines())
+
+
+@pytest.mark.asyncio
+async def test_watchdog_logs_blocking_callback_with_stack(mocker):
+    """Синхронная блокировка цикла дольше порога логируется один раз, со стеком виновника."""
+    mock_log = mocker.patch('profiling.log_event')
+    watchdog = SlowCallbackWatchdog(threshold_ms=50)
+    task = asyncio.create_task(watchdog.run())
+    await asyncio.sleep(0.05)
+
+    _busy(0.3)
+    await asyncio.sleep(0.05)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert watchdog.detected == 1
+    event_type, payload = mock_log.call_args.args
+    assert event_type == "SLOW_CALLBACK"
+    assert payload["blocked_ms"] >= 50
+    assert "test_watchdog_logs_blocking_callback_with_stack" in payload["stack"]
@@ -0,0 +1,93 @@
+# file: tests/test_quantization.py
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_UP
+
+import numpy as np
+import pytest
+
+from quantization import StepQuantizer, quantizer_for, size_positions, step_decimals
+from risk_sizer import calculate_position_size
+
+STEPS = [0.001, 0.01, 0.1, 0.5, 1, 5, 25, 0.0001, 0.00001, 0.025, 0.3, 1e-8]
+
+
+def decimal_to_step(x: float, step: float, rounding) -> float:
+    """Эталон: десятичная запись x (repr) делится на шаг точно, в Decimal."""
+    step_d = Decimal(repr(step))
+    return float((Decimal(repr(x)) / step_d).to_integral_value(rounding=rounding) * step_d)
+
+
+def random_values(step: float, n: int, rng) -> np.ndarray:
+    """Смесь случайных значений и точных кратных шага с соседними float: там ошибается наивное деление."""
+    multiples = rng.integers(-10**6, 10**6, n) * Decimal(repr(step))
+    exact = np.array([float(m) for m in multiples])
+    near = np.nextafter(exact, np.where(rng.random(n) < 0.5, -np.inf, np.inf))
+    halves = np.array([float(m + Decimal(repr(step)) / 2) for m in multiples])
+    noise = rng.uniform(-1e6, 1e6, n) * step
+    return np.concatenate([exact, near, halves, noise])
+
+
+@pytest.mark.parametrize("step", STEPS)
+def test_quantizer_matches_decimal(step):
+    """Свойство: floor/ceil/round для чисел и массивов совпадают с Decimal бит в бит."""
+    rng = np.random.default_rng(int(step * 1e8) + 1)
+    values = random_values(step, 500, rng)
+    quantizer = StepQuantizer(step)
+
+    floored, ceiled, rounded = quantizer.floor(values), quantizer.ceil(values), quantizer.round(values)
+    for i, x in enumerate(values.tolist()):
+        expected = (decimal_to_step(x, step, ROUND_FLOOR), decimal_to_step(x, step, ROUND_CEILING),
+                    decimal_to_step(x, step, ROUND_HALF_UP))
+        assert (quantizer.floor(x), quantizer.ceil(x), quantizer.round(x)) == expected, x
+        assert (floored[i], ceiled[i], rounded[i]) == expected, x
+
+
+def test_step_units_and_decimals():
+    assert (step_decimals(0.5), StepQuantizer(0.5).units) == (1, 5)
+    assert (step_decimals(25), StepQuantizer(25).units) == (0, 25)
+    assert StepQuantizer(0.001).floor_units(0.123) == 123
+    assert StepQuantizer(25).floor(99.0) == 75.0
+    assert StepQuantizer(0.5).round(1.25) == 1.5
+    assert quantizer_for(0.001) is quantizer_for(0.001)
+    with pytest.raises(ValueError):
+        StepQuantizer(0)
+
+
+def test_split_never_exceeds_total():
+    quantizer = quantizer_for(0.001)
+    assert quantizer.split(0.6, [1, 1, 1]) == [0.2, 0.2, 0.2]
+    assert quantizer.split(0.1, [1, 1, 1]) == [0.033, 0.033, 0.033]
+    rng = np.random.default_rng(3)
+    for _ in range(200):
+        total = float(quantizer.floor(rng.uniform(0, 50)))
+        parts = quantizer.split(total, rng.uniform(0.1, 5, int(rng.integers(1, 10))))
+        assert Decimal(repr(total)) >= sum(Decimal(repr(p)) for p in parts)
+        assert all(p == quantizer.floor(p) for p in parts)
+
+
+def test_batch_sizing_matches_scalar_and_decimal():
+    """Пакетный расчет совпадает со скалярным; риск с округленным объемом не превышает заданный."""
+    rng = np.random.default_rng(11)
+    n = 2000
+    entry = np.round(rng.uniform(1, 70000, n), 2)
+    stop = np.round(entry * rng.uniform(0.9, 1.1, n), 2)
+    equity = np.round(rng.uniform(0, 50000, n), 2)
+    risk = rng.choice([0.005, 0.01, 0.02], n)
+    for step in (0.001, 0.5, 25):
+        sizes = size_positions(entry, stop, equity, risk, step).tolist()
+        for size, e, s, eq, r in zip(sizes, entry.tolist(), stop.tolist(), equity.tolist(), risk.tolist()):
+            assert size == calculate_position_size(e, s, eq, step, r)
+            risk_usd = Decimal(repr(eq)) * Decimal(repr(r))
+            assert Decimal(repr(size)) * abs(Decimal(repr(e)) - Decimal(repr(s))) <= risk_usd + Decimal("1e-9")
+
+
+def test_batch_sizing_aligns_distance_to_price_tick():
+    # 0.000025 - 0.000024 во float - это 1.0000000000000026e-06
+    sizes = size_positions([0.000025, 100.0], [0.000024, 100.0], [1000.0, 1000.0], 0.01, 1, price_tick=0.000001)
+    assert sizes.tolist() == [10000000.0, 0.0]
+
+
+def test_calculate_position_size_steps_above_one():
+    # Шаги 0.5 и 25 раньше округлялись до знаков после запятой, а не до кратного шага
+    assert calculate_position_size(100.0, 99.0, 1000.0, amount_precision_step=0.5, risk_pct=0.0137) == 13.5
+    assert calculate_position_size(1.0, 0.99, 1000.0, amount_precision_step=25) == 1000.0
+    assert calculate_position_size(1.0, 0.99, 1090.0, amount_precision_step=25) == 1075.0
@@ -0,0 +1,77 @@
+# file: tests/test_rate_limiter.py
+import asyncio
+import time
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from rate_limiter import PriorityRateLimiter, LANE_PROTECTIVE, LANE_TRADING, LANE_MARKET_DATA
+
+
+@pytest.mark.asyncio
+async def test_protective_lane_preempts_queued_market_data():
+    """Защитный запрос, пришедший позже, обслуживается раньше уже ждущих запросов рыночных данных."""
+    limiter = PriorityRateLimiter(rate=50, capacity=1)
+    await limiter.acquire(1, LANE_MARKET_DATA)  # бюджет исчерпан
+    order = []
+
+    async def request(name, lane):
+        await limiter.acquire(1, lane)
+        order.append(name)
+
+    polls = [asyncio.create_task(request(f"poll{i}", LANE_MARKET_DATA)) for i in range(3)]
+    await asyncio.sleep(0)
+    stop_loss = asyncio.create_task(request("sl", LANE_PROTECTIVE))
+    entry = asyncio.create_task(request("entry", LANE_TRADING))
+    await asyncio.gather(*polls, stop_loss, entry)
+
+    assert order == ["sl", "entry", "poll0", "poll1", "poll2"]
+    metrics = limiter.metrics()
+    assert metrics["market_data"]["max_queue_depth"] == 3
+    assert metrics["protective"]["waited"] == 1
+    assert metrics["queue_depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_throughput_stays_at_ceiling():
+    """Поток запросов идет со скоростью лимита: всплеск в пределах capacity, дальше - rate в секунду."""
+    limiter = PriorityRateLimiter(rate=200, capacity=10)
+    start = time.perf_counter()
+    await asyncio.gather(*[limiter.acquire(1, LANE_MARKET_DATA) for _ in range(50)])
+    elapsed = time.perf_counter() - start
+
+    # 10 сразу + 40 по 5 мс = 200 мс; заметно быстрее - значит лимит превышен
+    assert 0.18 <= elapsed < 0.4
+    assert limiter.metrics()["market_data"]["acquired"] == 50
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_consume_budget():
+    limiter = PriorityRateLimiter(rate=100, capacity=1)
+    await limiter.acquire(1)
+    waiter = asyncio.create_task(limiter.acquire(1, LANE_MARKET_DATA))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+
+    await asyncio.wait_for(limiter.acquire(1, LANE_PROTECTIVE), timeout=0.1)
+    assert limiter.metrics()["market_data"]["acquired"] == 1
+
+
+@pytest.mark.asyncio
+async def test_wrapper_routes_stop_loss_to_protective_lane(mocker):
+    from bybit_wrapper import AsyncBybitWrapper
+    exchange = AsyncMock()
+    exchange.set_sandbox_mode = MagicMock()
+    exchange.edit_order.return_value = {'id': 'sl_1'}
+    exchange.fetch_tickers.return_value = {}
+    mocker.patch('ccxt.async_support.bybit', return_value=exchange)
+
+    wrapper = AsyncBybitWrapper(api_key="dummy", secret_key="dummy", testnet=True)
+    await wrapper.edit_order('sl_1', 'BTCUSDT', 95.0)
+    await wrapper.fetch_tickers(['BTCUSDT'])
+
+    metrics = wrapper.rate_limit_metrics()
+    assert metrics["protective"]["acquired"] == 1
+    assert metrics["market_data"]["acquired"] == 1
+    assert metrics["rejections"] == 0
@@ -0,0 +1,78 @@
+# file: tests/test_reconcile_scheduler.py
+import pytest
+from unittest.mock import AsyncMock
+
+from reconcile_scheduler import ReconcileScheduler
+from position_manager import run_manager_cycle
+from trade_store import TradeStore
+
+ACTIVE_LONG = {
+    'id': 1, 'symbol': 'BTCUSDT', 'side': 'long', 'status': 'ACTIVE',
+    'entry_range_start': 90.0, 'entry_range_end': 100.0, 'current_sl_price': 50.0,
+}
+
+
+def _targets(price):
+    return [{'tp_index': 0, 'price': price, 'status': 'pending'}]
+
+
+def test_trade_near_level_is_checked_every_second():
+    scheduler = ReconcileScheduler(min_interval=1, max_interval=60)
+    # TP в 0.05% от цены
+    assert scheduler.interval_for(ACTIVE_LONG, _targets(100.05), 100.0) == 1
+
+
+def test_trade_far_from_levels_is_checked_every_minute():
+    scheduler = ReconcileScheduler(min_interval=1, max_interval=60)
+    # TP в 20% от цены, SL в 50%
+    assert scheduler.interval_for(ACTIVE_LONG, _targets(120.0), 100.0) == 60
+
+
+def test_higher_volatility_shortens_interval():
+    calm = ReconcileScheduler(min_interval=0.01, max_interval=3600)
+    wild = ReconcileScheduler(min_interval=0.01, max_interval=3600)
+    for i, price in enumerate([100.0, 100.01, 100.0, 100.01]):
+        calm.observe_price('BTCUSDT', price, now=float(i))
+    for i, price in enumerate([100.0, 101.0, 99.0, 101.0]):
+        wild.observe_price('BTCUSDT', price, now=float(i))
+
+    assert wild.volatility('BTCUSDT') > calm.volatility('BTCUSDT')
+    assert wild.interval_for(ACTIVE_LONG, _targets(105.0), 100.0) < calm.interval_for(ACTIVE_LONG, _targets(105.0), 100.0)
+
+
+def test_pop_due_returns_trades_in_deadline_order_and_skips_stale_entries():
+    scheduler = ReconcileScheduler()
+    scheduler.schedule(1, 10.0)
+    scheduler.schedule(2, 5.0)
+    scheduler.schedule(3, 30.0)
+    scheduler.schedule(1, 20.0)  # перенос: старая запись на 10.0 должна быть проигнорирована
+
+    assert scheduler.pop_due(now=15.0) == [2]
+    assert scheduler.pop_due(now=25.0) == [1]
+    assert scheduler.next_deadline() == 30.0
+
+
+@pytest.mark.asyncio
+async def test_adaptive_cycle_only_reconciles_due_trades_and_reschedules(mock_bybit_client, mocker):
+    store = TradeStore()
+    near = dict(ACTIVE_LONG, id=1)
+    far = dict(ACTIVE_LONG, id=2, symbol='ETHUSDT')
+    store.trades = {1: near, 2: far}
+    store.targets = {1: _targets(100.05), 2: _targets(130.0)}
+    scheduler = ReconcileScheduler(min_interval=1, max_interval=60)
+
+    mock_bybit_client.fetch_open_positions.return_value = {
+        'BTCUSDT': {'markPrice': '100.0'}, 'ETHUSDT': {'markPrice': '100.0'}
+    }
+    mocker.patch('position_manager.update_live_prices', new_callable=AsyncMock, return_value={})
+    reconcile = mocker.patch('position_manager.reconcile_and_manage', new_callable=AsyncMock)
+
+    due = scheduler.due_trades(store, now=0.0)
+    assert {t['id'] for t in due} == {1, 2}
+    await run_manager_cycle(mock_bybit_client, store, trades=due, scheduler=scheduler)
+    assert reconcile.await_count == 2
+
+    # Сделка у уровня получает дедлайн намного раньше далекой
+    deadline_near = scheduler._deadlines[1]
+    deadline_far = scheduler._deadlines[2]
+    assert deadline_far - deadline_near > 30
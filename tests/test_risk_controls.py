@@ -1,11 +1,11 @@
 # file: tests/test_risk_controls.py
 import pytest
 import numpy as np
-from datetime import date
+from datetime import date, datetime, timedelta, timezone
 from fastapi import HTTPException
 
 # Импортируем тестируемые функции
-from risk_controls import check_daily_drawdown, update_pnl
+from risk_controls import check_daily_drawdown, update_pnl, observe_equity, trading_day, RISK_STATE
 # Импортируем утилиту для получения соединения
 from db_utils import get_db_connection
 
@@ -100,6 +100,64 @@ def test_update_pnl_accumulates_correctly():
     # Значение будет ровно 7.0, так как нет "грязных" данных из других тестов
     assert np.isclose(pnl, 7.0)
 
+@pytest.mark.asyncio
+async def test_dd_gate_does_no_io_after_first_load(mocker):
+    """Состояние дня читается из БД один раз; дальше гейт и update_pnl работают через память."""
+    conn = get_db_connection()
+    try:
+        update_pnl(conn, -10.0)
+    finally:
+        conn.close()
+    spy = mocker.patch('risk_controls.get_db_connection', side_effect=AssertionError("gate must not touch the DB"))
+
+    for _ in range(100):
+        assert await dummy_protected_function() == {"status": "allowed"}
+    spy.assert_not_called()
+    assert RISK_STATE.realised_pnl == -10.0
+
+
+@pytest.mark.asyncio
+async def test_dd_limit_uses_start_of_day_equity():
+    """Лимит считается от капитала на начало дня: при 2000$ убыток 40$ еще допустим (лимит 60$)."""
+    observe_equity(2000.0)
+    observe_equity(500.0)  # Повторный баланс за день базу не меняет
+    conn = get_db_connection()
+    try:
+        update_pnl(conn, -40.0)
+        row = conn.execute("SELECT start_equity FROM daily_pnl WHERE trade_date = ?", (RISK_STATE.day,)).fetchone()
+    finally:
+        conn.close()
+
+    assert row['start_equity'] == 2000.0
+    assert await dummy_protected_function() == {"status": "allowed"}
+    conn = get_db_connection()
+    try:
+        update_pnl(conn, -20.0)
+    finally:
+        conn.close()
+    with pytest.raises(HTTPException) as exc_info:
+        await dummy_protected_function()
+    assert "$60.00" in exc_info.value.detail
+
+
+def test_risk_state_rolls_over_at_day_boundary():
+    """На границе торгового дня PnL и база капитала сбрасываются и читаются для нового дня."""
+    day_one = datetime(2025, 3, 1, 23, 59, tzinfo=timezone.utc)
+    day_two = day_one + timedelta(minutes=2)
+    conn = get_db_connection()
+    with conn:
+        conn.execute("INSERT INTO daily_pnl (trade_date, realised_pnl, start_equity) VALUES (?, -25.0, 1500.0)",
+                     (trading_day(day_one),))
+    conn.close()
+
+    state = RISK_STATE.current(now_utc=day_one)
+    assert (state.realised_pnl, state.start_equity) == (-25.0, 1500.0)
+
+    state = RISK_STATE.current(now_utc=day_two)
+    assert state.day == trading_day(day_two) != trading_day(day_one)
+    assert state.realised_pnl == 0.0 and state.start_equity is None
+
+
 def test_final_state_is_also_clean():
     """
     Этот тест должен выполняться ПОСЛЕДНИМ в этом файле.
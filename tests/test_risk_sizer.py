@@ -25,3 +25,9 @@ def test_calculate_position_size_zero_balance():
 def test_calculate_position_size_zero_price_diff():
     size = calculate_position_size(60000.0, 60000.0, 1000.0, amount_precision_step=0.001)
     assert size == 0.0
+
+
+def test_calculate_position_size_keeps_all_step_decimals():
+    # -log10(0.001) во float равен 2.999..., поэтому раньше размер округлялся до 0.12
+    size = calculate_position_size(100.0, 19.0, 1000.0, amount_precision_step=0.001)
+    assert size == 0.123
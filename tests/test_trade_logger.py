@@ -1,9 +1,16 @@
 # file: tests/test_trade_logger.py
 import pytest
 import json
+import threading
+import time
+
+import trade_logger
 
 # Импортируем тестируемые функции
-from trade_logger import log_signal, log_trade_execution, log_event
+from trade_logger import (
+    log_signal, log_trade_execution, log_event,
+    BatchedLogWriter, start_log_writer, stop_log_writer,
+)
 from db_utils import get_db_connection
 
 # Эта строка применит фикстуру clean_db ко всем тестам в файле
@@ -77,4 +84,87 @@ def test_log_event_generic(): # REMOVE db_conn
 
     assert log_entry is not None
     payload = json.loads(log_entry['payload_json'])
-    assert payload['key'] == "value"
\ No newline at end of file
+    assert payload['key'] == "value"
+
+# === Группа тестов для фонового писателя BatchedLogWriter ===
+
+def _count_events(event_type):
+    conn = get_db_connection()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM trade_log WHERE event_type = ?", (event_type,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_batched_writer_flushes_queued_events():
+    """Проверяет, что события из очереди попадают в БД пачкой после flush()."""
+    commits_before = trade_logger._LOG_COMMIT_SECONDS.count
+    writer = start_log_writer(flush_interval_ms=50, batch_size=100, echo=False)
+    try:
+        for i in range(250):
+            log_event("BATCHED_TEST_EVENT", {"i": i})
+        writer.flush()
+        assert _count_events("BATCHED_TEST_EVENT") == 250
+        # 250 событий при batch_size=100 -> не меньше трех транзакций, но и не 250
+        assert 3 <= writer.batches < 250
+        # каждая пачка - один COMMIT, и его длительность попадает в гистограмму
+        assert trade_logger._LOG_COMMIT_SECONDS.count - commits_before == writer.batches
+    finally:
+        stop_log_writer()
+
+
+def test_batched_writer_stop_writes_remaining_events():
+    """Проверяет, что остановка писателя дописывает остаток очереди."""
+    start_log_writer(flush_interval_ms=10_000, batch_size=10_000, echo=False)
+    for i in range(20):
+        log_event("SHUTDOWN_TEST_EVENT", {"i": i})
+    stop_log_writer()
+
+    assert _count_events("SHUTDOWN_TEST_EVENT") == 20
+
+
+def test_batched_writer_stop_is_bounded_when_the_writer_hangs(monkeypatch):
+    """Поток завис на записи, очередь полна (политика block): stop не ждет дольше таймаута и пишет остаток синхронно."""
+    entered, release = threading.Event(), threading.Event()
+
+    def hanging_write(batch):
+        entered.set()
+        release.wait(5)
+
+    writer = BatchedLogWriter(maxsize=2, flush_interval_ms=10, batch_size=1, overflow_policy="block", echo=False)
+    monkeypatch.setattr(writer, "_write_batch", hanging_write)
+    writer.start()
+    try:
+        writer.submit(("ts", "HANGING_EVENT", {}))
+        assert entered.wait(1)
+        writer.submit(("ts", "QUEUED_EVENT", {"i": "1"}))
+        writer.submit(("ts", "QUEUED_EVENT", {"i": "2"}))
+
+        started = time.monotonic()
+        writer.stop(timeout=0.2)
+
+        assert time.monotonic() - started < 1
+        assert not writer.running
+        assert _count_events("QUEUED_EVENT") == 2
+        assert _count_events("LOG_WRITER_STOP_TIMEOUT") == 1
+    finally:
+        release.set()
+
+
+def test_batched_writer_drop_newest_policy():
+    """Проверяет политику drop_newest при переполнении очереди (поток не запущен)."""
+    writer = BatchedLogWriter(maxsize=2, overflow_policy="drop_newest", echo=False)
+    assert writer.submit(("ts", "E", {})) is True
+    assert writer.submit(("ts", "E", {})) is True
+    assert writer.submit(("ts", "E", {})) is False
+    assert writer.dropped == 1
+    assert writer.qsize() == 2
+
+
+def test_batched_writer_drop_oldest_policy():
+    """Проверяет политику drop_oldest: в очереди остаются самые свежие события."""
+    writer = BatchedLogWriter(maxsize=2, overflow_policy="drop_oldest", echo=False)
+    for i in range(3):
+        writer.submit(("ts", f"E{i}", {}))
+    assert writer.dropped == 1
+    assert [writer._queue.get_nowait()[1] for _ in range(2)] == ["E1", "E2"]
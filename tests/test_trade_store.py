@@ -0,0 +1,147 @@
+# file: tests/test_trade_store.py
+import sqlite3
+
+import pytest
+from unittest.mock import AsyncMock
+
+import position_manager
+import trade_store
+from position_manager import run_manager_cycle
+from trade_store import TradeStore
+from risk_controls import RISK_STATE
+from db_utils import get_db_connection
+from tests.test_position_manager import create_test_trade_in_db
+
+
+def _fetch_trade(trade_id):
+    conn = get_db_connection()
+    try:
+        return dict(conn.execute("SELECT * FROM managed_trades WHERE id = ?", (trade_id,)).fetchone())
+    finally:
+        conn.close()
+
+
+def test_load_keeps_only_open_trades():
+    open_id = create_test_trade_in_db(status='ACTIVE', avg_price=95.0)
+    closed_id = create_test_trade_in_db(status='CLOSED')
+
+    store = TradeStore()
+    store.load()
+
+    assert set(store.trades) == {open_id}
+    assert [t['price'] for t in store.get_targets(open_id)] == [110.0, 120.0]
+    assert closed_id not in store.trades
+
+
+def test_changes_are_written_only_on_flush():
+    trade_id = create_test_trade_in_db(status='ACTIVE', avg_price=95.0)
+    store = TradeStore()
+    store.load()
+
+    store.update_trade(trade_id, current_sl_price=95.0, updated_at='later')
+    store.update_target(trade_id, 0, status='placed', order_id='tp_1')
+    assert _fetch_trade(trade_id)['current_sl_price'] == 85.0
+
+    commits_before = trade_store._FLUSH_COMMIT_SECONDS.count
+    assert store.flush() == 2
+    assert trade_store._FLUSH_COMMIT_SECONDS.count == commits_before + 1
+    assert _fetch_trade(trade_id)['current_sl_price'] == 95.0
+    assert not store.dirty
+    assert store.flush() == 0
+
+
+def test_flush_evicts_closed_trades():
+    trade_id = create_test_trade_in_db(status='ACTIVE', avg_price=95.0)
+    store = TradeStore()
+    store.load()
+
+    store.update_trade(trade_id, status='CLOSED', close_reason='SL_HIT')
+    store.flush()
+
+    assert store.get(trade_id) is None
+    assert _fetch_trade(trade_id)['status'] == 'CLOSED'
+
+
+def _daily_pnl_total():
+    conn = get_db_connection()
+    try:
+        return conn.execute("SELECT COALESCE(SUM(realised_pnl), 0) FROM daily_pnl").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_close_and_daily_pnl_are_written_in_one_transaction(monkeypatch):
+    """Сбой flush не оставляет дневной PnL без статуса CLOSED; повтор пишет оба один раз, память - после COMMIT."""
+    trade_id = create_test_trade_in_db(status='ACTIVE', avg_price=95.0)
+    realised_before = RISK_STATE.current().realised_pnl
+    store = TradeStore()
+    store.load()
+    store.update_trade(trade_id, status='CLOSED', close_reason='SL_HIT', realized_pnl=-10.0)
+
+    def failing_record(conn, pnl, day=None):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(trade_store, 'record_daily_pnl', failing_record)
+        with pytest.raises(sqlite3.OperationalError):
+            store.flush()
+    assert _fetch_trade(trade_id)['status'] == 'ACTIVE'
+    assert _daily_pnl_total() == 0
+    assert RISK_STATE.current().realised_pnl == realised_before
+
+    store.flush()
+    store.flush()
+    assert _fetch_trade(trade_id)['status'] == 'CLOSED'
+    assert _daily_pnl_total() == -10.0
+    assert RISK_STATE.current().realised_pnl == realised_before - 10.0
+
+
+@pytest.mark.asyncio
+async def test_steady_state_cycle_does_not_read_db(mock_bybit_client, mocker):
+    """В установившемся режиме цикл менеджера не открывает соединений с БД вообще."""
+    create_test_trade_in_db(status='ACTIVE', avg_price=95.0, remaining_tps='[]')
+    store = TradeStore()
+    store.load()
+
+    mock_bybit_client.fetch_open_positions.return_value = {
+        'BTCUSDT': {'entryPrice': '95.0', 'contracts': '1.0', 'markPrice': '100.0'}
+    }
+    mocker.patch('position_manager.update_live_prices', new_callable=AsyncMock)
+    pm_conn = mocker.spy(position_manager, 'get_db_connection')
+    store_conn = mocker.spy(trade_store, 'get_db_connection')
+
+    await run_manager_cycle(mock_bybit_client, store)
+
+    assert pm_conn.call_count == 0
+    assert store_conn.call_count == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_entry_cancel_is_kept_and_retried(mock_bybit_client):
+    """Неудачная отмена ордера на вход не теряет его id; подтвержденная или 'уже нет на бирже' - убирает."""
+    trade_id = create_test_trade_in_db(status='ACTIVE', avg_price=95.0)
+    conn = get_db_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO entry_orders (trade_id, exchange_order_id, status) VALUES (?, ?, 'open')",
+            [(trade_id, 'e1'), (trade_id, 'e2'), (trade_id, 'e3')]
+        )
+    conn.close()
+    store = TradeStore()
+    store.load()
+    mock_bybit_client.cancel_order.side_effect = [
+        {'id': 'e1'}, {'error': 'timeout', 'not_found': False}, {'error': 'filled', 'not_found': True},
+    ]
+
+    assert await position_manager.cancel_open_entry_orders(store.get(trade_id), mock_bybit_client, store) == 1
+    store.flush()
+    assert store.open_entry_orders(trade_id) == ['e2']
+
+    mock_bybit_client.cancel_order.side_effect = None
+    mock_bybit_client.cancel_order.return_value = {'id': 'e2'}
+    assert await position_manager.cancel_open_entry_orders(store.get(trade_id), mock_bybit_client, store) == 0
+    store.flush()
+    conn = get_db_connection()
+    statuses = dict(conn.execute("SELECT exchange_order_id, status FROM entry_orders WHERE trade_id = ?", (trade_id,)).fetchall())
+    conn.close()
+    assert statuses == {'e1': 'cancelled', 'e2': 'cancelled', 'e3': 'cancelled'}
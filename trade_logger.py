@@ -1,40 +1,242 @@
 # file: trade_logger.py
 import json
+import os
+import queue
+import threading
+import time
 from datetime import datetime, timezone
 
 # Импортируем наш унифицированный коннектор к БД
-from db_utils import get_db_connection
+from db_utils import get_db_connection, timed_transaction
+from metrics import DB_COMMIT_SECONDS
+from live_feed import FEED
 
-def log_event(event_type: str, payload: dict):
+# --- Настройки фонового писателя журнала ---
+LOG_QUEUE_MAXSIZE = int(os.getenv("LOG_QUEUE_MAXSIZE", "10000"))
+LOG_FLUSH_INTERVAL_MS = int(os.getenv("LOG_FLUSH_INTERVAL_MS", "200"))
+LOG_FLUSH_BATCH_SIZE = int(os.getenv("LOG_FLUSH_BATCH_SIZE", "500"))
+# drop_oldest | drop_newest | block
+LOG_OVERFLOW_POLICY = os.getenv("LOG_OVERFLOW_POLICY", "drop_oldest")
+LOG_ECHO = os.getenv("LOG_ECHO", "1") == "1"
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+_INSERT_SQL = "INSERT INTO trade_log (timestamp_utc, event_type, payload_json) VALUES (?, ?, ?)"
+_STOP = object()
+_LOG_COMMIT_SECONDS = DB_COMMIT_SECONDS.labels("trade_log")
+
+
+class BatchedLogWriter:
     """
-    Универсальная функция для логирования любого события в системе.
-    Записывает событие в таблицу 'trade_log'.
+    Фоновый писатель для таблицы 'trade_log'.
 
-    Args:
-        event_type (str): Тип события (например, 'SIGNAL_RECEIVED', 'ORDER_PLACED').
-        payload (dict): Словарь с дополнительными данными о событии.
+    События складываются в ограниченную очередь, а отдельный поток пишет их пачками
+    через `executemany` в одной транзакции: каждые `flush_interval_ms` миллисекунд
+    или как только накопилось `batch_size` событий.
+
+    Политики переполнения очереди:
+        drop_oldest - выбрасываем самое старое событие, новое ставим в очередь;
+        drop_newest - выбрасываем новое событие;
+        block       - вызывающий поток ждет освобождения места.
     """
+
+    def __init__(self, maxsize: int = LOG_QUEUE_MAXSIZE, flush_interval_ms: int = LOG_FLUSH_INTERVAL_MS,
+                 batch_size: int = LOG_FLUSH_BATCH_SIZE, overflow_policy: str = LOG_OVERFLOW_POLICY,
+                 echo: bool = LOG_ECHO):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}'. Expected one of {OVERFLOW_POLICIES}.")
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._flush_interval = flush_interval_ms / 1000
+        self._batch_size = batch_size
+        self._overflow_policy = overflow_policy
+        self._echo = echo
+        self._thread = None
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._run, name="trade-log-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: tuple) -> bool:
+        """Ставит запись в очередь. Возвращает False, если запись была отброшена."""
+        if self._overflow_policy == "block":
+            self._queue.put(record)
+            return True
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            pass
+
+        if self._overflow_policy == "drop_newest":
+            self.dropped += 1
+            return False
+
+        # drop_oldest: освобождаем место, выкидывая голову очереди
+        while True:
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(record)
+                return True
+            except queue.Full:
+                continue
+
+    def flush(self):
+        """Блокирует вызывающий поток, пока все поставленные в очередь события не будут записаны."""
+        if self.running:
+            self._queue.join()
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Дописывает остаток очереди и останавливает поток, но ждет не дольше `timeout` секунд:
+        при политике block очередь может быть полна, а поток - занят записью в заблокированную БД.
+        Что не успел записать поток, пишется синхронно через _write_event_sync.
+        """
+        if not self.running:
+            return
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        thread, self._thread = self._thread, None
+        thread.join(max(0.0, deadline - time.monotonic()))
+        if thread.is_alive():
+            # Писатель уже не running, поэтому это событие (и все новые) пишутся синхронно
+            log_event("LOG_WRITER_STOP_TIMEOUT", {"timeout_sec": timeout, "queued": self.qsize()})
+            self._drain_sync()
+
+    def _drain_sync(self):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if item is not _STOP:
+                    _write_event_sync(item, item[2])
+            finally:
+                self._queue.task_done()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                first = self._queue.get(timeout=self._flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = []
+            if first is _STOP:
+                stopping = True
+            else:
+                batch.append(first)
+                deadline = time.monotonic() + self._flush_interval
+                while len(batch) < self._batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+
+            if stopping:
+                # Забираем все, что успели поставить до сигнала остановки
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+                    else:
+                        self._queue.task_done()
+
+            try:
+                if batch:
+                    self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+                # task_done для самого _STOP
+                if stopping:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch: list):
+        rows = [(ts, event_type, json.dumps(payload)) for ts, event_type, payload in batch]
+        conn = None
+        try:
+            conn = get_db_connection()
+            with timed_transaction(conn, _LOG_COMMIT_SECONDS):
+                conn.executemany(_INSERT_SQL, rows)
+            self.written += len(rows)
+            self.batches += 1
+        except Exception as e:
+            print(f"[LOGGING_ERROR] Failed to flush {len(rows)} events. Error: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+        if self._echo:
+            for _, event_type, payload in batch:
+                print(f"[LOG] Event: {event_type} | Payload: {payload}")
+
+
+_writer = None
+
+
+def start_log_writer(**kwargs) -> BatchedLogWriter:
+    """Запускает фоновый писатель. После этого log_event больше не пишет в БД синхронно."""
+    global _writer
+    if _writer is None or not _writer.running:
+        _writer = BatchedLogWriter(**kwargs)
+        _writer.start()
+    return _writer
+
+
+def stop_log_writer():
+    """Сбрасывает очередь на диск и останавливает писатель (вызывается из lifespan при остановке)."""
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+def get_log_writer():
+    return _writer
+
+
+def _write_event_sync(record: tuple, payload: dict):
+    """Старый путь: одна вставка в своей транзакции. Используется, пока писатель не запущен."""
+    timestamp_utc, event_type, serializable_payload = record
     try:
         conn = get_db_connection()
-        
-        # Преобразуем все значения в payload в строки, чтобы избежать ошибок сериализации
-        # сложных объектов (например, Decimal) и обеспечить консистентность.
-        serializable_payload = {k: str(v) for k, v in payload.items()}
-        payload_str = json.dumps(serializable_payload)
-
-        record = {
-            "timestamp_utc": datetime.now(timezone.utc).isoformat(timespec='microseconds'),
-            "event_type": event_type,
-            "payload_json": payload_str
-        }
-        
+
         # Используем `with conn:` для автоматического коммита или отката транзакции
         with conn:
-            conn.execute(
-                "INSERT INTO trade_log (timestamp_utc, event_type, payload_json) VALUES (:timestamp_utc, :event_type, :payload_json)",
-                record
-            )
-        
+            conn.execute(_INSERT_SQL, (timestamp_utc, event_type, json.dumps(serializable_payload)))
+
         print(f"[LOG] Event: {event_type} | Payload: {payload}")
 
     except Exception as e:
@@ -46,6 +248,40 @@ def log_event(event_type: str, payload: dict):
             conn.close()
 
 
+def log_event(event_type: str, payload: dict):
+    """
+    Универсальная функция для логирования любого события в системе.
+    Записывает событие в таблицу 'trade_log'.
+
+    Если запущен фоновый писатель (см. start_log_writer), событие только ставится
+    в очередь, а запись в БД происходит пачкой в фоновом потоке.
+
+    Args:
+        event_type (str): Тип события (например, 'SIGNAL_RECEIVED', 'ORDER_PLACED').
+        payload (dict): Словарь с дополнительными данными о событии.
+    """
+    try:
+        # Преобразуем все значения в payload в строки, чтобы избежать ошибок сериализации
+        # сложных объектов (например, Decimal) и обеспечить консистентность.
+        # Делаем это сразу, чтобы последующие изменения объектов не попали в журнал.
+        serializable_payload = {k: str(v) for k, v in payload.items()}
+        record = (
+            datetime.now(timezone.utc).isoformat(timespec='microseconds'),
+            event_type,
+            serializable_payload,
+        )
+    except Exception as e:
+        print(f"[LOGGING_ERROR] Failed to log event '{event_type}'. Error: {e}")
+        return
+
+    FEED.publish("event", {"timestamp_utc": record[0], "event_type": event_type, "payload": serializable_payload})
+    writer = _writer
+    if writer is not None and writer.running:
+        writer.submit(record)
+    else:
+        _write_event_sync(record, payload)
+
+
 def log_signal(signal: dict):
     """
     Специализированная функция-хелпер для логирования входящего торгового сигнала.
@@ -60,12 +296,12 @@ def log_trade_execution(order_result: dict):
     """
     # Создаем копию, чтобы не изменять оригинальный объект, который может еще использоваться
     payload = order_result.copy()
-    
+
     # Определяем тип события
     # Если в результате есть ключ 'error' и он не None/пустой, считаем это ошибкой
     if payload.get('error'):
         event_type = "ORDER_FAILED"
     else:
         event_type = "ORDER_PLACED"
-        
-    log_event(event_type, payload=payload)
\ No newline at end of file
+
+    log_event(event_type, payload=payload)
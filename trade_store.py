@@ -0,0 +1,255 @@
+# file: trade_store.py
+import sqlite3
+from datetime import datetime, timezone
+
+from db_utils import get_db_connection, timed_transaction
+from fill_ledger import attribute_fills
+from live_feed import FEED
+from performance import record_closed_trade
+from metrics import DB_COMMIT_SECONDS
+from portfolio_risk import PortfolioExposure
+from risk_controls import apply_committed_pnl, record_daily_pnl, trading_day
+
+_FLUSH_COMMIT_SECONDS = DB_COMMIT_SECONDS.labels("trade_store_flush")
+# Колонки, от которых зависит риск сделки в PortfolioExposure
+_EXPOSURE_FIELDS = frozenset(('status', 'current_sl_price', 'avg_entry_price', 'executed_qty', 'total_qty'))
+# Изменения этих колонок публикуются в живую ленту (topic "trade")
+_FEED_FIELDS = frozenset(('status', 'current_sl_price', 'avg_entry_price', 'executed_qty', 'close_reason', 'realized_pnl'))
+_FEED_COLUMNS = ('id', 'symbol', 'side', 'status', 'total_qty', 'executed_qty', 'avg_entry_price',
+                 'current_sl_price', 'close_reason', 'realized_pnl')
+
+
+def publish_trade(trade: dict, changed=()):
+    FEED.publish("trade", {**{c: trade.get(c) for c in _FEED_COLUMNS}, "changed": sorted(changed)})
+
+
+class TradeStore:
+    """
+    Авторитетная in-memory таблица открытых сделок менеджера позиций.
+
+    Загружается из БД один раз при старте (load), дополняется событиями API (load_trade,
+    add_entry_orders), а все изменения помечаются грязными и записываются обратно
+    в SQLite одной транзакцией за цикл (flush). БД остается долговременной копией.
+    updated_at каждой записанной сделки - время flush, а изменение цели TP тоже
+    сдвигает updated_at сделки: по нему дашборд догружает только изменившиеся строки.
+    """
+
+    def __init__(self):
+        self.exposure = PortfolioExposure()
+        self.clear()
+
+    def clear(self):
+        """Сбрасывает хранилище в состояние 'не загружено' (без записи грязных изменений)."""
+        self.trades = {}          # trade_id -> dict строки managed_trades
+        self.targets = {}         # trade_id -> [dict строки trade_targets] по tp_index
+        self.entry_orders = {}    # trade_id -> [exchange_order_id] открытых ордеров на вход
+        self.loaded = False
+        self.position_sizes = {}          # symbol -> размер позиции в прошлом цикле (когда догружать исполнения)
+        self._dirty_trades = {}           # trade_id -> set(измененных колонок)
+        self._dirty_targets = {}          # (trade_id, tp_index) -> set(измененных колонок)
+        self._cancelled_entry_orders = {} # trade_id -> [exchange_order_id]
+        self.db_reads = 0
+        self.db_flushes = 0
+        self.exposure.clear()
+
+    # --- Загрузка ---
+    def load(self, conn: sqlite3.Connection = None):
+        """Полная загрузка всех незакрытых сделок (при старте менеджера)."""
+        own_conn = conn is None
+        conn = conn or get_db_connection()
+        try:
+            trades = [dict(r) for r in conn.execute("SELECT * FROM managed_trades WHERE status != 'CLOSED'")]
+            self.trades = {t['id']: t for t in trades}
+            self.targets = {}
+            self.entry_orders = {}
+            self._load_children(conn, list(self.trades))
+            self.exposure.rebuild(trades)
+            self.db_reads += 1
+        finally:
+            if own_conn:
+                conn.close()
+        self.loaded = True
+
+    def load_trade(self, trade_id: int, conn: sqlite3.Connection = None):
+        """Подтягивает одну сделку (например, только что созданную через API)."""
+        own_conn = conn is None
+        conn = conn or get_db_connection()
+        try:
+            row = conn.execute("SELECT * FROM managed_trades WHERE id = ?", (trade_id,)).fetchone()
+            if row is None or row['status'] == 'CLOSED':
+                return None
+            self.trades[trade_id] = dict(row)
+            self._load_children(conn, [trade_id])
+            self.exposure.upsert(self.trades[trade_id])
+            publish_trade(self.trades[trade_id], ('created',))
+            self.db_reads += 1
+        finally:
+            if own_conn:
+                conn.close()
+        return self.trades[trade_id]
+
+    def _load_children(self, conn: sqlite3.Connection, trade_ids: list):
+        for trade_id in trade_ids:
+            self.targets[trade_id] = [
+                dict(r) for r in conn.execute(
+                    "SELECT * FROM trade_targets WHERE trade_id = ? ORDER BY tp_index", (trade_id,)
+                )
+            ]
+            self.entry_orders[trade_id] = [
+                r['exchange_order_id'] for r in conn.execute(
+                    "SELECT exchange_order_id FROM entry_orders WHERE trade_id = ? AND status = 'open'", (trade_id,)
+                )
+            ]
+
+    @classmethod
+    def for_trade(cls, trade: dict) -> "TradeStore":
+        """Временное хранилище на одну сделку - для вызовов reconcile_and_manage вне цикла менеджера."""
+        store = cls()
+        store.trades[trade['id']] = trade
+        conn = get_db_connection()
+        try:
+            store._load_children(conn, [trade['id']])
+        finally:
+            conn.close()
+        return store
+
+    # --- Чтение ---
+    def get(self, trade_id: int):
+        return self.trades.get(trade_id)
+
+    def open_trades(self) -> list:
+        return [t for t in self.trades.values() if t['status'] != 'CLOSED']
+
+    def get_targets(self, trade_id: int) -> list:
+        return self.targets.get(trade_id, [])
+
+    def open_entry_orders(self, trade_id: int) -> list:
+        return list(self.entry_orders.get(trade_id, []))
+
+    # --- Изменения (помечаются грязными) ---
+    def update_trade(self, trade_id: int, **fields):
+        trade = self.trades[trade_id]
+        trade.update(fields)
+        self._dirty_trades.setdefault(trade_id, set()).update(fields)
+        if not _EXPOSURE_FIELDS.isdisjoint(fields):
+            self.exposure.upsert(trade)
+        if not _FEED_FIELDS.isdisjoint(fields):
+            publish_trade(trade, _FEED_FIELDS.intersection(fields))
+
+    def update_target(self, trade_id: int, tp_index: int, **fields):
+        for target in self.targets.get(trade_id, []):
+            if target['tp_index'] == tp_index:
+                target.update(fields)
+                self._dirty_targets.setdefault((trade_id, tp_index), set()).update(fields)
+                if trade_id in self.trades:
+                    self._dirty_trades.setdefault(trade_id, set()).add('updated_at')
+                return
+        raise KeyError(f"Target {tp_index} of trade {trade_id} is not loaded")
+
+    def add_entry_orders(self, trade_id: int, order_ids: list):
+        """Регистрирует уже записанные в БД ордера на вход."""
+        if trade_id in self.trades:
+            self.entry_orders.setdefault(trade_id, []).extend(order_ids)
+
+    def cancel_entry_orders(self, trade_id: int, order_ids: list):
+        """
+        Помечает отмененными ордера на вход, отмену которых подтвердила биржа.
+        Остальные остаются открытыми в учете, чтобы отмену можно было повторить.
+        """
+        if not order_ids:
+            return
+        cancelled = set(order_ids)
+        self.entry_orders[trade_id] = [o for o in self.entry_orders.get(trade_id, []) if o not in cancelled]
+        self._cancelled_entry_orders.setdefault(trade_id, []).extend(order_ids)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._dirty_trades or self._dirty_targets or self._cancelled_entry_orders)
+
+    # --- Запись ---
+    def flush(self, conn: sqlite3.Connection = None) -> int:
+        """
+        Записывает все грязные изменения одной транзакцией и выгружает закрытые сделки.
+        При ошибке флаги не сбрасываются - изменения будут повторены в следующем цикле.
+        Возвращает количество записанных строк.
+        """
+        if not self.dirty:
+            return 0
+
+        own_conn = conn is None
+        conn = conn or get_db_connection()
+        written = 0
+        now_utc = datetime.now(timezone.utc).isoformat(timespec='microseconds')
+        pnl_day = trading_day()
+        closed_pnl = []
+        try:
+            with timed_transaction(conn, _FLUSH_COMMIT_SECONDS):
+                # Группируем по набору колонок, чтобы писать через executemany
+                trade_batches = {}
+                for trade_id, fields in self._dirty_trades.items():
+                    trade = self.trades[trade_id]
+                    trade['updated_at'] = now_utc
+                    columns = tuple(sorted(fields | {'updated_at'}))
+                    trade_batches.setdefault(columns, []).append(
+                        tuple(trade[c] for c in columns) + (trade_id,)
+                    )
+                for columns, rows in trade_batches.items():
+                    assignments = ", ".join(f"{c}=?" for c in columns)
+                    conn.executemany(f"UPDATE managed_trades SET {assignments} WHERE id=?", rows)
+                    written += len(rows)
+                # Закрытие сделки, ее вклад в статистику и в дневной PnL - в одной транзакции.
+                # record_closed_trade учитывает сделку один раз, поэтому и дневной PnL не задваивается
+                for trade_id, fields in self._dirty_trades.items():
+                    trade = self.trades[trade_id]
+                    if 'status' in fields and trade['status'] == 'CLOSED' and record_closed_trade(conn, trade):
+                        if trade.get('realized_pnl') is not None:
+                            record_daily_pnl(conn, trade['realized_pnl'], pnl_day)
+                            closed_pnl.append(trade['realized_pnl'])
+
+                target_batches = {}
+                for (trade_id, tp_index), fields in self._dirty_targets.items():
+                    columns = tuple(sorted(fields))
+                    target = next(t for t in self.targets[trade_id] if t['tp_index'] == tp_index)
+                    target_batches.setdefault(columns, []).append(
+                        tuple(target[c] for c in columns) + (trade_id, tp_index)
+                    )
+                for columns, rows in target_batches.items():
+                    assignments = ", ".join(f"{c}=?" for c in columns)
+                    conn.executemany(f"UPDATE trade_targets SET {assignments} WHERE trade_id=? AND tp_index=?", rows)
+                    written += len(rows)
+                # Исполнения целей и стопа могли прийти раньше, чем записаны id их ордеров
+                if any('order_id' in f for f in self._dirty_targets.values()) or \
+                        any('exchange_sl_order_id' in f for f in self._dirty_trades.values()):
+                    attribute_fills(conn)
+
+                cancelled = [
+                    (trade_id, order_id)
+                    for trade_id, order_ids in self._cancelled_entry_orders.items()
+                    for order_id in order_ids
+                ]
+                conn.executemany(
+                    "UPDATE entry_orders SET status='cancelled' WHERE trade_id=? AND exchange_order_id=? AND status='open'",
+                    cancelled
+                )
+                written += len(cancelled)
+            # Гейт просадки видит PnL только после COMMIT: при сбое flush память и БД не расходятся
+            for pnl in closed_pnl:
+                apply_committed_pnl(pnl, pnl_day)
+        finally:
+            if own_conn:
+                conn.close()
+
+        self._dirty_trades.clear()
+        self._dirty_targets.clear()
+        self._cancelled_entry_orders.clear()
+        self.db_flushes += 1
+
+        for trade_id in [tid for tid, t in self.trades.items() if t['status'] == 'CLOSED']:
+            self.trades.pop(trade_id, None)
+            self.targets.pop(trade_id, None)
+            self.entry_orders.pop(trade_id, None)
+        return written
+
+
+# Хранилище процесса: им владеет position_manager_loop, а API сообщает ему о новых сделках.
+TRADE_STORE = TradeStore()